@@ -0,0 +1,1327 @@
+import asyncio
+import unittest
+import unittest.mock
+import tempfile
+import threading
+import json
+import multiprocessing
+import os
+import time
+
+from pydb.database import Database
+from pydb.aio import AsyncDatabase
+from pydb.cache import QueryCache
+from pydb.columnar import ColumnStore
+from pydb.vectorized import filter_positions, filter_rows, numpy
+from pydb.predicate import And, Col, Not, Or
+from pydb.index import SortedIndex
+from pydb.storage import BinaryStorage, DirectoryStorage, JSONStorage, convert
+from pydb.locks import RWLock
+from pydb.parallel import ParallelScanner
+
+# Test cases for the Database class
+# Unlike the Table test cases, every test case here gets its own
+#  database file in a temporary directory, so the tests are
+#  independent of each other.
+
+USERS = {
+    'user_id': {'type': int(), 'auto_inc': True, 'PK': True},
+    'username': {'type': str()}
+}
+
+POSTS = {
+    'post_id': {'type': int(), 'auto_inc': True, 'PK': True},
+    'user_id': {
+        'type': int(), 'FK': {
+            'table': 'users',
+            'column': 'user_id',
+            'on_update': 'cascade',
+            'on_delete': 'cascade'
+        }
+    },
+    'content': {'type': str()}
+}
+
+COMMENTS = {
+    'comment_id': {'type': int(), 'auto_inc': True, 'PK': True},
+    'post_id': {
+        'type': int(), 'nullable': True, 'FK': {
+            'table': 'posts',
+            'column': 'post_id',
+            'on_update': 'cascade',
+            'on_delete': 'cascade'
+        }
+    },
+    'comment': {'type': str()}
+}
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'db.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_file(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+
+class JournalTestCase(DatabaseTestCase):
+    def test_insert_goes_to_journal(self):
+        # Inserts are appended to the journal, the snapshot is left alone
+        db = Database(self.path, journal=True)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        self.assertEqual(self.read_file()['users']['data'], [])
+        self.assertEqual(db.journal.pending, 1)
+        self.assertEqual(list(db.select('users', [], {'user_id': 1})), [[1, 'user1']])
+
+    def test_checkpoint_folds_journal(self):
+        db = Database(self.path, journal=True, checkpoint_interval=2)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        db.insert_into_table('users', [2, 'user2'])
+        self.assertEqual(self.read_file()['users']['data'], [[1, 'user1'], [2, 'user2']])
+        self.assertEqual(db.journal.pending, 0)
+
+    def test_replay_after_crash(self):
+        # Never closing the database simulates a crash
+        db = Database(self.path, journal=True)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        db.insert_into_table('users', [2, 'user2'])
+        db.update_table('users', ['username'], ['renamed'], 'user_id', 1)
+        db.delete_from_table('users', 'user_id', 2)
+        db.journal.close()
+
+        db = Database(self.path, journal=True)
+        db.load()
+        self.assertEqual(db.get_table('users').data, [[1, 'renamed']])
+        self.assertEqual(self.read_file()['users']['data'], [[1, 'renamed']])
+
+
+    def test_crash_before_truncate(self):
+        for storage in ('json', 'binary', 'directory'):
+            path = os.path.join(self.tmp.name, f'crash.{storage}')
+            db = Database(path, journal=True, storage=storage)
+            db.add_table('users', USERS)
+            db.insert_into_table('users', [1, 'a'])
+            db.insert_into_table('users', [2, 'b'])
+            db.delete_from_table('users', 'user_id', 1)
+            # The snapshot is written, then the process dies before the
+            #  journal is emptied
+            with unittest.mock.patch.object(db.journal, 'truncate', side_effect=OSError):
+                with self.assertRaises(OSError):
+                    db.checkpoint()
+            db.journal.close()
+
+            db = Database(path, journal=True, storage=storage)
+            db.load()
+            self.assertEqual(db.get_table('users').data, [[2, 'b']], storage)
+            # New records carry on after the ones already in the snapshot
+            db.insert_into_table('users', [3, 'c'])
+            db.journal.close()
+            db = Database(path, journal=True, storage=storage)
+            db.load()
+            self.assertEqual(db.get_table('users').data, [[2, 'b'], [3, 'c']], storage)
+
+class InMemoryTestCase(DatabaseTestCase):
+    def test_changes_stay_in_memory_until_commit(self):
+        db = Database(self.path, in_memory=True)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        self.assertTrue(db.get_table('users').dirty)
+        self.assertEqual(self.read_file()['users']['data'], [])
+        self.assertEqual(list(db.select('users', [], {'user_id': 1})), [[1, 'user1']])
+
+        db.commit()
+        self.assertFalse(db.get_table('users').dirty)
+        self.assertEqual(self.read_file()['users']['data'], [[1, 'user1']])
+
+    def test_only_dirty_tables_are_written(self):
+        db = Database(self.path, in_memory=True)
+        db.add_table('users', USERS)
+        db.add_table('posts', POSTS)
+        db.insert_into_table('users', [1, 'user1'])
+        db.get_table('posts').data.append([0, 1, 'not recorded'])
+        db.save()
+        self.assertEqual(self.read_file()['posts']['data'], [])
+
+    def test_flush_rows_threshold(self):
+        db = Database(self.path, in_memory=True, flush_rows=2)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        self.assertEqual(self.read_file()['users']['data'], [])
+        db.insert_into_table('users', [2, 'user2'])
+        self.assertEqual(len(self.read_file()['users']['data']), 2)
+
+
+    def test_flush_interval_timer(self):
+        db = Database(self.path, in_memory=True, flush_interval=0.2)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        db.insert_into_table('users', [2, 'user2'])
+        self.assertEqual(self.read_file()['users']['data'], [])
+        # No further change is needed for the pending ones to be written
+        deadline = time.monotonic() + 5
+        while not self.read_file()['users']['data'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(self.read_file()['users']['data']), 2)
+        self.assertFalse(db.get_table('users').dirty)
+
+        db.insert_into_table('users', [3, 'user3'])
+        db.close()
+        self.assertIsNone(db._flush_timer)
+        self.assertEqual(len(self.read_file()['users']['data']), 3)
+
+class TransactionTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        self.db.insert_into_table('posts', [1, 'hello'])
+
+    def test_commit(self):
+        with self.db.transaction():
+            self.db.insert_into_table('users', [3, 'user3'])
+            self.db.update_table('users', ['username'], ['renamed'], 'user_id', 1)
+            # Reads see the changes, the file doesn't until the end
+            self.assertEqual(list(self.db.select('users', ['username'], {'user_id': 3})), [['user3']])
+            self.assertEqual(len(self.read_file()['users']['data']), 2)
+        self.assertEqual(self.read_file()['users']['data'], [[1, 'renamed'], [2, 'user2'], [3, 'user3']])
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.insert_into_table('users', [3, 'user3'])
+                # Cascades to posts
+                self.db.delete_from_table('users', 'user_id', 1)
+                raise RuntimeError
+        self.assertEqual(self.db.get_table('users').data, [[1, 'user1'], [2, 'user2']])
+        self.assertEqual(self.db.get_table('posts').data, [[0, 1, 'hello']])
+        self.assertEqual(self.read_file()['posts']['data'], [[0, 1, 'hello']])
+        # The indexes are back in step with the rows
+        self.db.insert_into_table('users', [3, 'user3'])
+        self.assertEqual(list(self.db.select('users', [], {'user_id': 3})), [[3, 'user3']])
+        self.assertEqual(self.read_file()['users']['data'], [[1, 'user1'], [2, 'user2'], [3, 'user3']])
+
+    def test_rollback_keeps_indexes(self):
+        name = self.db.create_index('users', 'username')
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.insert_into_table('users', [3, 'user3'])
+                self.db.drop_index('users', name)
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.delete_from_table('users', 'user_id', 2)
+                self.db.create_index('users', 'username', unique=True, index_name='by_name')
+        table = self.db.get_table('users')
+        self.assertEqual(table.data, [[1, 'user1'], [2, 'user2']])
+        self.assertEqual(list(table.indexes), [name])
+        self.assertEqual(table.indexes[name].lookup('user2'), [1])
+        self.assertEqual(self.read_file()['users']['indexes'], {name: {'columns': ['username'], 'unique': False}})
+
+    def test_rollback_journal(self):
+        db = Database(os.path.join(self.tmp.name, 'journal.json'), journal=True)
+        db.add_table('users', USERS)
+        db.insert_into_table('users', [1, 'user1'])
+        with self.assertRaises(ValueError):
+            with db.transaction():
+                db.insert_into_table('users', [2, 'user2'])
+                db.insert_into_table('users', [1, 'duplicate'])
+        self.assertEqual(db.journal.pending, 1)
+        self.assertEqual(db.get_table('users').data, [[1, 'user1']])
+        self.assertTrue(db.get_table('users').dirty)
+
+    def test_restrictions(self):
+        with self.db.transaction():
+            with self.assertRaises(ValueError):
+                with self.db.transaction():
+                    pass
+            with self.assertRaises(ValueError):
+                self.db.add_table('comments', COMMENTS)
+            with self.assertRaises(ValueError):
+                self.db.save()
+
+    def test_atomic_write(self):
+        storage = JSONStorage()
+        before = self.read_file()
+        with self.assertRaises(TypeError):
+            storage.write(self.path, {'users': {'data': [[object()]]}})
+        self.assertEqual(self.read_file(), before)
+        self.assertEqual(os.listdir(self.tmp.name), ['db.json'])
+
+
+class ThreadingTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.add_table('scores', PredicateTestCase.SCORES)
+
+    def run_threads(self, target, count):
+        threads = [threading.Thread(target=target, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_inserts(self):
+        def insert(n):
+            for user_id in range(n * 25, (n + 1) * 25):
+                self.db.insert_into_table('users', [user_id, f'user{user_id}'])
+                self.db.insert_into_table('scores', [user_id, 'a', 1.0])
+
+        self.run_threads(insert, 4)
+        self.assertEqual(sorted(row[0] for row in self.db.select('users')), list(range(100)))
+        self.assertEqual(len(self.read_file()['users']['data']), 100)
+        self.assertEqual(len(self.read_file()['scores']['data']), 100)
+
+    def test_unrelated_tables(self):
+        self.db.insert_into_table('users', [1, 'user1'])
+        done = threading.Event()
+        with self.db.table_locks['users'].write_locked():
+            # scores is unrelated to users, posts references it
+            threading.Thread(target=lambda: (self.db.insert_into_table('scores', [1, 'a', 1.0]), done.set())).start()
+            self.assertTrue(done.wait(5))
+            done.clear()
+            threading.Thread(target=lambda: (list(self.db.select('posts')), done.set())).start()
+            self.assertTrue(done.wait(5))
+            done.clear()
+            threading.Thread(target=lambda: (self.db.insert_into_table('posts', [1, 'a']), done.set())).start()
+            self.assertFalse(done.wait(0.2))
+        self.assertTrue(done.wait(5))
+
+    def test_rwlock(self):
+        lock = RWLock()
+        events = []
+        lock.acquire_read()
+        reader = threading.Thread(target=lambda: (lock.acquire_read(), events.append('read'), lock.release_read()))
+        reader.start()
+        reader.join(5)
+        self.assertEqual(events, ['read'])
+
+        writer = threading.Thread(target=lambda: (lock.acquire_write(), events.append('write'), lock.release_write()))
+        writer.start()
+        writer.join(0.2)
+        self.assertEqual(events, ['read'])
+        with self.assertRaises(RuntimeError):
+            lock.acquire_write()
+        lock.release_read()
+        writer.join(5)
+        self.assertEqual(events, ['read', 'write'])
+
+    def test_cursor_reads_snapshot(self):
+        db = Database(os.path.join(self.tmp.name, 'memory.json'), in_memory=True)
+        db.add_table('users', USERS)
+        db.insert_many('users', [[n, f'user{n}'] for n in range(5)])
+        cursor = db.select('users')
+        self.assertEqual(cursor.fetchmany(2), [[0, 'user0'], [1, 'user1']])
+        db.delete_from_table('users', 'user_id', 3)
+        self.assertEqual(cursor.fetchall(), [[2, 'user2'], [3, 'user3'], [4, 'user4']])
+        # Changing the rows of a cursor while iterating it doesn't block
+        for row in db.select('users'):
+            db.update_table('users', ['username'], [row[1].upper()], 'user_id', row[0])
+        self.assertEqual([row[1] for row in db.select('users')], ['USER0', 'USER1', 'USER2', 'USER4'])
+
+    def test_join_releases_locks(self):
+        db = Database(os.path.join(self.tmp.name, 'memory.json'), in_memory=True)
+        db.add_table('users', USERS)
+        db.add_table('posts', POSTS)
+        db.insert_many('users', [[n, f'user{n}'] for n in range(3)])
+        db.insert_many('posts', [[n, n, f'post{n}'] for n in range(3)])
+        # Changing a table while reading a join of it
+        for row in db.join_tables('users', 'posts', on={'user_id': 'user_id'}):
+            db.update_table('users', ['username'], [row[1].upper()], 'user_id', row[0])
+        self.assertEqual([row[1] for row in db.select('users')], ['USER0', 'USER1', 'USER2'])
+
+        # A join left unfinished doesn't block writers in other threads
+        joined = iter(db.join_tables('users', 'posts', on={'user_id': 'user_id'}))
+        self.assertEqual(next(joined), [0, 'USER0', 0, 'post0'])
+        writer = threading.Thread(target=db.insert_into_table, args=('users', [3, 'user3']))
+        writer.start()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(len(list(db.select('users'))), 4)
+        self.assertEqual(len(list(joined)), 2)
+
+    def test_concurrent_select_and_insert(self):
+        db = Database(os.path.join(self.tmp.name, 'memory.json'), in_memory=True)
+        db.add_table('users', USERS)
+        db.insert_many('users', [[n, f'user{n}'] for n in range(3000)])
+        counts, errors = [], []
+
+        def read():
+            try:
+                counts.append(len(list(db.select('users'))))
+            except Exception as error:
+                errors.append(error)
+
+        readers = [threading.Thread(target=read) for _ in range(6)]
+        for thread in readers:
+            thread.start()
+        for n in range(3000, 3030):
+            db.insert_into_table('users', [n, f'user{n}'])
+        for thread in readers:
+            thread.join(30)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(counts), 6)
+        self.assertTrue(all(3000 <= count <= 3030 for count in counts))
+
+def insert_users(path, first, count):
+    db = Database(path, shared=True)
+    db.load()
+    for user_id in range(first, first + count):
+        db.insert_into_table('users', [user_id, f'user{user_id}'])
+
+
+class SharedTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, shared=True)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+
+    def test_stale_instance_reloads(self):
+        other = Database(self.path, shared=True)
+        other.load()
+        self.db.insert_into_table('users', [1, 'user1'])
+        self.assertEqual(list(other.select('users')), [[1, 'user1']])
+        self.assertIn(1, other.get_table('users').pk_index)
+
+        # The foreign key is checked against the row the other instance added
+        other.insert_into_table('posts', [1, 1, 'hello'])
+        self.assertEqual(list(self.db.select('posts')), [[1, 1, 'hello']])
+        self.db.delete_from_table('users', 'user_id', 1)
+        self.assertEqual(list(other.select('posts')), [])
+
+        self.db.remove_table('posts')
+        self.assertEqual(other.list_tables(), ['users'])
+
+    def test_no_lost_writes(self):
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=insert_users, args=(self.path, n * 20, 20)) for n in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(sorted(row[0] for row in self.db.select('users')), list(range(80)))
+        self.assertEqual(len(self.read_file()['users']['data']), 80)
+
+    def test_rejects_journal(self):
+        with self.assertRaises(ValueError):
+            Database(self.path, shared=True, journal=True)
+
+
+class AsyncDatabaseTestCase(DatabaseTestCase, unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_writes_share_flushes(self):
+        saves = []
+        async with AsyncDatabase(self.path) as db:
+            await db.add_table('users', USERS)
+            save = db.db.save
+            db.db.save = lambda: (saves.append(1), save())
+            await asyncio.gather(*(db.insert_into_table('users', [n, f'user{n}']) for n in range(50)))
+            self.assertEqual(len(self.read_file()['users']['data']), 50)
+            self.assertLess(len(saves), 50)
+
+            await db.update_table('users', ['username'], ['first'], 'user_id', 0)
+            await db.delete_from_table('users', 'user_id', 1)
+            self.assertEqual(await db.select('users', condition={'user_id': 0}), [[0, 'first']])
+            self.assertEqual(len(await db.select('users')), 49)
+        self.assertIsNone(db.db)
+        self.assertEqual(len(self.read_file()['users']['data']), 49)
+
+    async def test_concurrent_select_and_insert(self):
+        async with AsyncDatabase(self.path) as db:
+            await db.add_table('users', USERS)
+            await db.insert_many('users', [[n, f'user{n}'] for n in range(3000)])
+            results = await asyncio.gather(
+                *(db.select('users') for _ in range(6)),
+                *(db.insert_into_table('users', [n, f'user{n}']) for n in range(3000, 3030)))
+            for rows in results[:6]:
+                self.assertTrue(3000 <= len(rows) <= 3030)
+                self.assertEqual([row[0] for row in rows], list(range(len(rows))))
+            self.assertEqual(len(await db.select('users')), 3030)
+
+    async def test_join(self):
+        async with AsyncDatabase(self.path) as db:
+            await db.add_table('users', USERS)
+            await db.add_table('posts', POSTS)
+            await db.insert_into_table('users', [1, 'user1'])
+            await db.insert_into_table('posts', [1, 1, 'hello'])
+            rows = await db.join_tables('users', 'posts', on={'user_id': 'user_id'})
+            self.assertEqual(rows, [[1, 'user1', 1, 'hello']])
+
+
+class InsertManyTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+
+    def test_insert_many(self):
+        inserted, rejected = self.db.insert_many('users', ([i, f'user{i}'] for i in range(5)))
+        self.assertEqual(inserted, 5)
+        self.assertEqual(rejected, [])
+        self.assertEqual(len(self.read_file()['users']['data']), 5)
+
+    def test_insert_many_reports_rejections(self):
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        inserted, rejected = self.db.insert_many('posts', [
+            [1, 'valid'],
+            [3, 'invalid user'],
+            [0, 1, 'duplicate pk'],
+            ['1', 'wrong type'],
+        ])
+        self.assertEqual(inserted, 1)
+        self.assertEqual([position for position, row, reason in rejected], [1, 2, 3])
+
+    def test_insert_invalid_fk_raises(self):
+        self.db.insert_into_table('users', [1, 'user1'])
+        self.db.insert_into_table('posts', [1, 'valid'])
+        with self.assertRaises(ValueError):
+            self.db.insert_into_table('posts', [2, 'invalid user'])
+        self.assertEqual(self.read_file()['posts']['data'], [[0, 1, 'valid']])
+
+    def test_insert_null_fk(self):
+        self.db.add_table('comments', COMMENTS)
+        self.db.insert_into_table('comments', [None, 'no post'])
+        self.assertEqual(self.db.get_table('comments').data, [[0, None, 'no post']])
+
+    def test_insert_many_duplicates_within_batch(self):
+        inserted, rejected = self.db.insert_many('users', [[1, 'user1'], [1, 'again']])
+        self.assertEqual(inserted, 1)
+        self.assertEqual(rejected[0][0], 1)
+
+
+class PrimaryKeyIndexTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, in_memory=True)
+        self.db.add_table('users', USERS)
+        self.db.insert_many('users', [[i, f'user{i}'] for i in range(5)])
+        self.table = self.db.get_table('users')
+
+    def test_index_follows_deletes(self):
+        self.db.delete_from_table('users', 'user_id', 1)
+        self.assertEqual(self.table.pk_index.lookup(4), [3])
+        self.assertEqual(list(self.db.select('users', [], {'user_id': 4})), [[4, 'user4']])
+        self.assertEqual(list(self.db.select('users', [], {'user_id': 1})), [])
+
+    def test_index_follows_pk_updates(self):
+        self.db.update_table('users', ['user_id'], [10], 'user_id', 2)
+        self.assertNotIn(2, self.table.pk_index)
+        self.assertEqual(list(self.db.select('users', [], {'user_id': 10})), [[10, 'user2']])
+        with self.assertRaises(ValueError):
+            self.db.update_table('users', ['user_id'], [10], 'user_id', 3)
+
+    def test_index_rebuilt_on_load(self):
+        self.db.save()
+        db = Database(self.path)
+        db.load()
+        self.assertEqual(db.get_table('users').pk_index.lookup(3), [3])
+
+
+class SecondaryIndexTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, in_memory=True)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        self.db.insert_many('posts', [[1, 'a'], [2, 'b'], [1, 'c']])
+
+    def test_select_uses_index(self):
+        name = self.db.create_index('posts', 'user_id')
+        index = self.db.get_table('posts').indexes[name]
+        self.assertEqual(index.lookup(1), [0, 2])
+        self.assertEqual(list(self.db.select('posts', [], {'user_id': 1})), [[0, 1, 'a'], [2, 1, 'c']])
+        self.assertEqual(list(self.db.select('posts', [], {'user_id': 1, 'content': 'c'})), [[2, 1, 'c']])
+
+    def test_default_mode_uses_index(self):
+        self.db.save()
+        db = Database(self.path)
+        db.load()
+        name = db.create_index('posts', 'user_id')
+        db.insert_into_table('posts', [2, 'd'])
+        table = db.get_table('posts')
+        with unittest.mock.patch.object(table, 'lookup', wraps=table.lookup) as lookup:
+            self.assertEqual(list(db.select('posts', [], {'user_id': 2})), [[1, 2, 'b'], [3, 2, 'd']])
+        lookup.assert_called_once_with({'user_id': 2})
+        self.assertEqual(table.indexes[name].lookup(2), [1, 3])
+
+    def test_index_follows_cascades(self):
+        name = self.db.create_index('posts', ['user_id'])
+        index = self.db.get_table('posts').indexes[name]
+        self.db.update_table('users', ['user_id'], [5], 'user_id', 1)
+        self.assertEqual(index.lookup(5), [0, 2])
+        self.db.delete_from_table('users', 'user_id', 2)
+        self.assertEqual(index.lookup(2), [])
+        self.assertEqual(index.lookup(5), [0, 1])
+
+    def test_index_follows_deletes(self):
+        self.db.insert_many('posts', [[2, 'd'], [1, 'e'], [2, 'f']])
+        name = self.db.create_index('posts', 'user_id')
+        table = self.db.get_table('posts')
+        self.db.delete_from_table('posts', 'post_id', 1)
+        self.db.delete_from_table('posts', where=Col('content').isin(['a', 'e']))
+        for index in (table.indexes[name], table.pk_index):
+            fresh = type(index)(index.column_positions, index.unique)
+            fresh.build(table.data)
+            self.assertEqual(index.entries, fresh.entries)
+        self.assertEqual(table.indexes[name].lookup(2), [1, 2])
+
+    def test_unique_index(self):
+        self.db.create_index('users', 'username', unique=True)
+        with self.assertRaises(ValueError):
+            self.db.get_table('users').prep_insert_row([3, 'user1'])
+        with self.assertRaises(ValueError):
+            self.db.update_table('users', ['username'], ['user2'], 'user_id', 1)
+        with self.assertRaises(ValueError):
+            self.db.create_index('posts', 'user_id', unique=True)
+
+    def test_index_persists(self):
+        name = self.db.create_index('posts', ['user_id', 'content'])
+        self.db.save()
+        self.assertEqual(self.read_file()['posts']['indexes'][name], {'columns': ['user_id', 'content'], 'unique': False})
+        db = Database(self.path)
+        db.load()
+        self.assertEqual(db.get_table('posts').indexes[name].lookup((1, 'c')), [2])
+
+
+class JoinTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, in_memory=True)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2'], [3, 'user3']])
+        self.db.insert_many('posts', [[1, 'a'], [2, 'b'], [1, 'c']])
+
+    def test_inner_join_on_columns(self):
+        joined = self.db.join_tables('users', 'posts', on={'user_id': 'user_id'})
+        self.assertEqual(sorted(joined), [
+            [1, 'user1', 0, 'a'],
+            [1, 'user1', 2, 'c'],
+            [2, 'user2', 1, 'b'],
+        ])
+
+    def test_left_join_keeps_unmatched_rows(self):
+        joined = self.db.join_tables('users', 'posts', {'username': 'user3'}, on={'user_id': 'user_id'}, how='left')
+        self.assertEqual(joined.fetchall(), [[3, 'user3', None, None]])
+
+    def test_join_builds_on_either_side(self):
+        # posts is larger than users, then smaller once filtered
+        small = self.db.join_tables('posts', 'users', {'content': 'b'}, on={'user_id': 'user_id'}, how='left')
+        self.assertEqual(small.fetchall(), [[1, 2, 'b', 'user2']])
+        large = self.db.join_tables('users', 'posts', on={'user_id': 'user_id'}, how='left')
+        self.assertEqual(len(large.fetchall()), 4)
+
+    def test_join_without_keys(self):
+        # the original behaviour, filter both tables then pair every row
+        joined = self.db.join_tables('users', 'posts', {'user_id': 1})
+        self.assertEqual(joined.fetchall(), [[1, 'user1', 0, 'a'], [1, 'user1', 2, 'c']])
+
+    def test_join_is_lazy_and_not_stored(self):
+        joined = self.db.join_tables('users', 'posts', on={'user_id': 'user_id'})
+        self.assertNotIn(joined.table_name, self.db.list_tables())
+        self.db.insert_into_table('posts', [3, 'd'])
+        self.assertIn([3, 'user3', 3, 'd'], joined.fetchall())
+
+    def test_chained_joins(self):
+        self.db.add_table('likes', {
+            'like_id': {'type': int(), 'auto_inc': True, 'PK': True},
+            'post_id': {'type': int(), 'FK': {'table': 'posts', 'column': 'post_id'}},
+        })
+        self.db.insert_many('likes', [[2], [2], [1]])
+        users_posts = self.db.join_tables('users', 'posts', on={'user_id': 'user_id'})
+        joined = self.db.join_tables(users_posts, 'likes', on={'post_id': 'post_id'})
+        self.assertEqual(sorted(row[-1] for row in joined), [0, 1, 2])
+        self.assertEqual(list(joined.columns.keys()), ['user_id', 'username', 'post_id', 'content', 'like_id'])
+
+    def test_persisted_join(self):
+        table = self.db.join_tables('users', 'posts', {'user_id': 2}, on={'user_id': 'user_id'}, persist=True)
+        self.assertEqual(table.table_name, 'temp_users_posts')
+        self.assertEqual(table.data, [[2, 'user2', 1, 'b']])
+        self.db.close()
+        self.assertNotIn('temp_users_posts', self.read_file())
+
+
+    def test_persisted_join_rejects_rows(self):
+        relation = self.db.join_tables('users', 'posts', on={'user_id': 'user_id'})
+        columns = {'user_id': {'type': int()}, 'score': {'type': int()}}
+        scores = type(relation)('scores', columns, lambda: iter([[1, 10], [2, 'not an int']]))
+        with self.assertRaises(ValueError):
+            self.db.join_tables(scores, 'users', on={'user_id': 'user_id'}, persist=True)
+        self.assertNotIn('temp_scores_users', self.db.list_tables())
+        self.assertNotIn('temp_scores_users', self.read_file())
+
+class CascadeTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.add_table('comments', COMMENTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        self.db.insert_many('posts', [[1, 'a'], [2, 'b'], [1, 'c']])
+        self.db.insert_many('comments', [[0, 'x'], [1, 'y'], [2, 'z'], [2, 'w']])
+
+    def test_fk_graph(self):
+        self.assertEqual(self.db.fk_children['users'], [('posts', 'user_id', 'user_id')])
+        self.assertEqual(self.db.fk_children['posts'], [('comments', 'post_id', 'post_id')])
+        self.db.remove_table('comments')
+        self.assertNotIn('comments', [child[0] for child in self.db.fk_children['posts']])
+
+    def test_delete_cascades_through_every_level(self):
+        self.db.delete_from_table('users', 'user_id', 1)
+        self.assertEqual(self.db.get_table('posts').data, [[1, 2, 'b']])
+        self.assertEqual(self.db.get_table('comments').data, [[1, 1, 'y']])
+        self.assertEqual(self.read_file()['comments']['data'], [[1, 1, 'y']])
+
+    def test_update_cascades_through_every_level(self):
+        self.db.update_table('posts', ['post_id'], [7], 'post_id', 2)
+        self.assertEqual(list(self.db.select('comments', [], {'post_id': 7})), [[2, 7, 'z'], [3, 7, 'w']])
+        self.assertEqual(self.read_file()['comments']['data'][2], [2, 7, 'z'])
+
+    def test_delete_set_null(self):
+        self.db.get_table('comments').columns['post_id']['FK']['on_delete'] = 'set_null'
+        self.db.delete_from_table('posts', 'post_id', 2)
+        self.assertEqual(list(self.db.select('comments', [], {'post_id': None})), [[2, None, 'z'], [3, None, 'w']])
+
+
+class StorageTestCase(DatabaseTestCase):
+    def test_binary_round_trip(self):
+        storage = BinaryStorage()
+        db_data = {
+            'mixed': {
+                'columns': {'a': {'type': 0}},
+                'data': [
+                    [1, 1.5, 'x', None, True, 2 ** 70],
+                    [None, None, 'y\u00e9', 'z', False, 3],
+                    [-3, 0.25, '', 1, None, None]
+                ],
+                'indexes': {'ix': {'columns': ['a'], 'unique': False}}
+            },
+            'empty': {'columns': {'a': {'type': 0}}, 'data': []}
+        }
+        storage.write(self.path, db_data)
+        self.assertEqual(storage.read(self.path), db_data)
+
+    def test_read_single_table(self):
+        db_data = {
+            'users': {'columns': {'posts': {'type': 0}}, 'data': [[1, 'a\n    "posts": ']]},
+            'posts': {'columns': {'users': {'type': 0}}, 'data': [[2, None]], 'indexes': {}},
+            'caf\u00e9': {'columns': {}, 'data': []}
+        }
+        for storage in (JSONStorage(), BinaryStorage()):
+            storage.write(self.path, db_data)
+            for table_name in db_data:
+                self.assertEqual(storage.read_table(self.path, table_name), db_data[table_name])
+            self.assertEqual(storage.read_table(self.path, 'missing'), {})
+
+        # Files in another layout are parsed whole
+        with open(self.path, 'w') as db_file:
+            json.dump(db_data, db_file)
+        self.assertEqual(JSONStorage().read_table(self.path, 'posts'), db_data['posts'])
+
+    def test_read_catalog(self):
+        db_data = {
+            'users': {'data': [[1, 'a\n        "columns": ']], 'columns': {'posts': {'type': 0}}},
+            'posts': {'columns': {'users': {'type': 0}}, 'data': [[2, None]], 'indexes': {'i': {'columns': ['users']}}},
+        }
+        schemas = {name: {key: value for key, value in table.items() if key != 'data'} for name, table in db_data.items()}
+        JSONStorage().write(self.path, db_data)
+        self.assertEqual(JSONStorage().read_catalog(self.path), schemas)
+        with open(self.path, 'w') as db_file:
+            json.dump(db_data, db_file)
+        self.assertEqual(JSONStorage().read_catalog(self.path), db_data)
+
+    def test_lazy_load(self):
+        for storage in ('json', 'binary', 'directory'):
+            path = os.path.join(self.tmp.name, storage)
+            db = Database(path, storage=storage)
+            db.add_table('users', USERS)
+            db.add_table('posts', POSTS)
+            db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+            db.insert_many('posts', [[1, 2, 'hello']])
+
+            db = Database(path, storage=storage, in_memory=True)
+            reads = []
+            read_table = db.storage.read_table
+            db.storage.read_table = lambda *args: (reads.append(args[1]), read_table(*args))[1]
+            db.load()
+            self.assertEqual(reads, [])
+            self.assertEqual(list(db.select('users', condition={'user_id': 2})), [[2, 'user2']])
+            self.assertEqual(reads, ['users'])
+            with self.assertRaises(ValueError):
+                db.insert_into_table('posts', [2, 3, 'no such user'])
+            self.assertEqual(reads, ['users', 'posts'])
+
+    def test_convert(self):
+        db = Database(self.path)
+        db.add_table('users', USERS)
+        db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        binary_path = os.path.join(self.tmp.name, 'db.bin')
+        convert(self.path, binary_path)
+
+        db = Database(binary_path, storage='binary')
+        db.load()
+        self.assertEqual(list(db.select('users', [], {'user_id': 2})), [[2, 'user2']])
+
+    def test_binary_database(self):
+        self.path = os.path.join(self.tmp.name, 'db.bin')
+        db = Database(self.path, storage='binary')
+        db.add_table('users', USERS)
+        db.add_table('posts', POSTS)
+        db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        db.insert_into_table('posts', [2, 'hello'])
+        db.delete_from_table('users', 'user_id', 1)
+
+        db = Database(self.path, storage='binary')
+        db.load()
+        self.assertEqual(db.get_table('users').data, [[2, 'user2']])
+        self.assertEqual(db.get_table('posts').data, [[0, 2, 'hello']])
+
+    def test_unknown_storage(self):
+        with self.assertRaises(ValueError):
+            Database(self.path, storage='xml')
+
+
+class DirectoryStorageTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tmp.name, 'db')
+        self.db = Database(self.path, storage=DirectoryStorage(partition_rows=2))
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2'], [3, 'user3'], [4, 'user4'], [5, 'user5']])
+
+    def partition(self, table_name, partition):
+        with open(os.path.join(self.path, table_name, f'{partition}.json'), 'r') as f:
+            return json.load(f)
+
+    def test_layout(self):
+        with open(os.path.join(self.path, 'catalog.json'), 'r') as f:
+            catalog = json.load(f)
+        self.assertEqual(sorted(catalog['tables']), ['posts', 'users'])
+        self.assertNotIn('data', catalog['tables']['users'])
+        self.assertEqual(self.partition('users', 0), [[1, 'user1'], [2, 'user2']])
+        self.assertEqual(self.partition('users', 2), [[5, 'user5']])
+        self.assertEqual(self.partition('posts', 0), [])
+
+    def test_update_rewrites_only_its_partition(self):
+        first = os.path.join(self.path, 'users', '0.json')
+        os.utime(first, (0, 0))
+        self.db.update_table('users', ['username'], ['changed'], 'user_id', 3)
+        self.assertEqual(self.partition('users', 1), [[3, 'changed'], [4, 'user4']])
+        self.assertEqual(os.path.getmtime(first), 0)
+
+    def test_delete_removes_empty_partitions(self):
+        self.db.delete_from_table('users', 'user_id', 2)
+        self.assertEqual(self.partition('users', 0), [[1, 'user1'], [3, 'user3']])
+        self.assertEqual(self.partition('users', 1), [[4, 'user4'], [5, 'user5']])
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'users', '2.json')))
+
+    def test_load(self):
+        self.db.insert_into_table('posts', [4, 'hello'])
+        self.db.create_index('users', 'username')
+        db = Database(self.path, storage='directory')
+        db.load()
+        self.assertEqual(len(db.get_table('users').data), 5)
+        self.assertEqual(list(db.select('posts', [], {'user_id': 4})), [[0, 4, 'hello']])
+        self.assertEqual(list(db.get_table('users').indexes), ['users_username_idx'])
+
+    def test_tables_lock_separately(self):
+        storage = self.db.storage
+        held, release, events = threading.Event(), threading.Event(), []
+
+        def hold():
+            with storage.locked(['users']):
+                held.set()
+                release.wait(5)
+
+        def write_all():
+            with storage.locked():
+                events.append('all')
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait(5)
+        # Writing another table doesn't wait for the users table
+        writer = threading.Thread(target=self.db.insert_into_table, args=('posts', [1, 'hello']))
+        writer.start()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        # Writing the whole database does
+        whole = threading.Thread(target=write_all)
+        whole.start()
+        whole.join(0.2)
+        self.assertEqual(events, [])
+        release.set()
+        holder.join(5)
+        whole.join(5)
+        self.assertEqual(events, ['all'])
+        self.assertEqual(self.partition('posts', 0), [[0, 1, 'hello']])
+
+    def test_remove_table(self):
+        self.db.remove_table('posts')
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'posts')))
+        self.assertEqual(DirectoryStorage().read_catalog(self.path).keys(), {'users'})
+
+
+class ColumnarTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, columnar=True)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.add_table('comments', COMMENTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        self.db.insert_many('posts', [[1, 'a'], [2, 'b'], [1, 'c']])
+        self.db.insert_many('comments', [[0, 'x'], [None, 'y'], [2, 'z']])
+
+    def test_column_types(self):
+        columns = self.db.get_table('comments').data.columns
+        self.assertEqual(columns[0].values.typecode, 'q')
+        self.assertIsNotNone(columns[1].nulls)
+        self.assertEqual(columns[2].codes.typecode, 'i')
+
+    def test_row_views(self):
+        data = self.db.get_table('comments').data
+        self.assertEqual(data, [[0, 0, 'x'], [1, None, 'y'], [2, 2, 'z']])
+        row = data[-1]
+        row[2] = 'changed'
+        self.assertEqual(data[2], [2, 2, 'changed'])
+        self.assertEqual(row.copy(), [2, 2, 'changed'])
+        self.assertEqual(data.pop(0), [0, 0, 'x'])
+        self.assertEqual(len(data), 2)
+
+    def test_fallback_to_objects(self):
+        store = ColumnStore({'a': {'type': int()}}, [[1], [2]])
+        store.append([2 ** 70])
+        store[0][0] = True
+        self.assertIsInstance(store.columns[0].values, list)
+        self.assertEqual(store, [[True], [2], [2 ** 70]])
+
+    def test_find(self):
+        store = ColumnStore({'a': {'type': int(), 'nullable': True}}, [[256], [1], [None], [256], [0]])
+        self.assertEqual(store.find(0, 256), [0, 3])
+        self.assertEqual(store.find(0, 0), [4])
+        self.assertEqual(store.find(0, None), [2])
+
+    def test_operations(self):
+        self.db.update_table('users', ['username'], ['renamed'], 'user_id', 2)
+        self.assertEqual(list(self.db.select('users', [], {'username': 'renamed'})), [[2, 'renamed']])
+        self.db.delete_from_table('users', 'user_id', 1)
+        self.assertEqual(self.db.get_table('posts').data, [[1, 2, 'b']])
+        self.assertEqual(self.db.get_table('comments').data, [[1, None, 'y']])
+        self.assertEqual(self.read_file()['comments']['data'], [[1, None, 'y']])
+
+        db = Database(self.path, columnar=True)
+        db.load()
+        self.assertEqual(list(db.select('comments', [], {'post_id': None})), [[1, None, 'y']])
+        self.assertEqual(list(db.select('posts', [], {'content': 'b'})), [[1, 2, 'b']])
+
+
+class TupleRowsTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, tuple_rows=True)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.insert_many('users', [[1, 'user1'], [2, 'user2']])
+        self.db.insert_many('posts', [[1, 1, 'a'], [2, 2, 'b']])
+
+    def test_changes_copy_rows(self):
+        users = self.db.get_table('users')
+        before = users.data[0]
+        self.db.update_table('users', ['username'], ['renamed'], 'user_id', 1)
+        self.assertEqual(before, (1, 'user1'))
+        self.assertEqual(users.data, [(1, 'renamed'), (2, 'user2')])
+
+        # The cascade replaces the child rows as well
+        self.db.update_table('users', ['user_id'], [3], 'user_id', 1)
+        self.assertEqual(self.db.get_table('posts').data, [(1, 3, 'a'), (2, 2, 'b')])
+        self.assertEqual(list(self.db.select('posts', condition={'user_id': 3})), [[1, 3, 'a']])
+
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.transaction():
+                self.db.delete_from_table('users', 'user_id', 2)
+                1 / 0
+        self.assertEqual(users.data, [(3, 'renamed'), (2, 'user2')])
+        self.assertEqual(self.read_file()['posts']['data'], [[1, 3, 'a'], [2, 2, 'b']])
+
+    def test_load(self):
+        db = Database(self.path, tuple_rows=True)
+        db.load()
+        self.assertEqual(db.get_table('users').data, [(1, 'user1'), (2, 'user2')])
+        with self.assertRaises(ValueError):
+            Database(self.path, tuple_rows=True, columnar=True)
+
+
+class VectorizedTestCase(unittest.TestCase):
+    COLUMNS = {
+        'a': {'type': int(), 'nullable': True},
+        'b': {'type': float()},
+        'c': {'type': str(), 'nullable': True},
+        'd': {'type': bool()}
+    }
+    ROWS = [[1, 0.5, 'x', True], [None, 1.5, None, False], [1, 1.5, 'y', True], [2, 0.5, 'x', False]]
+
+    def check(self, conditions):
+        store = ColumnStore(self.COLUMNS, self.ROWS)
+        expected = [position for position, row in enumerate(self.ROWS)
+                    if all(row[column] == value for column, value in conditions)]
+        self.assertEqual(filter_positions(store, conditions), expected)
+        rows = filter_rows(self.ROWS, [column for column, value in conditions], [value for column, value in conditions])
+        self.assertEqual(rows, [self.ROWS[position] for position in expected])
+
+    def test_single_column(self):
+        for conditions in ([(0, 1)], [(0, None)], [(1, 1.5)], [(2, 'x')], [(2, None)], [(2, 'missing')], [(3, True)], [(0, 2 ** 70)]):
+            self.check(conditions)
+
+    def test_many_columns(self):
+        for conditions in ([(0, 1), (2, 'y')], [(3, False), (1, 0.5)], [(2, 'x'), (1, 0.5), (0, 2)], [(0, 1), (0, 2)]):
+            self.check(conditions)
+
+    def test_select_matches_row_layout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results = []
+            for columnar in (False, True):
+                db = Database(os.path.join(tmp, f'{columnar}.json'), columnar=columnar)
+                db.add_table('t', self.COLUMNS)
+                db.insert_many('t', self.ROWS)
+                results.append([list(db.select('t', [], {'a': 1})), list(db.select('t', [], {'c': 'x', 'b': 0.5}))])
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[1][1], [[1, 0.5, 'x', True], [2, 0.5, 'x', False]])
+
+
+class ParallelTestCase(DatabaseTestCase):
+    def databases(self):
+        for workers in (None, 2):
+            db = Database(os.path.join(self.tmp.name, f'{workers}.json'), parallel_workers=workers, parallel_min_rows=10)
+            db.add_table('users', USERS)
+            db.add_table('posts', POSTS)
+            db.insert_many('users', [[n, f'user{n % 7}'] for n in range(60)])
+            db.insert_many('posts', [[n, n % 40, f'post{n}'] for n in range(90)])
+            yield db
+            db.close()
+
+    def test_same_results_as_serial(self):
+        results = []
+        for db in self.databases():
+            results.append([
+                list(db.select('users', condition=Col('username').isin(['user1', 'user3']))),
+                list(db.select('posts', condition=Col('user_id') < 20, order_by='user_id', descending=True)),
+                list(db.join_tables('users', 'posts', on={'user_id': 'user_id'})),
+                list(db.join_tables('posts', 'users', on={'user_id': 'user_id'}, how='left')),
+                list(db.join_tables('posts', 'users', {'username': 'user3'}, on={'user_id': 'user_id'}, how='left')),
+            ])
+            db.delete_from_table('users', where=Col('user_id') >= 30)
+            results[-1].append(list(db.select('posts')))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0][5]), 70)
+
+
+    def test_serial_while_other_threads_run(self):
+        scanner = ParallelScanner(2, min_rows=10)
+        release = threading.Event()
+        thread = threading.Thread(target=release.wait, args=(5,))
+        thread.start()
+        try:
+            self.assertFalse(scanner.wants(1000))
+        finally:
+            release.set()
+            thread.join(5)
+        self.assertEqual(scanner.wants(1000), threading.active_count() == 1)
+        self.assertFalse(scanner.wants(5))
+
+class QueryCacheTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path, cache_entries=10)
+        self.db.add_table('users', USERS)
+        self.db.add_table('posts', POSTS)
+        self.db.add_table('comments', COMMENTS)
+        self.db.insert_many('users', [[1, 'a'], [2, 'b']])
+        self.db.insert_many('posts', [[1, 1, 'x'], [2, 2, 'y']])
+
+    def test_hits_and_invalidation(self):
+        self.assertEqual(list(self.db.select('users', ['username'], {'user_id': 1})), [['a']])
+        self.assertEqual(list(self.db.select('users', ['username'], {'user_id': 1})), [['a']])
+        self.assertEqual(list(self.db.select('posts')), [[1, 1, 'x'], [2, 2, 'y']])
+        list(self.db.select('comments'))
+        self.assertEqual(self.db.cache.stats()['hits'], 1)
+
+        self.db.update_table('users', ['username'], ['c'], 'user_id', 1)
+        self.assertEqual(self.db.cache.stats()['entries'], 2)
+        self.assertEqual(list(self.db.select('users', ['username'], {'user_id': 1})), [['c']])
+
+        # The cascade reaches posts but not comments
+        self.db.delete_from_table('users', 'user_id', 2)
+        self.assertEqual(list(self.db.select('posts')), [[1, 1, 'x']])
+        list(self.db.select('comments'))
+        self.assertEqual(self.db.cache.stats()['hits'], 2)
+
+    def test_join_and_rollback(self):
+        on = {'user_id': 'user_id'}
+        self.assertEqual(len(list(self.db.join_tables('users', 'posts', on=on))), 2)
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.transaction():
+                self.db.insert_into_table('posts', [3, 1, 'z'])
+                self.assertEqual(len(list(self.db.join_tables('users', 'posts', on=on))), 3)
+                1 / 0
+        self.assertEqual(len(list(self.db.join_tables('users', 'posts', on=on))), 2)
+
+        rows = list(self.db.join_tables('users', 'posts', on=on))
+        rows[0][1] = 'changed'
+        self.assertEqual(list(self.db.join_tables('users', 'posts', on=on))[0][1], 'a')
+
+    def test_eviction(self):
+        cache = QueryCache(max_entries=2)
+        cache.put('a', ['t'], (0,), [[1]])
+        cache.put('b', ['t'], (0,), [[2]])
+        cache.get('a', (0,))
+        cache.put('c', ['u'], (0,), [[3]])
+        self.assertIsNone(cache.get('b', (0,)))
+        self.assertEqual(cache.get('a', (0,)), [[1]])
+        self.assertIsNone(cache.get('a', (1,)))
+        cache.invalidate('u')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+        cache = QueryCache(max_entries=None, max_bytes=1000)
+        cache.put('big', ['t'], (0,), [[n] for n in range(100)])
+        cache.put('small', ['t'], (0,), [[1]])
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.stats()['bytes'], 1000)
+
+
+class PredicateTestCase(DatabaseTestCase):
+    SCORES = {
+        'score_id': {'type': int(), 'PK': True},
+        'name': {'type': str(), 'nullable': True},
+        'score': {'type': float(), 'nullable': True}
+    }
+    ROWS = [[1, 'a', 1.5], [2, 'b', None], [3, None, 7.0], [4, 'd', 10.0], [5, 'a', -2.0]]
+
+    def databases(self):
+        for columnar in (False, True):
+            db = Database(os.path.join(self.tmp.name, f'{columnar}.json'), columnar=columnar)
+            db.add_table('scores', self.SCORES)
+            db.insert_many('scores', self.ROWS)
+            yield db
+
+    def ids(self, db, predicate):
+        return [row[0] for row in db.select('scores', [], predicate)]
+
+    def test_select(self):
+        cases = [
+            (Col('score') > 1.5, [3, 4]),
+            (Col('score') <= 1.5, [1, 5]),
+            (Col('score') != 7.0, [1, 4, 5]),
+            (Col('name') == None, [3]),
+            (Col('name') != None, [1, 2, 4, 5]),
+            (Col('name').isin(['a', 'd', 'x']), [1, 4, 5]),
+            (Col('score').between(0, 7), [1, 3]),
+            (Col('score').is_null(), [2]),
+            ((Col('name') == 'a') & (Col('score') < 0), [5]),
+            (Or(Col('score_id') == 2, Col('score') >= 10, Col('name').is_null()), [2, 3, 4]),
+            (~Col('name').isin(['a']), [2, 3, 4]),
+            (Not(Col('score') > 0), [2, 5]),
+            # ~ matches every row its predicate doesn't, None included
+            (~(Col('score') < 5), [2, 3, 4]),
+            (~Col('score').isin([1.5, 7.0]), [2, 4, 5]),
+            (~(Col('score') < 5) & Col('score').is_not_null(), [3, 4]),
+            # A float equal to an int matches it
+            (Col('score_id').isin([2.0, 4.5, 5]), [2, 5]),
+            (And(Col('score_id') == 4, Col('score') > 0), [4]),
+        ]
+        for db in self.databases():
+            for predicate, expected in cases:
+                self.assertEqual(self.ids(db, predicate), expected, predicate)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed.")
+    def test_masks_match_rows(self):
+        store = ColumnStore(self.SCORES, self.ROWS)
+        slots = {'score_id': 0, 'name': 1, 'score': 2}
+        for predicate in (Col('score_id').isin([2.0, 4.5, 5]), ~Col('score').isin([1.5, 7.0]), ~(Col('score') < 5)):
+            test = predicate.compile(slots)
+            self.assertEqual(numpy.flatnonzero(predicate.mask(store, slots)).tolist(),
+                             [position for position, row in enumerate(self.ROWS) if test(row)], predicate)
+
+    def test_invalid_predicate(self):
+        for db in self.databases():
+            with self.assertRaises(ValueError):
+                db.select('scores', [], Col('missing') == 1)
+            with self.assertRaises(ValueError):
+                db.select('scores', [], Col('name') > 3)
+
+    def test_update_where(self):
+        for db in self.databases():
+            db.update_table('scores', ['name'], ['low'], where=Col('score') < 5)
+            self.assertEqual(self.ids(db, Col('name') == 'low'), [1, 5])
+
+    def test_delete_where(self):
+        db = Database(self.path)
+        db.add_table('users', USERS)
+        db.add_table('posts', POSTS)
+        db.insert_many('users', [[1, 'user1'], [2, 'user2'], [3, 'user3']])
+        db.insert_many('posts', [[1, 'a'], [2, 'b'], [3, 'c']])
+        db.delete_from_table('users', where=Col('user_id').isin([1, 3]))
+        self.assertEqual(db.get_table('users').data, [[2, 'user2']])
+        self.assertEqual(self.read_file()['posts']['data'], [[1, 2, 'b']])
+
+
+class SortedIndexTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = Database(self.path)
+        self.db.add_table('scores', PredicateTestCase.SCORES)
+        self.db.insert_many('scores', PredicateTestCase.ROWS)
+        self.db.create_index('scores', 'score', ordered=True)
+        self.index = self.db.get_table('scores').indexes['scores_score_idx']
+
+    def test_index(self):
+        index = SortedIndex([0])
+        index.build([[3], [None], [1], [3], [2]])
+        self.assertEqual(index.lookup(3), [0, 3])
+        self.assertEqual(index.range(2, 3), [4, 0, 3])
+        self.assertEqual(index.range(1, 3, include_low=False, include_high=False), [4])
+        self.assertEqual(index.range(low=2, reverse=True), [0, 3, 4])
+        self.assertEqual(index.ordered(), [1, 2, 4, 0, 3])
+        self.assertEqual(index.ordered(reverse=True), [0, 3, 4, 2, 1])
+        self.assertEqual((index.min(), index.max()), (1, 3))
+        index.remove([(0, [3]), (2, [1])], [[None], [3], [2]])
+        self.assertEqual(index.ordered(), [0, 2, 1])
+
+    def test_kept_up_to_date(self):
+        self.db.insert_into_table('scores', [6, 'f', 3.0])
+        self.db.update_table('scores', ['score'], [0.0], 'score_id', 4)
+        self.db.delete_from_table('scores', 'score_id', 1)
+        fresh = SortedIndex(self.index.column_positions)
+        fresh.build(self.db.get_table('scores').data)
+        self.assertEqual((self.index.keys, self.index.positions, self.index.null_entries),
+                         (fresh.keys, fresh.positions, fresh.null_entries))
+
+    def test_range_predicate(self):
+        rows = self.db.select('scores', [], Col('score').between(0, 7) & (Col('score_id') != 5))
+        self.assertEqual([row[0] for row in rows], [1, 3])
+        self.assertEqual([row[0] for row in self.db.select('scores', [], Col('score') > 1.5)], [3, 4])
+
+    def test_order_by(self):
+        ordered = [row[0] for row in self.db.select('scores', [], {}, order_by='score')]
+        self.assertEqual(ordered, [2, 5, 1, 3, 4])
+        ordered = [row[0] for row in self.db.select('scores', [], Col('score') > 0, order_by='score', descending=True)]
+        self.assertEqual(ordered, [4, 3, 1])
+        # Without an index the rows are sorted the same way
+        ordered = [row[0] for row in self.db.select('scores', [], {'name': 'a'}, order_by='score')]
+        self.assertEqual(ordered, [5, 1])
+        ordered = [row[0] for row in self.db.select('scores', [], None, order_by='name', descending=True)]
+        self.assertEqual(ordered, [4, 2, 1, 5, 3])
+
+    def test_tie_order(self):
+        rows = [[n, 'tie', [2.0, None, 1.0, 2.0, None, 1.0, 2.0][n % 7]] for n in range(1, 22)]
+        for ordered in (False, True):
+            db = Database(os.path.join(self.tmp.name, f'ties{ordered}.json'))
+            db.add_table('ties', PredicateTestCase.SCORES)
+            db.insert_many('ties', rows)
+            if ordered:
+                db.create_index('ties', 'score', ordered=True)
+            pages = []
+            for descending in (False, True):
+                for offset, limit in ((0, None), (0, 5), (4, 6), (15, 10)):
+                    pages.append([row[0] for row in db.select('ties', ['score_id'], None, order_by='score',
+                                                              descending=descending, limit=limit, offset=offset)])
+                pages.append([row[0] for row in db.select('ties', ['score_id'], Col('score') >= 1.0, order_by='score',
+                                                          descending=descending)])
+            if ordered:
+                self.assertEqual(pages, unindexed)
+            unindexed = pages
+        self.assertEqual(unindexed[5][:7], [3, 6, 7, 10, 13, 14, 17])
+
+    def test_persists(self):
+        db = Database(self.path)
+        db.load()
+        self.assertIsInstance(db.get_table('scores').indexes['scores_score_idx'], type(self.index))
+        self.assertEqual([row[0] for row in db.select('scores', [], None, order_by='score')], [2, 5, 1, 3, 4])
+
+    def test_unique(self):
+        self.db.create_index('scores', 'score_id', unique=True, ordered=True)
+        with self.assertRaises(ValueError):
+            self.db.create_index('scores', 'name', unique=True, ordered=True)
+        with self.assertRaises(ValueError):
+            self.db.insert_into_table('scores', [1, 'dup', 0.0])
+        self.assertEqual(len(self.db.get_table('scores').data), 5)
+
+
+class CursorTestCase(DatabaseTestCase):
+    def databases(self):
+        # Rows read from the file, rows held in memory (with and without
+        #  an ordered primary key index) and columnar rows
+        for name, options, ordered in [('file', {}, False), ('memory', {'in_memory': True}, False),
+                                       ('indexed', {'in_memory': True}, True), ('columnar', {'in_memory': True, 'columnar': True}, False)]:
+            db = Database(os.path.join(self.tmp.name, f'{name}.json'), **options)
+            db.add_table('scores', PredicateTestCase.SCORES)
+            db.insert_many('scores', [[n, 'abc'[n % 3], float(n % 4)] for n in range(20, 0, -1)])
+            if ordered:
+                db.create_index('scores', 'score_id', unique=True, ordered=True)
+            yield db
+
+    def test_projection(self):
+        for db in self.databases():
+            rows = list(db.select('scores', ['score', 'score_id'], {'score_id': 7}))
+            self.assertEqual(rows, [[3.0, 7]])
+            self.assertEqual(list(db.select('scores', ['score'], Col('score_id') < 3, order_by='score_id')), [[1.0], [2.0]])
+            with self.assertRaises(ValueError):
+                db.select('scores', ['missing'])
+
+    def test_limit_offset(self):
+        for db in self.databases():
+            ids = [row[0] for row in db.select('scores', limit=3, offset=2)]
+            self.assertEqual(ids, [18, 17, 16])
+            ids = [row[0] for row in db.select('scores', condition=Col('name') == 'a', order_by='score_id', limit=2, offset=1)]
+            self.assertEqual(ids, [6, 9])
+            self.assertEqual(list(db.select('scores', limit=0)), [])
+            with self.assertRaises(ValueError):
+                db.select('scores', limit=-1)
+
+    def test_keyset_pagination(self):
+        for db in self.databases():
+            pages = []
+            after = None
+            while True:
+                page = list(db.select('scores', ['score_id'], Col('score') != 0.0, order_by='score_id', after=after, limit=4))
+                if not page:
+                    break
+                pages.append([row[0] for row in page])
+                after = page[-1][0]
+            self.assertEqual(pages, [[1, 2, 3, 5], [6, 7, 9, 10], [11, 13, 14, 15], [17, 18, 19]])
+            page = db.select('scores', ['score_id'], None, descending=True, after=5, limit=2)
+            self.assertEqual(list(page), [[4], [3]])
+            with self.assertRaises(ValueError):
+                db.select('scores', after=5, order_by='score')
+
+    def test_fetch(self):
+        db = next(self.databases())
+        cursor = db.select('scores', ['score_id'], order_by='score_id', limit=5)
+        self.assertEqual(cursor.fetchone(), [1])
+        self.assertEqual(cursor.fetchmany(2), [[2], [3]])
+        self.assertEqual(cursor.fetchall(), [[4], [5]])
+        self.assertIsNone(cursor.fetchone())
+        # Iterating runs the query again, and sees the current rows
+        db.delete_from_table('scores', 'score_id', 1)
+        self.assertEqual([row[0] for row in cursor], [2, 3, 4, 5, 6])
+        self.assertEqual(list(cursor.columns), ['score_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
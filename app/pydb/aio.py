@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List
+
+import asyncio
+
+from app.pydb.database import Database
+from app.pydb.relation import Relation
+
+
+class AsyncDatabase:
+    '''
+    An asyncio front-end to a `Database`.
+
+    Every call runs on a bounded pool of threads, so that file I/O and
+        scans never block the event loop. The database is opened in
+        in-memory mode: a change only touches the tables held in memory,
+        and is then written by a flush shared with every other change made
+        in the meantime, so that many concurrent writes cost a few writes
+        of the file. A write returns once a flush started after its change
+        has completed.
+
+    Example:
+        async with AsyncDatabase('db.json') as db:
+            await asyncio.gather(*(db.insert_into_table('users', row) for row in rows))
+            users = await db.select('users', condition={'username': 'hgsuthers'})
+
+    Args:
+        path (str): The path to the database file.
+        max_workers (int): The number of threads the calls run on.
+        flush_delay (float): The number of seconds a flush waits for more
+            changes to join it.
+        **options: The other arguments of `Database`, such as storage or
+            columnar. shared and journal are not supported.
+
+    Attributes:
+        db (Database): The underlying database, or None until opened.
+
+    Raises:
+        ValueError: If options ask for a journal or a shared database.
+    '''
+    def __init__(self, path: str, max_workers: int = 4, flush_delay: float = 0.0, **options):
+        if options.get('journal') or options.get('shared'):
+            raise ValueError("An AsyncDatabase can't keep a journal or be shared.")
+        self.path = path
+        self.max_workers = max_workers
+        self.flush_delay = flush_delay
+        self.options = options
+        self.db = None
+        self._executor = None
+        self._flush_task = None
+
+    def __repr__(self):
+        return f"AsyncDatabase(path='{self.path}', open={self.db is not None})"
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _run(self, function, *args, **kwargs):
+        '''
+        Runs a blocking call on the pool and waits for its result.
+        '''
+        if self.db is None:
+            raise ValueError("The database is not open.")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(function, *args, **kwargs))
+
+    async def _write(self, function, *args, **kwargs):
+        result = await self._run(function, *args, **kwargs)
+        await self.flush()
+        return result
+
+    async def open(self) -> 'AsyncDatabase':
+        '''
+        Opens the database file and loads its tables.
+        '''
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='pydb')
+
+        def open_database():
+            db = Database(self.path, in_memory=True, **self.options)
+            db.load()
+            return db
+
+        loop = asyncio.get_running_loop()
+        try:
+            self.db = await loop.run_in_executor(self._executor, open_database)
+        except BaseException:
+            self._executor.shutdown()
+            raise
+        return self
+
+    async def close(self):
+        '''
+        Writes the pending changes and closes the database.
+        '''
+        if self.db is None:
+            return
+        await self.flush()
+        await self._run(self.db.close)
+        self.db = None
+        self._executor.shutdown()
+
+    def flush(self):
+        '''
+        Writes the pending changes. Every caller arriving before the write
+            starts waits for the same write.
+
+        Returns:
+            Awaitable: Done once the changes are written.
+        '''
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+        # A caller cancelled while waiting must not cancel the shared flush
+        return asyncio.shield(self._flush_task)
+
+    async def _flush(self):
+        await asyncio.sleep(self.flush_delay)
+        # The changes made from now on need a flush of their own
+        self._flush_task = None
+        await self._run(self.db.save)
+
+    async def add_table(self, table_name: str, columns: Dict[str, Dict[str, Any]]):
+        await self._run(self.db.add_table, table_name, columns)
+
+    async def select(self, table_name: str, *args, **kwargs) -> List[List[Any]]:
+        '''
+        Runs `Database.select` and reads all of its rows. The cursor reads
+            them as a single snapshot, so writes awaited alongside it never
+            split the result.
+        '''
+        return await self._run(lambda: self.db.select(table_name, *args, **kwargs).fetchall())
+
+    async def join_tables(self, leftmost, rightmost, *args, **kwargs):
+        '''
+        Runs `Database.join_tables` and reads all of its rows, or returns
+            the temporary table when persisted.
+        '''
+        def join():
+            result = self.db.join_tables(leftmost, rightmost, *args, **kwargs)
+            return list(result) if isinstance(result, Relation) else result
+        return await self._run(join)
+
+    async def insert_into_table(self, table_name: str, row: List[Any]):
+        await self._write(self.db.insert_into_table, table_name, row)
+
+    async def insert_many(self, table_name: str, rows):
+        return await self._write(self.db.insert_many, table_name, rows)
+
+    async def update_table(self, table_name: str, *args, **kwargs):
+        await self._write(self.db.update_table, table_name, *args, **kwargs)
+
+    async def delete_from_table(self, table_name: str, *args, **kwargs):
+        await self._write(self.db.delete_from_table, table_name, *args, **kwargs)
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import sys
+import threading
+
+
+def _size_of(rows: List[List[Any]]) -> int:
+    '''
+    Estimates the number of bytes held by a list of rows.
+    '''
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+    return size
+
+
+class QueryCache:
+    '''
+    A least recently used cache of query results.
+
+    Each entry records the tables its rows were read from, and the version
+        of each of them at the time. An entry is dropped as soon as one of
+        its tables changes, and is never returned for a version other than
+        the one it was read at. When the cache is full, the entries used
+        least recently are evicted first.
+
+    Args:
+        max_entries (int): The number of results to keep, or None for no limit.
+        max_bytes (int): The estimated size of the results to keep, or None
+            for no limit. A result larger than the limit is not kept.
+
+    Attributes:
+        hits (int): The number of queries answered from the cache.
+        misses (int): The number of queries that had to run.
+        evictions (int): The number of entries evicted to make room.
+        invalidations (int): The number of entries dropped because one of
+            their tables changed.
+        size (int): The estimated size of the entries, when max_bytes is set.
+
+    Raises:
+        ValueError: If max_entries is less than 1.
+    '''
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None):
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size = 0
+
+    def __repr__(self):
+        return f"QueryCache(entries={len(self._entries)}, max_entries={self.max_entries}, max_bytes={self.max_bytes})"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key: Hashable):
+        table_names, _, _, size = self._entries.pop(key)
+        self.size -= size
+        for table_name in table_names:
+            keys = self._by_table.get(table_name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table_name]
+
+    def get(self, key: Hashable, versions: Tuple[int, ...]) -> Optional[List[List[Any]]]:
+        '''
+        Returns the rows stored under key, or None if there are none for
+            these versions of the tables.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] != versions:
+                self._drop(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, table_names: List[str], versions: Tuple[int, ...], rows: List[List[Any]]):
+        '''
+        Stores the rows of a query read from table_names at versions.
+        '''
+        size = _size_of(rows) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (tuple(table_names), versions, rows, size)
+            self.size += size
+            for table_name in table_names:
+                self._by_table.setdefault(table_name, set()).add(key)
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                   or (self.max_bytes is not None and self.size > self.max_bytes)):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table_name: str):
+        '''
+        Drops every entry read from table_name.
+        '''
+        with self._lock:
+            keys = list(self._by_table.get(table_name, ()))
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        Returns the hit and miss counts of the cache and its current size.
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
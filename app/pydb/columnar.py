@@ -0,0 +1,405 @@
+from typing import Any, Dict, Iterator, List
+from array import array
+
+
+def _find_all(values: array, value: Any) -> List[int]:
+    '''
+    Returns the positions of value in an integer array.
+
+    The array is searched as raw bytes, which is much faster than
+        comparing its items one by one.
+    '''
+    needle = array(values.typecode, [value]).tobytes()
+    haystack = values.tobytes()
+    size = values.itemsize
+    positions = []
+    start = haystack.find(needle)
+    while start != -1:
+        if start % size:
+            # A match straddling two items
+            start = haystack.find(needle, start + 1)
+            continue
+        positions.append(start // size)
+        start = haystack.find(needle, start + size)
+    return positions
+
+
+class ObjectColumn:
+    '''
+    A column of arbitrary Python values, stored in a list.
+
+    Every column can fall back to an ObjectColumn when it is given
+        a value its own storage can't hold.
+    '''
+    def __init__(self, values: List[Any] = ()):
+        self.values = list(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, position: int) -> Any:
+        return self.values[position]
+
+    def set(self, position: int, value: Any) -> bool:
+        self.values[position] = value
+        return True
+
+    def append(self, value: Any) -> bool:
+        self.values.append(value)
+        return True
+
+    def delete(self, position: int):
+        del self.values[position]
+
+    def tolist(self) -> List[Any]:
+        return list(self.values)
+
+    def find(self, value: Any) -> List[int]:
+        return [position for position, item in enumerate(self.tolist()) if item == value]
+
+
+class ArrayColumn(ObjectColumn):
+    '''
+    A column of ints or floats, packed into a typed array.
+
+    Nullable columns keep a null map of one byte per row next to the
+        array, and a placeholder in the array for every None.
+
+    Args:
+        kind (type): int or float.
+        nullable (bool): Whether the column can hold None.
+        values (List[Any]): The initial values.
+    '''
+    TYPECODES = {int: 'q', float: 'd'}
+
+    def __init__(self, kind: type, nullable: bool = False, values: List[Any] = ()):
+        self.kind = kind
+        self.placeholder = kind()
+        self.values = array(self.TYPECODES[kind])
+        self.nulls = bytearray() if nullable else None
+        values = list(values)
+        if self.nulls is not None and None in values:
+            self.nulls = bytearray(value is None for value in values)
+            values = [self.placeholder if value is None else value for value in values]
+        elif self.nulls is not None:
+            self.nulls = bytearray(len(values))
+        if not all(type(value) is kind for value in values):
+            raise TypeError(f"Values are not all of type {kind.__name__}.")
+        try:
+            self.values.fromlist(values)
+        except OverflowError as e:
+            raise TypeError(str(e))
+
+    def fits(self, value: Any) -> bool:
+        if value is None:
+            return self.nulls is not None
+        if type(value) is not self.kind:
+            return False
+        if self.kind is int:
+            return -2 ** 63 <= value < 2 ** 63
+        return True
+
+    def get(self, position: int) -> Any:
+        if self.nulls is not None and self.nulls[position]:
+            return None
+        return self.values[position]
+
+    def set(self, position: int, value: Any) -> bool:
+        if not self.fits(value):
+            return False
+        if self.nulls is not None:
+            self.nulls[position] = value is None
+        self.values[position] = self.placeholder if value is None else value
+        return True
+
+    def append(self, value: Any) -> bool:
+        if not self.fits(value):
+            return False
+        if self.nulls is not None:
+            self.nulls.append(value is None)
+        self.values.append(self.placeholder if value is None else value)
+        return True
+
+    def delete(self, position: int):
+        del self.values[position]
+        if self.nulls is not None:
+            del self.nulls[position]
+
+    def tolist(self) -> List[Any]:
+        values = self.values.tolist()
+        if self.nulls is not None and any(self.nulls):
+            return [None if null else value for value, null in zip(values, self.nulls)]
+        return values
+
+    def find(self, value: Any) -> List[int]:
+        if value is None:
+            if self.nulls is None:
+                return []
+            return [position for position, null in enumerate(self.nulls) if null]
+        if self.kind is not int or not self.fits(value):
+            return super().find(value)
+        positions = _find_all(self.values, value)
+        if self.nulls is not None:
+            positions = [position for position in positions if not self.nulls[position]]
+        return positions
+
+
+class DictionaryColumn(ObjectColumn):
+    '''
+    A dictionary-encoded column of strings.
+
+    Every distinct string is stored once, and each row holds the 32-bit
+        code of its string, -1 for None. Columns with many distinct values
+        don't benefit from the encoding, so once the distinct values
+        outnumber half of the rows the column asks to be stored as objects.
+
+    Args:
+        values (List[Any]): The initial values.
+    '''
+    MIN_DISTINCT = 256
+
+    def __init__(self, values: List[Any] = ()):
+        self.codes = array('i')
+        self.values = []
+        self.lookup = {}
+        for value in values:
+            if not self.append(value):
+                raise TypeError("Too many distinct values for a dictionary encoding.")
+
+    def __len__(self):
+        return len(self.codes)
+
+    def encode(self, value: Any):
+        '''
+        Returns the code of value, or None if value can't be encoded.
+        '''
+        if value is None:
+            return -1
+        if type(value) is not str:
+            return None
+        code = self.lookup.get(value)
+        if code is None:
+            if len(self.values) >= self.MIN_DISTINCT and len(self.values) * 2 > len(self.codes):
+                return None
+            code = len(self.values)
+            self.values.append(value)
+            self.lookup[value] = code
+        return code
+
+    def get(self, position: int) -> Any:
+        code = self.codes[position]
+        return None if code < 0 else self.values[code]
+
+    def set(self, position: int, value: Any) -> bool:
+        code = self.encode(value)
+        if code is None:
+            return False
+        self.codes[position] = code
+        return True
+
+    def append(self, value: Any) -> bool:
+        code = self.encode(value)
+        if code is None:
+            return False
+        self.codes.append(code)
+        return True
+
+    def delete(self, position: int):
+        del self.codes[position]
+
+    def tolist(self) -> List[Any]:
+        values = self.values + [None]
+        return [values[code] for code in self.codes]
+
+    def find(self, value: Any) -> List[int]:
+        code = -1 if value is None else self.lookup.get(value)
+        if code is None:
+            return []
+        return _find_all(self.codes, code)
+
+
+def make_column(column_type: Any, nullable: bool, values: List[Any]) -> ObjectColumn:
+    '''
+    Returns the most compact column that can hold values, based on the
+        type of the column in the table schema.
+    '''
+    try:
+        if type(column_type) in ArrayColumn.TYPECODES:
+            return ArrayColumn(type(column_type), nullable, values)
+        if type(column_type) is str:
+            return DictionaryColumn(values)
+    except TypeError:
+        pass
+    return ObjectColumn(values)
+
+
+class RowView:
+    '''
+    A live view of a single row of a ColumnStore.
+
+    Reading or assigning an item reads or writes the underlying column,
+        so code written against rows as lists keeps working. The view is
+        bound to a position: after rows before it are deleted, it shows
+        whichever row moved into that position. Use `copy` or `list` to
+        keep the values of a row.
+    '''
+    __slots__ = ('store', 'position')
+
+    def __init__(self, store: 'ColumnStore', position: int):
+        self.store = store
+        self.position = position
+
+    def __len__(self):
+        return len(self.store.columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.copy()[key]
+        return self.store.get(self.position, key)
+
+    def __setitem__(self, key, value):
+        self.store.set(self.position, key, value)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.copy())
+
+    def __eq__(self, other):
+        try:
+            return self.copy() == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def __add__(self, other):
+        return self.copy() + list(other)
+
+    def copy(self) -> List[Any]:
+        return [column.get(self.position) for column in self.store.columns]
+
+
+class ColumnStore:
+    '''
+    Holds the rows of a table column by column.
+
+    int and float columns are packed into typed arrays, with a null map
+        if they are nullable, and str columns are dictionary-encoded, which
+        takes a fraction of the memory of a list per row. Any column that
+        is given a value its storage can't hold (a bool, a huge int, a
+        mismatched type) falls back to a list of objects.
+
+    A ColumnStore can be used in place of the list of rows of a `Table`:
+        indexing it returns a `RowView` that reads and writes the columns,
+        iterating or slicing it returns rows as lists, and it supports
+        append, pop and del. `find` and `column` scan a single column
+        without building any row.
+
+    Args:
+        columns (Dict[str, Dict[str, Any]]): The columns of the table and
+            their metadata, in the same form as `Table.columns`.
+        rows (List[List[Any]]): The initial rows.
+
+    Attributes:
+        columns (List[ObjectColumn]): The storage of each column, in the
+            order of the table columns.
+    '''
+    def __init__(self, columns: Dict[str, Dict[str, Any]], rows: List[List[Any]] = ()):
+        rows = list(rows)
+        values = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        self.columns = [
+            make_column(info['type'], info.get('nullable', False), column_values)
+            for info, column_values in zip(columns.values(), values)
+        ]
+        self.length = len(rows)
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"ColumnStore(rows={self.length}, columns={[type(column).__name__ for column in self.columns]})"
+
+    def _position(self, position: int) -> int:
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError("ColumnStore index out of range")
+        return position
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            columns = [column.tolist()[start:stop:step] for column in self.columns]
+            return [list(row) for row in zip(*columns)]
+        return RowView(self, self._position(key))
+
+    def __setitem__(self, position: int, row: List[Any]):
+        position = self._position(position)
+        for column_position, value in enumerate(list(row)):
+            self.set(position, column_position, value)
+
+    def __delitem__(self, position: int):
+        position = self._position(position)
+        for column in self.columns:
+            column.delete(position)
+        self.length -= 1
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        return map(list, zip(*(column.tolist() for column in self.columns)))
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(row == list(other_row) for row, other_row in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def get(self, position: int, column_position: int) -> Any:
+        return self.columns[column_position].get(position)
+
+    def set(self, position: int, column_position: int, value: Any):
+        column = self.columns[column_position]
+        if not column.set(position, value):
+            column = self.columns[column_position] = ObjectColumn(column.tolist())
+            column.set(position, value)
+
+    def append(self, row: List[Any]):
+        if len(row) != len(self.columns):
+            raise ValueError(f"Row has {len(row)} values, expected {len(self.columns)}.")
+        for column_position, value in enumerate(row):
+            column = self.columns[column_position]
+            if not column.append(value):
+                column = self.columns[column_position] = ObjectColumn(column.tolist())
+                column.append(value)
+        self.length += 1
+
+    def extend(self, rows: List[List[Any]]):
+        for row in rows:
+            self.append(row)
+
+    def pop(self, position: int = -1) -> List[Any]:
+        position = self._position(position)
+        row = RowView(self, position).copy()
+        del self[position]
+        return row
+
+    def column(self, column_position: int) -> List[Any]:
+        '''
+        Returns every value of a column, in row order.
+        '''
+        return self.columns[column_position].tolist()
+
+    def find(self, column_position: int, value: Any) -> List[int]:
+        '''
+        Returns the positions of the rows where a column equals value.
+        '''
+        return self.columns[column_position].find(value)
+
+    def find_in(self, column_position: int, values) -> List[int]:
+        '''
+        Returns the positions of the rows where a column is one of values.
+        '''
+        values = set(values)
+        return [position for position, value in enumerate(self.column(column_position)) if value in values]
+
+    def tolist(self) -> List[List[Any]]:
+        return list(self)
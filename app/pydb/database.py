@@ -1,7 +1,18 @@
 from app.pydb.table import Table
+from app.pydb.journal import Journal
+from app.pydb.relation import Cursor, Relation
+from app.pydb.locks import FileLock, RWLock
+from app.pydb.parallel import ParallelScanner
+from app.pydb.cache import QueryCache
+from app.pydb.storage import files_written, get_storage
+from app.pydb.vectorized import filter_rows
+from app.pydb.predicate import And, Col, Predicate
 from typing import Dict, Any, List
+from contextlib import contextmanager, nullcontext
+from itertools import islice
 import logging
-import json
+import threading
+import time
 
 # Create a custom logger
 logger = logging.getLogger(__name__)
@@ -47,30 +58,17 @@ class Database:
         - Delete data from tables
         - Foreign key constraints
         - ON DELETE and ON UPDATE actions
+        - Hash indexes (see `create_index`)
+        - Joins (see `join_tables`)
+        - Transactions (see `transaction`)
     
     PyDB does NOT support the following features:
-        - Joins
-        - Indexes
-        - Transactions
         - Views
         - Stored procedures
         - Triggers
         - User management
         - Permissions
 
-    To simulate JOINs, you can use the `select` method
-        to load data from multiple tables and perform
-        the join in Python code using a library like
-        Pandas or NumPy.
-    
-    To simulate transactions, you can wrap multiple
-        operations in a try-except block and handle
-        exceptions accordingly.
-
-    To simulate indexes, you can create additional
-        tables that store indexed data and use them
-        to quickly look up values.
-
     To simulate views, you can create a method that
         generates a view by combining data from
         multiple tables.
@@ -87,27 +85,160 @@ class Database:
         you can create a custom authentication and
         authorization system in your application.
 
+    Journal mode:
+        By default every insert, update and delete rewrites
+        the whole JSON file. With `journal=True` changes are
+        appended to a write-ahead journal next to the file
+        (`<path>.journal`) and folded back into the file at
+        every `checkpoint_interval` records, on `save` and on
+        `close`. A journal left behind by a crash is replayed
+        when the database is opened.
+
+    In-memory mode:
+        With `in_memory=True` the tables held by the
+        database are the source of truth. Reads never go
+        back to the file and changes only mark their table
+        dirty. Dirty tables are written on `save`/`commit`,
+        or automatically once `flush_rows` changes are
+        pending or `flush_interval` seconds have passed
+        since the last write. The interval is kept by a
+        background timer, so changes are written even if
+        no other change follows them.
+
+    Threads:
+        A Database can be shared by several threads. Reads
+        of a table run in parallel under a read lock, and
+        changes take a write lock on the tables they can
+        touch: the table itself and the tables its foreign
+        key actions cascade into. Changes to unrelated
+        tables don't wait on each other. Adding or removing
+        tables, and transactions, have the database to
+        themselves.
+
     Args:
         path (str): The path to the JSON file that
             will store the database data.
+        journal (bool): Whether to use a write-ahead journal.
+        checkpoint_interval (int): The number of journal
+            records between two checkpoints.
+        in_memory (bool): Whether to keep the tables
+            resident and only write dirty tables on demand.
+        flush_interval (float): In in-memory mode, the
+            number of seconds after the last write at which
+            pending changes are written by a background
+            timer. None to disable.
+        flush_rows (int): In in-memory mode, the number of
+            pending row changes after which they are
+            written. None to disable.
+        storage (str | StorageBackend): The format of the
+            database file, 'json' (the default), the
+            compact and faster 'binary' format, or
+            'directory' to store each table in files of
+            its own under the directory at path. Pass a
+            `DirectoryStorage(partition_rows=...)` to split
+            large tables into partitions. See
+            `app.pydb.storage.convert` to switch formats.
+        columnar (bool): Whether to hold the rows of the
+            tables column by column in typed arrays. See
+            `app.pydb.columnar.ColumnStore`.
+        shared (bool): Whether other processes may open the
+            same database file. Writes then hold a lock file
+            next to it, and the tables are read back when
+            another process changed them. Can't be combined
+            with journal or in_memory.
+        parallel_workers (int): The number of processes
+            the scans of large tables are split across,
+            or None to scan in this process only.
+        parallel_min_rows (int): The number of rows from
+            which a scan, a join or a foreign key action
+            is split across the processes.
+        cache_entries (int): The number of `select` and
+            `join_tables` results to keep in a
+            `QueryCache`, or None for no cache unless
+            cache_bytes is set.
+        cache_bytes (int): The estimated size of the
+            results to keep in the cache, or None for
+            no limit.
+        tuple_rows (bool): Whether to hold each row as a
+            tuple rather than a list, which takes less
+            memory. Can't be combined with columnar.
     
     Attributes:
         path (str): The path to the JSON file that
             stores the database data.
         tables (dict): A dictionary of Table objects
             that represent the tables in the database.
+        storage (StorageBackend): The backend used to read
+            and write the database file.
+        fk_children (dict): The reverse foreign key graph.
+            Maps each parent table name to the
+            (child table, child column, parent column)
+            of every column referencing it.
+        journal (Journal): The write-ahead journal, or None.
+        in_memory (bool): Whether the tables held in
+            memory are the source of truth.
+        columnar (bool): Whether the tables hold their
+            rows column by column.
+        tuple_rows (bool): Whether the tables hold their
+            rows as tuples.
+        catalog_lock (RWLock): Held for reading by every
+            statement, and for writing while tables are
+            added or removed and during a transaction.
+        table_locks (Dict[str, RWLock]): The lock of each
+            table.
+        shared (FileLock): The lock file shared with the
+            other processes, or None.
+        generation (int): The generation of the lock file
+            the tables were last read at.
+        scanner (ParallelScanner): The pool scans are split
+            across, or None.
+        cache (QueryCache): The query result cache, or None.
+
+    Raises:
+        ValueError: If shared is combined with journal or
+            in_memory, or tuple_rows with columnar.
     '''
-    def __init__(self, path: str):
+    def __init__(self, path: str, journal: bool = False, checkpoint_interval: int = 1000,
+                 in_memory: bool = False, flush_interval: float = None, flush_rows: int = None,
+                 storage='json', columnar: bool = False, shared: bool = False,
+                 parallel_workers: int = None, parallel_min_rows: int = 100000,
+                 cache_entries: int = None, cache_bytes: int = None, tuple_rows: bool = False):
+        if shared and (journal or in_memory):
+            raise ValueError("A shared database can't keep a journal or hold its changes in memory.")
+        if tuple_rows and columnar:
+            raise ValueError("Columnar tables don't hold their rows as tuples.")
         self.path = path
         self.tables = {}
+        self.fk_children = {}
+        self.journal = None
+        self.in_memory = in_memory
+        self.columnar = columnar
+        self.tuple_rows = tuple_rows
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.last_flush = time.monotonic()
+        self._flush_timer = None
+        self._flush_lock = threading.Lock()
+        self._transaction = None
+        self.catalog_lock = RWLock()
+        self.table_locks = {}
+        self.shared = None
+        self.generation = 0
+        self.scanner = ParallelScanner(parallel_workers, parallel_min_rows) if parallel_workers else None
+        self.cache = QueryCache(cache_entries, cache_bytes) if cache_entries or cache_bytes else None
+
+        self.storage = get_storage(storage)
+
+        if shared:
+            self.shared = FileLock(f'{path}.lock')
 
         # create the db.json file if it does not exist
-        try:
-            with open(path, 'r') as f:
-                pass
-        except FileNotFoundError:
-            with open(path, 'w') as f:
-                json.dump({}, f)
+        with self._exclusive():
+            self.storage.create(path)
+
+        if journal:
+            self.journal = Journal(f'{path}.journal', checkpoint_interval)
+            self.recover()
     
     def __repr__(self):
         return f"Database(path='{self.path}', tables={self.tables})"
@@ -118,15 +249,177 @@ class Database:
             logger.info(f"Removing temporary table {table_name}")
             self.remove_table(table_name)
 
+    def recover(self):
+        '''
+        Replays a journal left behind by a crash into the database file,
+            and carries on the sequence numbers of the journal from the
+            ones stored with the tables.
+        '''
+        records = self.journal.records()
+        if not records:
+            catalog = self.storage.read_catalog(self.path)
+            self.journal.lsn = max([table.get('lsn', 0) for table in catalog.values()], default=0)
+            return
+        with self.storage.locked():
+            db_data = self.storage.read(self.path)
+            applied = self.journal.replay(db_data)
+            self.storage.write(self.path, db_data)
+        self.journal.truncate()
+        logger.info(f"Recovered {applied} journal records into {self.path}.")
+
+    def checkpoint(self):
+        '''
+        Folds the journal back into the database file.
+        '''
+        if self.journal is not None:
+            self.save()
+
+    def _maybe_flush(self):
+        '''
+        Writes pending changes once the journal or the flush policy asks for it.
+        '''
+        if self._transaction is not None:
+            return
+        if self.journal is not None:
+            if self.journal.needs_checkpoint():
+                self.save()
+        elif self.in_memory:
+            pending = sum(table.pending_changes for table in self.tables.values())
+            if not pending:
+                return
+            if self.flush_rows is not None and pending >= self.flush_rows:
+                self.save()
+            elif self.flush_interval is not None:
+                if time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.save()
+                else:
+                    self._schedule_flush()
+
+    def _schedule_flush(self):
+        '''
+        Starts a timer that writes the pending changes once flush_interval
+            seconds have passed since the last write, unless one is running.
+        '''
+        with self._flush_lock:
+            if self._flush_timer is None:
+                delay = max(0.0, self.flush_interval - (time.monotonic() - self.last_flush))
+                self._flush_timer = threading.Timer(delay, self._timed_flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _cancel_flush(self):
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+    def _timed_flush(self):
+        with self._flush_lock:
+            self._flush_timer = None
+        try:
+            self._maybe_flush()
+        except ValueError as e:
+            logger.error(f"Error flushing {self.path}: {e}")
+
+    def _refresh(self):
+        '''
+        Reads the tables back from the file if another process changed it
+            since they were last read. Only the generation counter of the
+            lock file is read when nothing changed.
+        '''
+        if self.shared is None or self.catalog_lock.owned():
+            return
+        if self.shared.generation() == self.generation:
+            return
+        # Backends that replace the whole file on write can be read while
+        #  another process writes, the others must keep writers out
+        reading = nullcontext() if self.storage.snapshot_reads else self.shared.shared()
+        with reading, self.catalog_lock.write_locked():
+            # The counter is read before the data, so that a change made
+            #  while reading is picked up by the next refresh
+            generation = self.shared.generation()
+            if generation == self.generation:
+                return
+            self._reload()
+            self.generation = generation
+
+    def _reload(self):
+        '''
+        Replaces the rows and indexes of the tables with the ones in the file.
+            Tables another process removed are forgotten, while the tables
+            it added are left alone until `add_table` or `load` is called.
+        '''
+        if not self.tables:
+            return
+        db_data = self.storage.read(self.path)
+        for table_name, table in list(self.tables.items()):
+            if table_name in db_data:
+                table.reload(db_data[table_name])
+            else:
+                self._forget_table(table_name)
+        logger.info(f"Tables of {self.path} read back after a change by another process.")
+
+    @contextmanager
+    def _exclusive(self):
+        '''
+        Keeps the other processes sharing the database out while a change
+            is made, and tells them about it by incrementing the generation
+            counter of the lock file if any file was written. Does nothing
+            if the database is not shared.
+        '''
+        if self.shared is None:
+            yield
+            return
+        with self.shared.exclusive():
+            self._refresh()
+            written = files_written()
+            try:
+                yield
+            finally:
+                if files_written() != written:
+                    self.generation = self.shared.bump()
+
     def add_table(self, table_name: str, columns: Dict[str, Dict[str, Any]]):
+        with self._exclusive(), self.catalog_lock.write_locked():
+            self._add_table(table_name, columns)
+
+    def _add_table(self, table_name: str, columns: Dict[str, Dict[str, Any]], catalog: Dict[str, Dict[str, Any]] = None):
         if table_name in self.tables:
             raise ValueError(f"Table '{table_name}' already exists.")
-        new_table = Table(path=self.path, table_name=table_name, columns=columns)
+        if self._transaction is not None:
+            raise ValueError("Tables can't be added during a transaction.")
+        # Schema changes go straight to the file, so the journal
+        #  must not hold any records older than them
+        self.checkpoint()
+        new_table = Table(
+            path=self.path, table_name=table_name, columns=columns,
+            journal=self.journal, autosave=not self.in_memory,
+            storage=self.storage, columnar=self.columnar, tuple_rows=self.tuple_rows,
+            scanner=self.scanner, catalog=catalog
+        )
         self.tables[table_name] = new_table
+        self.table_locks[table_name] = RWLock()
+        if self.cache is not None:
+            self.cache.invalidate(table_name)
+            new_table.change_hooks.append(self._invalidate)
+
+        # Record the new table in the reverse foreign key graph
+        for column, values in new_table.columns.items():
+            if values['FK']:
+                self.fk_children.setdefault(values['FK']['table'], []).append(
+                    (table_name, column, values['FK']['column'])
+                )
 
     def remove_table(self, table_name: str):
+        with self._exclusive(), self.catalog_lock.write_locked():
+            self._remove_table(table_name)
+
+    def _remove_table(self, table_name: str):
         if table_name not in self.tables:
             raise ValueError(f"Table '{table_name}' does not exist.")
+        if self._transaction is not None:
+            raise ValueError("Tables can't be removed during a transaction.")
+        self.checkpoint()
         
         # get the table
         table = self.get_table(table_name)
@@ -134,47 +427,268 @@ class Database:
         # delete the table using the table's built in delete_table method
         #  this removes the table from the db file
         table.delete_table()
+        self._forget_table(table_name)
 
+    def _forget_table(self, table_name: str):
         # remove the table from the database object's tables attribute
         del self.tables[table_name]
+        del self.table_locks[table_name]
+        if self.cache is not None:
+            self.cache.invalidate(table_name)
+
+        # and from the reverse foreign key graph
+        self.fk_children.pop(table_name, None)
+        for parent_name, children in self.fk_children.items():
+            self.fk_children[parent_name] = [child for child in children if child[0] != table_name]
+
+    def _cascade_tables(self, table_name: str) -> set:
+        '''
+        Returns table_name and every table its foreign key actions can
+            cascade into, directly or through other tables.
+        '''
+        names = {table_name}
+        pending = [table_name]
+        while pending:
+            for child_name, _, _ in self.fk_children.get(pending.pop(), []):
+                if child_name not in names:
+                    names.add(child_name)
+                    pending.append(child_name)
+        return names
+
+    @contextmanager
+    def _locked(self, table_names: List[str], write: bool = False):
+        '''
+        Holds the catalog lock for reading, and the locks of the tables
+            a statement on table_names touches.
+
+        A read only locks table_names, for reading. A write locks them and
+            every table their foreign key actions can cascade into for
+            writing, and their parent tables for reading, since foreign
+            keys are checked against them. The locks are always taken in
+            the order of the table names, so that two threads never wait
+            on each other.
+
+        Raises:
+            ValueError: If a table does not exist.
+        '''
+        self._refresh()
+        self.catalog_lock.acquire_read()
+        held = []
+        try:
+            modes = {}
+            for table_name in table_names:
+                table = self.get_table(table_name)
+                modes[table_name] = write
+                if write:
+                    for values in table.columns.values():
+                        if values['FK']:
+                            modes.setdefault(values['FK']['table'], False)
+                    for name in self._cascade_tables(table_name):
+                        modes[name] = True
+            for name in sorted(modes):
+                lock = self.table_locks[name]
+                if modes[name]:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                held.append((lock, modes[name]))
+            yield
+        finally:
+            for lock, writing in reversed(held):
+                if writing:
+                    lock.release_write()
+                else:
+                    lock.release_read()
+            self.catalog_lock.release_read()
 
     def get_table(self, table_name: str) -> Table:
+        self._refresh()
         if table_name not in self.tables:
             raise ValueError(f"Table '{table_name}' does not exist.")
         return self.tables[table_name]
 
     def list_tables(self) -> List[str]:
+        self._refresh()
         return list(self.tables.keys())
+
+    def create_index(self, table_name: str, columns, unique: bool = False, index_name: str = None, ordered: bool = False) -> str:
+        '''
+        Creates a hash or ordered index on one or more columns of a table.
+
+        The index is kept up to date by every insert, update and delete,
+            including foreign key cascades, and `select` uses it whenever
+            its condition covers all of the indexed columns. The index
+            definition is stored with the table in the database file and
+            the index is rebuilt when the database is loaded.
+
+        Args:
+            table_name (str): The name of the table.
+            columns (str | List[str]): The column or columns to index.
+            unique (bool): Whether the indexed values must be unique.
+            index_name (str): The name of the index. Defaults to
+                `<table>_<columns>_idx`.
+            ordered (bool): Whether to create an ordered index, which
+                also answers range predicates such as `between`, and
+                `select` with `order_by`, without a full scan.
+
+        Returns:
+            str: The name of the index.
+
+        Raises:
+            ValueError: If a transaction is running, since a rollback
+                wouldn't undo the index.
+        '''
+        if isinstance(columns, str):
+            columns = [columns]
+        if index_name is None:
+            index_name = f"{table_name}_{'_'.join(columns)}_idx"
+        with self._exclusive(), self._locked([table_name], write=True):
+            if self._transaction is not None:
+                raise ValueError("Indexes can't be created during a transaction.")
+            self.get_table(table_name).create_index(index_name, columns, unique, ordered)
+        logger.info(f"Created {'unique ' if unique else ''}{'ordered ' if ordered else ''}index {index_name} on {table_name}{columns}.")
+        return index_name
+
+    def drop_index(self, table_name: str, index_name: str):
+        with self._exclusive(), self._locked([table_name], write=True):
+            if self._transaction is not None:
+                raise ValueError("Indexes can't be dropped during a transaction.")
+            self.get_table(table_name).drop_index(index_name)
+        logger.info(f"Dropped index {index_name} from {table_name}.")
     
-    def select(self, table_name: str, columns: List[str], condition: Dict[str, Any] = None) -> List[List[Any]]:
+    def select(self, table_name: str, columns: List[str] = None, condition: Dict[str, Any] = None,
+               order_by: str = None, descending: bool = False, limit: int = None, offset: int = 0,
+               after: Any = None) -> Cursor:
+        '''
+        Returns a lazy cursor over the rows of a table that match a condition.
+
+        The query runs when the cursor is iterated or fetched from. The
+            matching rows are read under a single read lock, so a cursor
+            returns a consistent snapshot even if the table changes while
+            it is fetched from. Only the requested columns are copied, and
+            the scan stops as soon as `limit` rows have been found.
+
+        Args:
+            table_name (str): The name of the table.
+            columns (List[str]): The columns to return, in order. None or
+                an empty list returns every column.
+            condition (Dict[str, Any] | Predicate): Either column names and
+                the values they must equal, or a `Predicate` such as
+                `(Col('age') > 30) | Col('name').isin(['Bob', 'Carol'])`.
+            order_by (str): A column to sort the rows by, None first.
+                Uses an ordered index on the column when there is one.
+            descending (bool): Whether to sort in descending order, None last.
+            limit (int): The maximum number of rows to return.
+            offset (int): The number of matching rows to skip.
+            after (Any): A primary key value. Only the rows that come after it
+                in primary key order are returned, which pages through a
+                table without skipping rows one by one like offset does.
+                Orders the rows by the primary key, so pass the primary key
+                as order_by to read the first page.
+
+        Returns:
+            Cursor: The matching rows.
+
+        Raises:
+            ValueError: If a column doesn't exist, or the arguments don't fit
+                the table.
+        '''
         table = self.get_table(table_name)
-        loaded = table.load_data()
-        data = loaded['data']
-        columns = list(loaded['columns'].keys())
-    
-        cond_index = [columns.index(col) for col in condition.keys()]
-        if len(cond_index) == 0:
-            return data
-        if condition:
-            filtered_data = []
-            for row in data:
-                if all(row[cond_index[i]] == val for i, val in enumerate(condition.values())):
-                    if len(columns) > 0:
-                        filtered_data.append([row[columns.index(col)] for col in columns])
-                    else:
-                        filtered_data.append(row)
-            return filtered_data
-
-    def join_tables(self, leftmost: str, rightmost: str, condition: Dict[str, Any] = None, *args):
+        column_list = list(table.columns.keys())
+        columns = list(columns or column_list)
+        for column in columns:
+            if column not in table.columns:
+                raise ValueError(f"Column {column} does not exist in table.")
+        if limit is not None and limit < 0:
+            raise ValueError("limit must not be negative.")
+        if offset < 0:
+            raise ValueError("offset must not be negative.")
+
+        if isinstance(condition, dict):
+            condition = And(*(Col(column) == value for column, value in condition.items())) if condition else None
+        if condition is not None:
+            condition.validate(table.columns)
+
+        if after is not None:
+            pk_columns = [column for column, info in table.columns.items() if info.get('PK')]
+            if len(pk_columns) != 1:
+                raise ValueError(f"Table '{table_name}' needs a single column primary key to page with after.")
+            if order_by not in (None, pk_columns[0]):
+                raise ValueError("Paging with after orders the rows by the primary key.")
+            order_by = pk_columns[0]
+        if order_by is not None and order_by not in table.columns:
+            raise ValueError(f"Column {order_by} does not exist in table.")
+
+        slots = [column_list.index(column) for column in columns]
+        stop = None if limit is None else offset + limit
+
+        def project(row):
+            if columns == column_list:
+                return list(row)
+            return [row[slot] for slot in slots]
+
+        def rows():
+            # The matching rows are copied under a single read lock, so the
+            #  cursor reads a consistent snapshot and doesn't hold up writers
+            with self._locked([table_name]):
+                data = table.data
+                positions = table.scan(condition, order_by, descending, after, stop)
+                found = [project(data[position]) for position in islice(positions, offset, stop)]
+            yield from found
+
+        if self.cache is not None:
+            key = ('select', table_name, tuple(columns), repr(condition), order_by, descending, limit, offset, repr(after))
+            rows = self._cached(key, [table_name], rows)
+        return Cursor(table_name, {column: table.columns[column] for column in columns}, rows)
+
+    def join_tables(self, leftmost, rightmost, condition: Dict[str, Any] = None, *args,
+                    on: Dict[str, str] = None, how: str = 'inner', persist: bool = False):
         '''Join two tables together.
-        This method can be daisy-chained to join multiple tables together.
+        This method can be daisy-chained to join multiple tables together,
+            by passing the relation it returns in place of a table name.
+
+        The result is a lazy `Relation`: the join runs every time the
+            relation is iterated and its rows never touch the database
+            file, unless `persist` is set. The matching rows of the tables
+            are copied under their read locks before the first joined row
+            is produced, so the tables can change while it is read.
+
+        With `on`, the tables are joined column to column with a hash join:
+            a hash table is built on the smaller input and probed with the
+            larger one, so the join costs O(n + m) instead of O(n * m).
+            Without `on`, every left row is paired with every right row.
+
+        Args:
+            leftmost (str | Relation): The left table name, or a relation.
+            rightmost (str | Relation): The right table name, or a relation.
+            condition (Dict[str, Any]): Constant equality filters applied
+                before joining. Each column filters whichever of the two
+                inputs has it.
+            on (Dict[str, str]): The join keys, as {left column: right column}.
+            how (str): 'inner', or 'left' to keep the left rows without a
+                match, padded with None.
+            persist (bool): Whether to store the result in a temporary
+                `temp_<left>_<right>` table, removed on `close`.
+
+        Returns:
+            Relation: The joined rows, or the temporary table when persisted.
+
+        Raises:
+            ValueError: If the join type or a column doesn't exist, or, when
+                persisted, a joined row doesn't fit the temporary table,
+                which is then removed.
         '''
-        joined = []
+        if how not in ['inner', 'left']:
+            raise ValueError(f"Unsupported join type '{how}'.")
+        condition = condition or {}
+        on = on or {}
 
         try:
             # start by getting the table objects
-            leftmost = self.get_table(leftmost)
-            rightmost = self.get_table(rightmost)
+            if not isinstance(leftmost, Relation):
+                leftmost = self.get_table(leftmost)
+            if not isinstance(rightmost, Relation):
+                rightmost = self.get_table(rightmost)
 
             # dont want to have temp_temp_table
             if not 'temp' in leftmost.table_name and not 'temp' in rightmost.table_name:
@@ -185,169 +699,549 @@ class Database:
             logger.error(f"Error joining tables: {e}")
             return
 
-        # load the data from the tables
-        leftmost_loaded = leftmost.load_data()
-        rightmost_loaded = rightmost.load_data()
+        leftmost_columns = list(leftmost.columns.keys())
+        rightmost_columns = list(rightmost.columns.keys())
 
-        # get the data and columns from the loaded data
-        leftmost_data = leftmost_loaded['data']
-        rightmost_data = rightmost_loaded['data']
+        for col in condition:
+            if col not in leftmost_columns and col not in rightmost_columns:
+                raise ValueError(f"Column {col} does not exist in {leftmost} or {rightmost}.")
+        for left_col, right_col in on.items():
+            if left_col not in leftmost_columns or right_col not in rightmost_columns:
+                raise ValueError(f"Join columns {left_col} = {right_col} do not exist in {leftmost} and {rightmost}.")
 
-        leftmost_columns = list(leftmost_loaded['columns'].keys())
-        rightmost_columns = list(rightmost_loaded['columns'].keys())
+        left_condition = {col: val for col, val in condition.items() if col in leftmost_columns}
+        right_condition = {col: val for col, val in condition.items() if col in rightmost_columns}
 
-        # get full column info
-        leftmost_columns_info = leftmost.columns
-        rightmost_columns_info = rightmost.columns
+        # keep every left column and the right columns the left doesn't have
+        right_extra = [idx for idx, col in enumerate(rightmost_columns) if col not in leftmost_columns]
 
-        # get the column info for the joined columns
-        cols = {col: leftmost_columns_info[col] for col in leftmost_columns}
-        cols.update({col: rightmost_columns_info[col] for col in rightmost_columns if col not in leftmost_columns})
-        
         # rip only the key and type from the columns info,
         #  keeping the nested dict structure
         #  all other columns will default
-        cols = {col: {'type': info['type']} for col, info in cols.items()}
-
-        # get the index of the condition columns in both tables
-        left_cond_index = [leftmost_columns.index(col) for col in condition.keys()]
-        right_cond_index = [rightmost_columns.index(col) for col in condition.keys()]
-
-        # iterate through the leftmost table
-        #  and find rows that match the condition
-        # then iterate through the rightmost table
-        #  and find rows that match the condition, but only keep columns
-        #  that are not in the leftmost table
-        for row in leftmost_data:
-            if all(row[left_cond_index[i]] == val for i, val in enumerate(condition.values())):
-                joined_row_starter = [row[leftmost_columns.index(col)] for col in leftmost_columns]
-                for r_row in rightmost_data:
-                    if all(r_row[right_cond_index[i]] == val for i, val in enumerate(condition.values())):
-                        joined_row = joined_row_starter.copy()
-                        joined_row.extend([r_row[rightmost_columns.index(col)] for col in rightmost_columns if col not in leftmost_columns])
-                        joined.append(joined_row)
-
-        # turn the joined list into a table
+        cols = {col: {'type': info['type'], 'nullable': info.get('nullable', False)} for col, info in leftmost.columns.items()}
+        for idx in right_extra:
+            col = rightmost_columns[idx]
+            info = rightmost.columns[col]
+            cols[col] = {'type': info['type'], 'nullable': how == 'left' or info.get('nullable', False)}
+
+        left_keys = [leftmost_columns.index(col) for col in on.keys()]
+        right_keys = [rightmost_columns.index(col) for col in on.values()]
+
+        tables = [side.table_name for side in (leftmost, rightmost) if not isinstance(side, Relation)]
+
+        def read(side, side_condition):
+            # filter both sides by the constant conditions before joining
+            #  relations are streamed, tables are copied so that the rows
+            #  don't change once their locks are released
+            found = self._filter(side, side_condition)
+            if isinstance(side, Relation):
+                return found
+            if side.columnar or side.tuple_rows:
+                return list(found)
+            return [list(row) for row in found]
+
+        def rows():
+            # The tables are only read locked while their rows are copied,
+            #  so that they can be changed while the join is read, and a
+            #  join left open doesn't hold up writers. Relations lock their
+            #  own tables as they are read.
+            with self._locked(tables):
+                left_rows = read(leftmost, left_condition)
+                right_rows = read(rightmost, right_condition)
+            if on:
+                if (self.scanner is not None and isinstance(left_rows, list) and isinstance(right_rows, list)
+                        and self.scanner.wants(max(len(left_rows), len(right_rows)))):
+                    yield from self.scanner.hash_join(left_rows, right_rows, left_keys, right_keys, right_extra, how)
+                else:
+                    yield from self._hash_join(left_rows, right_rows, left_keys, right_keys, right_extra, how)
+            else:
+                yield from self._cross_join(left_rows, right_rows, right_extra, how)
+
+        if self.cache is not None and len(tables) == 2:
+            key = ('join', *tables, repr(condition), repr(on), how)
+            rows = self._cached(key, tables, rows)
+
+        relation = Relation(temp_name, cols, rows)
+        if not persist:
+            return relation
+
+        # turn the joined rows into a table with a single write
         self.add_table(table_name=temp_name, columns=cols)
-        for row in joined:
-            self.insert_into_table(temp_name, row)
+        _, rejected = self.insert_many(temp_name, relation)
+        if rejected:
+            # a table missing some of the joined rows would be wrong
+            self.remove_table(temp_name)
+            position, row, reason = rejected[0]
+            raise ValueError(f"{len(rejected)} joined rows don't fit table {temp_name}, "
+                             f"the first at {position}: {reason}")
+        return self.get_table(temp_name)
+
+    def _invalidate(self, table: Table):
+        self.cache.invalidate(table.table_name)
+
+    def _cached(self, key, table_names: List[str], rows):
+        '''
+        Wraps the rows function of a query so that its result is read from
+            the cache when none of table_names changed since it was stored.
+
+        The whole result is read at once on a miss, under the read locks
+            of the tables, so that it is stored along with the versions of
+            the tables it was read from.
+        '''
+        def cached_rows():
+            with self._locked(table_names):
+                versions = tuple(self.tables[name].version for name in table_names)
+                found = self.cache.get(key, versions)
+                if found is None:
+                    found = list(rows())
+                    self.cache.put(key, table_names, versions, found)
+            # The cached rows are copied, so that the caller can't change them
+            for row in found:
+                yield list(row)
+        return cached_rows
 
+    def _filter(self, table, condition: Dict[str, Any]):
+        '''
+        Returns the rows of a table or relation that equal every value in condition.
+
+        Tables give back a list, relations a lazy iterator.
+        '''
+        columns = list(table.columns.keys())
+        cond_index = [(columns.index(col), val) for col, val in condition.items()]
+        if isinstance(table, Relation):
+            return (row for row in table if all(row[idx] == val for idx, val in cond_index))
+
+        data = table.data
+        if not condition:
+            return data
+        positions = table.candidates(condition)
+        if positions is not None:
+            data = table.rows_at(positions)
+        return filter_rows(data, [idx for idx, val in cond_index], [val for idx, val in cond_index])
+
+    @staticmethod
+    def _cross_join(left_rows, right_rows, right_extra, how):
+        '''
+        Pairs every left row with every right row.
+        '''
+        right_rows = [[r_row[idx] for idx in right_extra] for r_row in right_rows]
+        for row in left_rows:
+            for extra in right_rows:
+                yield list(row) + extra
+            if how == 'left' and not right_rows:
+                yield list(row) + [None] * len(right_extra)
+
+    @staticmethod
+    def _hash_join(left_rows, right_rows, left_keys, right_keys, right_extra, how):
+        '''
+        Equi-joins two collections of rows, yielding the joined rows.
+
+        The hash table is built on the smaller side and probed with the
+            larger one. A lazy input (a relation) is always the probe side,
+            so it is streamed rather than held in memory. None never matches
+            anything, like NULL in SQL.
+        '''
+        def key_func(positions):
+            if len(positions) == 1:
+                position = positions[0]
+                return lambda row: row[position]
+            return lambda row: tuple(row[position] for position in positions)
+
+        def has_null(key):
+            return key is None or (isinstance(key, tuple) and None in key)
+
+        left_key = key_func(left_keys)
+        right_key = key_func(right_keys)
+        padding = [None] * len(right_extra)
+
+        if not isinstance(left_rows, list):
+            build_right = True
+        elif not isinstance(right_rows, list):
+            build_right = False
+        else:
+            build_right = len(right_rows) <= len(left_rows)
+
+        if build_right:
+            # build on the right, probe with the left
+            buckets = {}
+            for r_row in right_rows:
+                key = right_key(r_row)
+                if not has_null(key):
+                    buckets.setdefault(key, []).append([r_row[idx] for idx in right_extra])
+            for row in left_rows:
+                key = left_key(row)
+                matches = None if has_null(key) else buckets.get(key)
+                if matches:
+                    for extra in matches:
+                        yield list(row) + extra
+                elif how == 'left':
+                    yield list(row) + padding
+        else:
+            # build on the left, probe with the right
+            buckets = {}
+            for position, row in enumerate(left_rows):
+                key = left_key(row)
+                if not has_null(key):
+                    buckets.setdefault(key, []).append(position)
+            matched = set()
+            for r_row in right_rows:
+                key = right_key(r_row)
+                positions = None if has_null(key) else buckets.get(key)
+                if positions:
+                    extra = [r_row[idx] for idx in right_extra]
+                    for position in positions:
+                        yield list(left_rows[position]) + extra
+                    matched.update(positions)
+            if how == 'left':
+                for position, row in enumerate(left_rows):
+                    if position not in matched:
+                        yield list(row) + padding
 
     def insert_into_table(self, table_name: str, row: List[Any]):
-        table = self.get_table(table_name)
-        insert_data = table.prep_insert_row(row)
+        '''
+        Inserts a row into a table.
+
+        Raises:
+            ValueError: If the row doesn't fit the table schema, repeats a
+                primary key or unique value, or references a parent row
+                that doesn't exist.
+        '''
+        with self._exclusive(), self._locked([table_name], write=True):
+            table = self.get_table(table_name)
+            insert_data = table.prep_insert_row(row)
 
-        logger.debug(f"Inserting {insert_data} into {table_name} with {list(table.columns.keys())}")
+            logger.debug(f"Inserting {insert_data} into {table_name} with {list(table.columns.keys())}")
 
-        # check for a parent table
-        for column, values in table.columns.items():
-            if values['FK']:
-                fk_column = values['FK']['column']
-                parent_table = values['FK']['table']
+            # check for a parent table
+            try:
+                self._check_foreign_keys(table, insert_data)
+            except ValueError as e:
+                logger.info(f"Row {insert_data} not inserted into {table_name}.")
+                logger.debug(f"{e} Did not insert.")
+                raise
+
+            table.append_row(insert_data)
+            table.persist()
+        self._maybe_flush()
 
-                # get the index of column in both tables
-                parent_table_index = list(self.get_table(parent_table).columns.keys()).index(fk_column)
-                table_index = list(table.columns.keys()).index(column)
+    def _check_foreign_keys(self, table: Table, row: List[Any]):
+        '''
+        Checks that every foreign key value of a prepared row exists in its parent table.
 
-                # check if the parent table has the value
-                parent_table_data = self.get_table(parent_table).load_data()['data']
-                parent_table_values = [row[parent_table_index] for row in parent_table_data]
+        Foreign keys always reference the parent's primary key, so each check is a
+            single probe of the parent's primary key index. None passes the check,
+            since nullability is already enforced by `Table.prep_insert_row`.
 
-                if row[table_index] not in parent_table_values:
-                    # ignore and move on
-                    logger.info(f"Row {row} not inserted into {table_name}.")
-                    logger.debug(f"Value {row[table_index]} not found in parent table {parent_table}. Did not insert.")
-                    return
+        Raises:
+            ValueError: If a value is not found in its parent table.
+        '''
+        for table_index, values in enumerate(table.columns.values()):
+            if values['FK'] and row[table_index] is not None:
+                parent_table = self.get_table(values['FK']['table'])
+                if row[table_index] not in parent_table.pk_index:
+                    raise ValueError(f"Value {row[table_index]} not found in parent table {parent_table}.")
 
-        table.insert_row(insert_data)
+    def insert_many(self, table_name: str, rows):
+        '''
+        Inserts many rows into a table with a single write.
 
-    def update_table(self, table_name, column_names: List[str], column_values: List[Any], conditional_column_name: str, conditional_column_value: Any):
+        Types, nullability, primary key uniqueness (including duplicates
+            within rows), auto-increment values and foreign keys are all
+            checked in one pass over the rows. Foreign keys are probed
+            against the primary key index of their parent table.
 
-        table = self.get_table(table_name)
-        prev_cols = list(table.columns.keys())
-        counter, prev_vals = table.update_row(column_names, column_values, conditional_column_name, conditional_column_value)
+        Args:
+            table_name (str): The name of the table.
+            rows (Iterable[List[Any]]): The rows to insert, as a list
+                or any other iterable.
 
-        logger.info(f"{counter} updates made to {table_name} where {conditional_column_name} = {conditional_column_value} from {prev_vals} to {column_values}")
+        Returns:
+            Tuple[int, List[Tuple[int, List[Any], str]]]: The number of rows
+                inserted, and a (position in rows, row, reason) tuple for every
+                row that was rejected.
+        '''
+        if isinstance(rows, Relation):
+            # A relation read locks its own tables, which must not be
+            #  locked after the tables of this statement
+            rows = list(rows)
+        with self._exclusive(), self._locked([table_name], write=True):
+            table = self.get_table(table_name)
 
-        self.handle_fk_updates(table_name, column_names, column_values, prev_cols, prev_vals)
+            has_fk = any(values['FK'] for values in table.columns.values())
+            check_fk = (lambda row: self._check_foreign_keys(table, row)) if has_fk else None
+
+            inserted, rejected = table.insert_rows(rows, check_fk)
+
+        logger.info(f"{len(inserted)} rows inserted into {table_name}, {len(rejected)} rejected.")
+        for position, row, reason in rejected:
+            logger.debug(f"Row {position} {row} not inserted into {table_name}: {reason}")
+
+        self._maybe_flush()
+        return len(inserted), rejected
+
+    def update_table(self, table_name, column_names: List[str], column_values: List[Any], conditional_column_name: str = None, conditional_column_value: Any = None,
+                     where: Predicate = None):
+        '''
+        Updates the rows of a table where conditional_column_name equals
+            conditional_column_value, or the rows matching the `where`
+            predicate, and applies the foreign key ON UPDATE actions.
+        '''
+        with self._exclusive(), self._locked([table_name], write=True), self._deferred(self._cascade_tables(table_name)):
+            table = self.get_table(table_name)
+            prev_cols = list(table.columns.keys())
+            counter, prev_vals = table.update_row(column_names, column_values, conditional_column_name, conditional_column_value, where=where)
+
+            condition = where if where is not None else f"{conditional_column_name} = {conditional_column_value}"
+            logger.info(f"{counter} updates made to {table_name} where {condition} from {prev_vals} to {column_values}")
+
+            self.handle_fk_updates(table_name, column_names, column_values, prev_cols, prev_vals)
+        self._maybe_flush()
 
     def handle_fk_updates(self, table_name, column_names, column_values, prev_cols, prev_vals):
+        '''
+        Applies the ON UPDATE actions of the tables referencing table_name.
 
-        prev_table = self.get_table(table_name)
-        for potential_child_table in self.tables:
-            if potential_child_table == table_name:
-                continue
-            pct = self.get_table(potential_child_table)
+        Args:
+            table_name (str): The updated parent table.
+            column_names (List[str]): The updated columns.
+            column_values (List[Any]): The new values of the updated columns.
+            prev_cols (List[str]): The columns of the parent table.
+            prev_vals (List[List[Any]]): The updated rows as they were before the update.
+        '''
+        changes = {}
+        for column, value in zip(column_names, column_values):
+            prev_column_index = prev_cols.index(column)
+            changes[column] = {
+                prev_val[prev_column_index]: value for prev_val in prev_vals
+                if prev_val[prev_column_index] != value
+            }
+        self._cascade_update(table_name, changes, set())
 
-            for child_column, child_values in pct.columns.items():
-                if child_values['FK'] and child_values['FK']['table'] == table_name:
-                    parent_column = child_values['FK']['column']
+    def _cascade_update(self, table_name: str, changes: Dict[str, Dict[Any, Any]], visited: set):
+        '''
+        Propagates changed parent keys through the foreign key graph.
 
-                    for column, value, prev_val in zip(column_names, column_values, prev_vals):
-                        if not child_values['FK']['column'] == column:
-                            continue
+        Every referencing column is updated in one batch for all of the
+            changed keys, and the changes it causes are propagated in turn.
 
-                        fk_column_index = list(pct.columns.keys()).index(child_column)
-                        prev_column_index = list(prev_table.columns.keys()).index(parent_column)
+        Args:
+            table_name (str): The parent table.
+            changes (Dict[str, Dict[Any, Any]]): For each changed column,
+                a mapping from old value to new value.
+            visited (set): The (child table, child column) pairs already
+                cascaded into, which guards against cycles.
+        '''
+        for child_name, child_column, parent_column in self.fk_children.get(table_name, []):
+            mapping = changes.get(parent_column)
+            if not mapping or child_name == table_name or (child_name, child_column) in visited:
+                continue
+            pct = self.get_table(child_name)
+            action = pct.columns[child_column]['FK']['on_update']
+            if action not in ['cascade', 'set_null']:
+                continue
 
-                        logger.debug(f"Updating {potential_child_table}.{child_column} where {table_name}.{parent_column} = {prev_val[prev_column_index]}")
+            positions = pct.find_positions_in(child_column, mapping.keys())
+            if not positions:
+                continue
+            fk_column_index = list(pct.columns.keys()).index(child_column)
+            if action == 'cascade':
+                values = [mapping[pct.data[position][fk_column_index]] for position in positions]
+            else:
+                values = [None] * len(positions)
 
-                        if child_values['FK']['on_update'] == 'cascade':
-                            for i, row in enumerate(pct.load_data()['data']):
-                                if row[fk_column_index] == prev_val[prev_column_index]:
-                                        pct.update_row([child_column], [value], child_column, row[fk_column_index])
-                        elif child_values['FK']['on_update'] == 'set_null':
-                            for i, row in enumerate(pct.load_data()['data']):
-                                if row[fk_column_index] == prev_val[prev_column_index]:
-                                    pct.update_row([child_column], [None], child_column, row[fk_column_index])
+            logger.debug(f"Updating {len(positions)} rows of {child_name}.{child_column} after {table_name}.{parent_column} changed ({action})")
+            prev_rows = pct.update_positions(positions, child_column, values)
 
+            child_changes = {child_column: {
+                prev_row[fk_column_index]: value for prev_row, value in zip(prev_rows, values)
+            }}
+            self._cascade_update(child_name, child_changes, visited | {(child_name, child_column)})
 
-    def delete_from_table(self, table_name: str, column_name: str, column_value: Any):
-        table = self.get_table(table_name)
-        counter = table.delete_row(column_name, column_value)
+    def delete_from_table(self, table_name: str, column_name: str = None, column_value: Any = None, where: Predicate = None):
+        '''
+        Deletes the rows of a table where the primary key column_name equals
+            column_value, or the rows matching the `where` predicate, and
+            applies the foreign key ON DELETE actions.
+        '''
+        with self._exclusive(), self._locked([table_name], write=True), self._deferred(self._cascade_tables(table_name)):
+            table = self.get_table(table_name)
+            if where is not None:
+                deleted = table.delete_where(where)
+                condition = where
+            else:
+                deleted = table.delete_rows(column_name, column_value)
+                condition = f"{column_name} = {column_value}"
 
-        logger.info(f"{counter} rows deleted from {table_name} where {column_name} = {column_value}")
+            logger.info(f"{len(deleted)} rows deleted from {table_name} where {condition}")
 
-        self.handle_fk_deletes(table_name, column_name, column_value)
+            self.handle_fk_deletes(table_name, deleted)
+        self._maybe_flush()
 
-    def handle_fk_deletes(self, table_name, column_name, column_value):
+    def handle_fk_deletes(self, table_name: str, deleted: List[List[Any]], visited: set = None):
+        '''
+        Applies the ON DELETE actions of the tables referencing table_name.
 
-        table = self.get_table(table_name)
-        for potential_child_table in self.tables:
-            if potential_child_table == table_name:
+        Every referencing table is handled in one batch for all of the deleted
+            keys. Cascaded deletes are followed through the foreign key graph,
+            so deleting a user also deletes the comments on the user's posts.
+
+        Args:
+            table_name (str): The parent table.
+            deleted (List[List[Any]]): The rows deleted from the parent table.
+            visited (set): The (child table, child column) pairs already
+                cascaded into, which guards against cycles.
+        '''
+        if not deleted:
+            return
+        visited = visited or set()
+        columns = list(self.get_table(table_name).columns.keys())
+        for child_name, child_column, parent_column in self.fk_children.get(table_name, []):
+            if child_name == table_name or (child_name, child_column) in visited:
+                continue
+            pct = self.get_table(child_name)
+            action = pct.columns[child_column]['FK']['on_delete']
+            if action not in ['cascade', 'set_null']:
                 continue
-            pct = self.get_table(potential_child_table)
-            for child_column, child_values in pct.columns.items():
-                if child_values['FK'] and child_values['FK']['table'] == table_name:
-                    parent_column = child_values['FK']['column']
-
-                    if not parent_column == column_name:
-                        continue
-
-                    fk_column_index = list(pct.columns.keys()).index(child_column)
-                    if child_values['FK']['on_delete'] == 'cascade':
-                        for i, row in enumerate(pct.load_data()['data']):
-                            if row[fk_column_index] == column_value:
-                                logger.debug(f"Deleting row in {potential_child_table} where {child_column} = {column_value}")
-                                pct.delete_row(child_column, column_value, True)
-                    elif child_values['FK']['on_delete'] == 'set_null':
-                        for i, row in enumerate(pct.load_data()['data']):
-                            if row[fk_column_index] == column_value:
-                                logger.debug(f"Setting row in {potential_child_table} where {child_column} = {column_value} to NULL")
-                                pct.update_row([child_column], [None], child_column, column_value)
+
+            parent_column_index = columns.index(parent_column)
+            keys = {row[parent_column_index] for row in deleted}
+            keys.discard(None)
+            positions = pct.find_positions_in(child_column, keys)
+            if not positions:
+                continue
+
+            if action == 'cascade':
+                logger.debug(f"Deleting {len(positions)} rows in {child_name} where {child_column} in {keys}")
+                child_deleted = pct.delete_positions(positions)
+                self.handle_fk_deletes(child_name, child_deleted, visited | {(child_name, child_column)})
+            else:
+                logger.debug(f"Setting {len(positions)} rows in {child_name} where {child_column} in {keys} to NULL")
+                prev_rows = pct.update_positions(positions, child_column, [None] * len(positions))
+                fk_column_index = list(pct.columns.keys()).index(child_column)
+                child_changes = {child_column: {prev_row[fk_column_index]: None for prev_row in prev_rows}}
+                self._cascade_update(child_name, child_changes, visited | {(child_name, child_column)})
+
+    @contextmanager
+    def _deferred(self, table_names):
+        '''
+        Holds back the writes of the autosaving tables among table_names
+            until the block ends, then writes the dirty ones in a single pass.
+            The caller holds their write locks.
+        '''
+        autosaving = [self.tables[table_name] for table_name in table_names if self.tables[table_name].autosave]
+        for table in autosaving:
+            table.autosave = False
+        try:
+            yield
+        finally:
+            for table in autosaving:
+                table.autosave = True
+            dirty = [table for table in autosaving if table.dirty]
+            if self.journal is None and dirty:
+                self._write_tables(dirty)
+
+    def _write_tables(self, tables: List[Table]):
+        '''
+        Writes the unsaved changes of tables in a single pass, along with
+            the sequence number of the last journal record they hold.
+        '''
+        lsn = self.journal.lsn if self.journal is not None else None
+        with self.storage.locked([table.table_name for table in tables]):
+            self.storage.write_data(self.path, {table.table_name: table.unsaved_changes() for table in tables}, lsn)
+        for table in tables:
+            table.mark_clean()
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Runs a block of changes as a single atomic unit.
+
+        Inside the block, changes are only made in memory: no table is
+            written and nothing is appended to the journal. The first
+            change to a table takes a snapshot of its rows. If the block
+            raises, every changed table is restored from its snapshot and
+            the exception propagates. Otherwise every change is written at
+            once by `save` when the block ends, so many small statements
+            cost a single write.
+
+        Reads inside the block see its changes. Tables and indexes can't be
+            added or removed, and `save` can't be called, until the block ends. The
+            block has the database to itself: statements from other threads
+            wait until it ends.
+
+        Example:
+            with db.transaction():
+                db.insert_into_table('accounts', [1, 100])
+                db.update_table('accounts', ['balance'], [50], 'id', 2)
+
+        Raises:
+            ValueError: If a transaction is already running.
+        '''
+        with self._exclusive(), self.catalog_lock.write_locked():
+            if self._transaction is not None:
+                raise ValueError("A transaction is already running.")
+            snapshots = {}
+
+            def take_snapshot(table: Table):
+                if table.table_name not in snapshots:
+                    snapshots[table.table_name] = table.snapshot()
+
+            states = {table_name: (table.autosave, table.journal) for table_name, table in self.tables.items()}
+            for table in self.tables.values():
+                table.autosave = False
+                table.journal = None
+                table.change_hooks.append(take_snapshot)
+            self._transaction = snapshots
+            try:
+                yield self
+            except BaseException:
+                for table_name, snapshot in snapshots.items():
+                    self.tables[table_name].restore(snapshot)
+                logger.info(f"Transaction rolled back, {len(snapshots)} tables restored.")
+                raise
+            finally:
+                self._transaction = None
+                for table_name, (autosave, journal) in states.items():
+                    table = self.tables[table_name]
+                    table.autosave = autosave
+                    table.journal = journal
+                    table.change_hooks.remove(take_snapshot)
+            self.save()
 
     def save(self):
-        for table_name, table in self.tables.items():
-            table.save_data()
-        logger.info(f'Tables saved to {self.path}.')
+        '''
+        Writes every dirty table to the database file in a single pass
+            and empties the journal, if any.
+
+        Raises:
+            ValueError: If a transaction is running.
+        '''
+        with self._exclusive(), self._locked(list(self.tables)):
+            if self._transaction is not None:
+                raise ValueError("Can't save in the middle of a transaction.")
+            # The changes made so far are written now
+            self._cancel_flush()
+            dirty = [table for table in self.tables.values() if table.dirty]
+            if dirty:
+                self._write_tables(dirty)
+            if self.journal is not None:
+                self.journal.truncate()
+        self.last_flush = time.monotonic()
+        logger.info(f'{len(dirty)} tables saved to {self.path}.')
+
+    def commit(self):
+        '''
+        Writes all pending changes to the database file.
+        '''
+        self.save()
 
     def load(self):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
-        for table_name, table_data in data.items():
-            self.add_table(table_name, table_data['columns'])
-            table = self.get_table(table_name)
-            table.load_data(table_data['data'])
+        with self._exclusive(), self.catalog_lock.write_locked():
+            # Only the schemas are read, the rows of each table are read
+            #  on first access
+            data = self.storage.read_catalog(self.path)
+            for table_name, table_data in data.items():
+                self._add_table(table_name, table_data['columns'], data)
 
     def reset(self):
         for table_name in self.list_tables():
@@ -361,5 +1255,9 @@ class Database:
         # close any temporary tables
         self.clear_temp_tables()
         self.save()
+        if self.journal is not None:
+            self.journal.close()
+        if self.shared is not None:
+            self.shared.close()
         logger.info("Database closed.")
         return self
\ No newline at end of file
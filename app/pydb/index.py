@@ -0,0 +1,369 @@
+from typing import Any, Dict, Iterator, List, Tuple
+from bisect import bisect_left, bisect_right, insort
+
+
+class HashIndex:
+    '''
+    A hash index from column values to row positions in a table.
+
+    Tables use a HashIndex on their primary key so that lookups,
+        uniqueness checks and single-row updates and deletes don't
+        have to scan every row.
+
+    The index stores positions in `Table.data`, so it has to be
+        told about every row that is added, changed or removed.
+
+    Args:
+        column_positions (List[int]): The positions of the indexed
+            columns within a row.
+        unique (bool): Whether every key maps to at most one row.
+
+    Attributes:
+        column_positions (List[int]): The positions of the indexed
+            columns within a row.
+        unique (bool): Whether every key maps to at most one row.
+        entries (Dict[Any, Any]): The key to position mapping. For a
+            unique index each key maps to a single position, otherwise
+            to a list of positions.
+    '''
+    def __init__(self, column_positions: List[int], unique: bool = False):
+        self.column_positions = list(column_positions)
+        self.unique = unique
+        self.entries: Dict[Any, Any] = {}
+
+    def __repr__(self):
+        return f"HashIndex(columns={self.column_positions}, unique={self.unique}, keys={len(self.entries)})"
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def key(self, row: List[Any]) -> Any:
+        '''
+        Returns the key of a row. Single column indexes use the bare
+            value, multi column indexes a tuple of values.
+        '''
+        if len(self.column_positions) == 1:
+            return row[self.column_positions[0]]
+        return tuple(row[position] for position in self.column_positions)
+
+    def build(self, data: List[List[Any]]):
+        '''
+        Rebuilds the index from every row in data.
+        '''
+        self.entries = {}
+        for position, row in enumerate(data):
+            self.add(row, position)
+
+    def lookup(self, key: Any) -> List[int]:
+        '''
+        Returns the positions of the rows with the given key, in table order.
+        '''
+        found = self.entries.get(key)
+        if found is None:
+            return []
+        if self.unique:
+            return [found]
+        return list(found)
+
+    def add(self, row: List[Any], position: int):
+        key = self.key(row)
+        if self.unique:
+            self.entries[key] = position
+        else:
+            self.entries.setdefault(key, []).append(position)
+
+    def discard(self, row: List[Any], position: int):
+        key = self.key(row)
+        if self.unique:
+            if self.entries.get(key) == position:
+                del self.entries[key]
+        else:
+            positions = self.entries.get(key)
+            if positions and position in positions:
+                positions.remove(position)
+                if not positions:
+                    del self.entries[key]
+
+    def update(self, old_row: List[Any], new_row: List[Any], position: int):
+        '''
+        Re-keys the row at position after it was changed in place.
+        '''
+        if self.key(old_row) == self.key(new_row):
+            return
+        self.discard(old_row, position)
+        self.add(new_row, position)
+        if not self.unique:
+            self.entries[self.key(new_row)].sort()
+
+    def remove(self, removed: List[Tuple[int, List[Any]]], data: List[List[Any]]):
+        '''
+        Updates the index after rows were deleted from data.
+
+        Args:
+            removed (List[Tuple[int, List[Any]]]): The (position, row) pairs
+                that were deleted, positions as they were before the delete.
+            data (List[List[Any]]): The rows left in the table.
+        '''
+        if not removed:
+            return
+        for position, row in removed:
+            self.discard(row, position)
+
+        # Every row after a deleted one moved up by one, and deleting from
+        #  the end of the table doesn't move any other row. The shift keeps
+        #  the positions of each key in table order
+        gone = sorted(position for position, row in removed)
+        first = gone[0]
+        if first >= len(data):
+            return
+        if len(gone) == 1:
+            shift = lambda position: position - (position > first)
+        else:
+            shift = lambda position: position - bisect_left(gone, position)
+        if self.unique:
+            for key, position in self.entries.items():
+                if position > first:
+                    self.entries[key] = shift(position)
+        else:
+            for key, positions in self.entries.items():
+                if positions[-1] > first:
+                    self.entries[key] = [shift(position) for position in positions]
+
+
+def has_null(key: Any) -> bool:
+    return key is None or (isinstance(key, tuple) and None in key)
+
+
+class SortedIndex:
+    '''
+    An ordered index from column values to row positions in a table.
+
+    Besides the lookups of a HashIndex, a SortedIndex answers range scans,
+        min/max and ordered iteration in O(log n + k), using binary search
+        over its sorted keys. Tables use it for range predicates and to
+        return rows in column order.
+
+    Keys holding None can't be ordered against other keys, so they are
+        kept apart and sort before every other key.
+
+    Args:
+        column_positions (List[int]): The positions of the indexed
+            columns within a row.
+        unique (bool): Whether every key maps to at most one row.
+
+    Attributes:
+        column_positions (List[int]): The positions of the indexed
+            columns within a row.
+        unique (bool): Whether every key maps to at most one row.
+        keys (List[Any]): The keys without None, in ascending order.
+        positions (List[int]): The row position of every entry of keys.
+            Rows with equal keys are in table order.
+        null_entries (Dict[Any, List[int]]): The positions of the rows
+            whose key holds None, by key.
+    '''
+    def __init__(self, column_positions: List[int], unique: bool = False):
+        self.column_positions = list(column_positions)
+        self.unique = unique
+        self.keys: List[Any] = []
+        self.positions: List[int] = []
+        self.null_entries: Dict[Any, List[int]] = {}
+
+    def __repr__(self):
+        return f"SortedIndex(columns={self.column_positions}, unique={self.unique}, keys={len(self)})"
+
+    def __len__(self):
+        return len(self.keys) + sum(map(len, self.null_entries.values()))
+
+    def __contains__(self, key):
+        if has_null(key):
+            return key in self.null_entries
+        low = bisect_left(self.keys, key)
+        return low < len(self.keys) and self.keys[low] == key
+
+    def key(self, row: List[Any]) -> Any:
+        '''
+        Returns the key of a row. Single column indexes use the bare
+            value, multi column indexes a tuple of values.
+        '''
+        if len(self.column_positions) == 1:
+            return row[self.column_positions[0]]
+        return tuple(row[position] for position in self.column_positions)
+
+    def build(self, data: List[List[Any]]):
+        '''
+        Rebuilds the index from every row in data with a single sort.
+        '''
+        self.null_entries = {}
+        entries = []
+        for position, row in enumerate(data):
+            key = self.key(row)
+            if has_null(key):
+                self.null_entries.setdefault(key, []).append(position)
+            else:
+                entries.append((key, position))
+        entries.sort()
+        self.keys = [key for key, position in entries]
+        self.positions = [position for key, position in entries]
+
+    def lookup(self, key: Any) -> List[int]:
+        '''
+        Returns the positions of the rows with the given key, in table order.
+        '''
+        if has_null(key):
+            return list(self.null_entries.get(key, []))
+        return self.positions[bisect_left(self.keys, key):bisect_right(self.keys, key)]
+
+    def add(self, row: List[Any], position: int):
+        key = self.key(row)
+        if has_null(key):
+            insort(self.null_entries.setdefault(key, []), position)
+            return
+        low = bisect_left(self.keys, key)
+        high = bisect_right(self.keys, key, low)
+        at = bisect_left(self.positions, position, low, high)
+        self.keys.insert(at, key)
+        self.positions.insert(at, position)
+
+    def discard(self, row: List[Any], position: int):
+        key = self.key(row)
+        if has_null(key):
+            positions = self.null_entries.get(key)
+            if positions and position in positions:
+                positions.remove(position)
+                if not positions:
+                    del self.null_entries[key]
+            return
+        low = bisect_left(self.keys, key)
+        high = bisect_right(self.keys, key, low)
+        at = bisect_left(self.positions, position, low, high)
+        if at < high and self.positions[at] == position:
+            del self.keys[at]
+            del self.positions[at]
+
+    def update(self, old_row: List[Any], new_row: List[Any], position: int):
+        '''
+        Re-keys the row at position after it was changed in place.
+        '''
+        if self.key(old_row) == self.key(new_row):
+            return
+        self.discard(old_row, position)
+        self.add(new_row, position)
+
+    def remove(self, removed: List[Tuple[int, List[Any]]], data: List[List[Any]]):
+        '''
+        Updates the index after rows were deleted from data.
+
+        Args:
+            removed (List[Tuple[int, List[Any]]]): The (position, row) pairs
+                that were deleted, positions as they were before the delete.
+            data (List[List[Any]]): The rows left in the table.
+        '''
+        if not removed:
+            return
+        for position, row in removed:
+            self.discard(row, position)
+
+        # Every row after a deleted one moved up by one. The shift keeps
+        #  rows with equal keys in table order, so no entry has to move
+        gone = sorted(position for position, row in removed)
+        if gone[0] >= len(data):
+            return
+        if len(gone) == 1:
+            first = gone[0]
+            shift = lambda positions: [position - (position > first) for position in positions]
+        else:
+            shift = lambda positions: [position - bisect_left(gone, position) for position in positions]
+        self.positions = shift(self.positions)
+        for key, positions in self.null_entries.items():
+            self.null_entries[key] = shift(positions)
+
+    def range(self, low: Any = None, high: Any = None, include_low: bool = True, include_high: bool = True,
+              reverse: bool = False) -> List[int]:
+        '''
+        Returns the positions of the rows with a key between low and high,
+            in key order. Keys holding None are never in a range.
+
+        Args:
+            low (Any): The lower bound, or None for no lower bound.
+            high (Any): The upper bound, or None for no upper bound.
+            include_low (bool): Whether keys equal to low are included.
+            include_high (bool): Whether keys equal to high are included.
+            reverse (bool): Whether to return the positions in descending key
+                order. Rows with equal keys stay in table order.
+        '''
+        return list(self.scan(low, high, include_low, include_high, reverse))
+
+    def scan(self, low: Any = None, high: Any = None, include_low: bool = True, include_high: bool = True,
+             reverse: bool = False) -> Iterator[int]:
+        '''
+        Lazily yields the positions `range` returns, so that a caller who
+            stops early only pays for the entries it reads.
+        '''
+        start = 0
+        stop = len(self.keys)
+        if low is not None:
+            start = (bisect_left if include_low else bisect_right)(self.keys, low)
+        if high is not None:
+            stop = (bisect_right if include_high else bisect_left)(self.keys, high, start)
+        if reverse:
+            return self._descending(start, stop)
+        return (self.positions[at] for at in range(start, stop))
+
+    def _descending(self, start: int, stop: int) -> Iterator[int]:
+        '''
+        Yields the positions of the entries from start to stop in descending
+            key order, and the rows with equal keys in table order, as a
+            stable sort in descending order would.
+        '''
+        while stop > start:
+            first = bisect_left(self.keys, self.keys[stop - 1], start, stop)
+            yield from self.positions[first:stop]
+            stop = first
+
+    def ordered(self, reverse: bool = False) -> List[int]:
+        '''
+        Returns the positions of every row in key order, rows whose key
+            holds None first (last when reverse is set). Rows with equal
+            keys are in table order either way.
+        '''
+        return list(self.iter_ordered(reverse))
+
+    def iter_ordered(self, reverse: bool = False, after: Any = None) -> Iterator[int]:
+        '''
+        Lazily yields the positions of the rows in key order, rows whose key
+            holds None first (last when reverse is set). Rows with equal
+            keys are in table order either way.
+
+        Args:
+            reverse (bool): Whether to yield the positions in descending key order.
+            after (Any): Only yield the rows whose key comes after this key
+                in the requested order. Rows whose key holds None never do.
+        '''
+        if after is not None:
+            if reverse:
+                yield from self.scan(high=after, include_high=False, reverse=True)
+            else:
+                yield from self.scan(low=after, include_low=False)
+            return
+        nulls = sorted(position for positions in self.null_entries.values() for position in positions)
+        if reverse:
+            yield from self.scan(reverse=True)
+            yield from nulls
+        else:
+            yield from nulls
+            yield from self.scan()
+
+    def min(self) -> Any:
+        '''
+        Returns the smallest key without None, or None if there is none.
+        '''
+        return self.keys[0] if self.keys else None
+
+    def max(self) -> Any:
+        '''
+        Returns the largest key without None, or None if there is none.
+        '''
+        return self.keys[-1] if self.keys else None
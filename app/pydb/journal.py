@@ -0,0 +1,143 @@
+from typing import Any, Dict, List
+
+from os import path
+
+import json
+import os
+import threading
+
+
+class Journal:
+    '''
+    An append-only write-ahead journal of row changes.
+
+    Instead of rewriting the whole database file on every mutation,
+        each insert, update and delete is appended to the journal
+        as a single compact JSON line. The journal lives next to the
+        database file (`<db path>.journal`) and is folded back into
+        the main snapshot during a checkpoint.
+
+    Each record is a JSON list of the form
+        [lsn, op, table_name, position, row] where lsn is the log
+        sequence number of the record and op is one of 'i' (insert),
+        'u' (update) or 'd' (delete). Positions refer to the table's
+        row list as it was when the record was written, so replaying
+        the records in order against the last snapshot restores the
+        exact state of the database.
+
+    A checkpoint stores the sequence number of the last record along
+        with every table it writes. Replaying skips the records a table
+        already holds, so a crash between writing a snapshot and
+        truncating the journal doesn't apply its records twice.
+
+    Args:
+        path (str): The path to the journal file.
+        checkpoint_interval (int): The number of records after which
+            the journal asks to be checkpointed.
+        sync (bool): Whether to fsync after every record. Slower, but
+            survives an OS crash and not only a process crash.
+
+    Attributes:
+        path (str): The path to the journal file.
+        checkpoint_interval (int): The number of records after which
+            `needs_checkpoint` returns True.
+        pending (int): The number of records written since the last
+            checkpoint.
+        lsn (int): The sequence number of the last record written.
+            Numbers keep growing across checkpoints.
+    '''
+    def __init__(self, path: str, checkpoint_interval: int = 1000, sync: bool = False):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.sync = sync
+        self.pending = 0
+        self.lsn = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Journal(path='{self.path}', pending={self.pending})"
+
+    def append(self, op: str, table_name: str, position: int, row: List[Any] = None):
+        '''
+        Appends a single change record to the journal.
+        '''
+        with self._lock:
+            self.lsn += 1
+            record = json.dumps([self.lsn, op, table_name, position, row], separators=(',', ':'), default=list) + '\n'
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(record)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self.pending += 1
+
+    def needs_checkpoint(self) -> bool:
+        return self.pending >= self.checkpoint_interval
+
+    def records(self) -> List[List[Any]]:
+        '''
+        Reads every complete record from the journal.
+
+        A torn last line, left behind by a crash in the middle of
+            a write, is ignored.
+        '''
+        if not path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def replay(self, db_data: Dict[str, Any]) -> int:
+        '''
+        Applies the journal records to the db_data loaded from the snapshot.
+
+        Records for tables that no longer exist in the snapshot are skipped,
+            and so are the records a table already holds: those at or below
+            the sequence number stored with it. The sequence number of each
+            changed table is advanced to the last record applied to it.
+
+        Returns:
+            int: The number of records applied.
+        '''
+        applied = 0
+        for lsn, op, table_name, position, row in self.records():
+            self.lsn = max(self.lsn, lsn)
+            table = db_data.get(table_name)
+            if table is None or lsn <= table.get('lsn', 0):
+                continue
+            table['lsn'] = lsn
+            data = table['data']
+            if op == 'i':
+                data.append(row)
+            elif op == 'u':
+                data[position] = row
+            elif op == 'd':
+                del data[position]
+            applied += 1
+        return applied
+
+    def truncate(self):
+        '''
+        Empties the journal. Called once its records are part of the snapshot.
+        '''
+        with self._lock:
+            self._close()
+            with open(self.path, 'w'):
+                pass
+            self.pending = 0
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
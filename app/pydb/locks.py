@@ -0,0 +1,200 @@
+from contextlib import contextmanager
+
+import os
+import struct
+import threading
+
+# Advisory file locks are only available on POSIX systems
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class RWLock:
+    '''
+    A readers-writer lock.
+
+    Any number of threads can hold the lock for reading at once, while
+        a writer holds it alone. Waiting writers go first: once a writer
+        is waiting, new readers wait behind it, so a steady stream of
+        readers can't starve writers.
+
+    The lock is reentrant. A thread holding it can acquire it again in
+        the same mode, and a writer can also acquire it for reading. A
+        reader can't upgrade to a writer, since two readers upgrading at
+        once would wait on each other forever.
+    '''
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+        self._waiting = 0
+
+    def __repr__(self):
+        return f"RWLock(readers={len(self._readers)}, writer={self._writer is not None})"
+
+    def _wait(self, predicate):
+        '''
+        Waits until predicate holds. Called with the condition held.
+        '''
+        if predicate():
+            return
+        self._waiting += 1
+        try:
+            self._condition.wait_for(predicate)
+        finally:
+            self._waiting -= 1
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            self._wait(lambda: self._writer is None and not self._waiting_writers)
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                if self._waiting:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        '''
+        Raises:
+            RuntimeError: If the thread holds the lock for reading only.
+        '''
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writes += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("Can't acquire a write lock while holding a read lock.")
+            self._waiting_writers += 1
+            try:
+                self._wait(lambda: self._writer is None and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writes = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                if self._waiting:
+                    self._condition.notify_all()
+
+    def owned(self) -> bool:
+        '''
+        Returns whether the calling thread holds the lock, in either mode.
+        '''
+        me = threading.get_ident()
+        return self._writer == me or me in self._readers
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class FileLock:
+    '''
+    An advisory lock file coordinating the processes that share a database.
+
+    Writers hold the lock exclusively. The file also holds a generation
+        counter, which a writer increments once it has changed the database,
+        so that a process can tell with a single read whether the database
+        changed since it last loaded it. Reading the counter takes no lock.
+
+    Within a process the lock is reentrant, and the threads holding it
+        exclusively take turns.
+
+    Args:
+        path (str): The path to the lock file, created if it doesn't exist.
+
+    Raises:
+        ValueError: If the platform has no advisory file locks.
+    '''
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise ValueError("File locking is not supported on this platform.")
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __repr__(self):
+        return f"FileLock(path='{self.path}')"
+
+    def generation(self) -> int:
+        '''
+        Returns the number of changes made to the database so far.
+        '''
+        counter = os.pread(self._fd, 8, 0)
+        return struct.unpack('<Q', counter)[0] if len(counter) == 8 else 0
+
+    def bump(self) -> int:
+        '''
+        Increments the generation counter. Called with the lock held exclusively.
+
+        Returns:
+            int: The new generation.
+        '''
+        generation = self.generation() + 1
+        os.pwrite(self._fd, struct.pack('<Q', generation), 0)
+        return generation
+
+    @contextmanager
+    def exclusive(self):
+        with self._lock:
+            if not self._depth:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def shared(self):
+        '''
+        Holds the lock for reading, which only keeps writers out. Does
+            nothing when the process already holds the lock exclusively.
+        '''
+        with self._lock:
+            if self._depth:
+                yield
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self._fd)
@@ -0,0 +1,203 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List
+
+import multiprocessing
+import threading
+
+# The rows a pool of workers scans. Each worker gets them from its
+#  parent when it is forked, so they are neither copied nor pickled.
+_shared = None
+
+
+def _share(value):
+    global _shared
+    _shared = value
+
+
+# The functions below run in the worker processes. Each gets the positions
+#  of a chunk of the shared rows, so that the results of the chunks can be
+#  merged back in table order.
+
+def _filter_chunk(positions, condition, slots: Dict[str, int]) -> List[int]:
+    rows = _shared
+    test = condition.compile(slots)
+    return [position for position in positions if test(rows[position])]
+
+
+def _find_chunk(positions, column_position: int, values: set) -> List[int]:
+    rows = _shared
+    return [position for position in positions if rows[position][column_position] in values]
+
+
+def _has_null(key) -> bool:
+    return key is None or (isinstance(key, tuple) and None in key)
+
+
+def _probe_chunk(positions, key_positions: List[int], right_extra: List[int], probe_left: bool, how: str):
+    '''
+    Probes the hash table of a join with a chunk of the rows of its other side.
+
+    With probe_left, the rows are the left side and the buckets hold the
+        extra columns of the right rows. Otherwise the rows are the right
+        side, the buckets hold the positions of the left rows, and the
+        positions of the left rows that matched are returned too.
+    '''
+    rows, buckets, left_rows = _shared
+    key = itemgetter(*key_positions)
+    joined = []
+    if probe_left:
+        padding = [None] * len(right_extra)
+        for position in positions:
+            row = rows[position]
+            row_key = key(row)
+            matches = None if _has_null(row_key) else buckets.get(row_key)
+            if matches:
+                for extra in matches:
+                    joined.append(list(row) + extra)
+            elif how == 'left':
+                joined.append(list(row) + padding)
+        return joined, None
+
+    matched = set()
+    for position in positions:
+        row = rows[position]
+        row_key = key(row)
+        matches = None if _has_null(row_key) else buckets.get(row_key)
+        if matches:
+            extra = [row[idx] for idx in right_extra]
+            for left_position in matches:
+                joined.append(list(left_rows[left_position]) + extra)
+            matched.update(matches)
+    return joined, matched
+
+
+class ParallelScanner:
+    '''
+    Splits the scans of large tables into chunks evaluated by a pool of processes.
+
+    A pool is forked for each scan, so the workers see the rows as they
+        are in this process without them being copied or pickled; only
+        the positions of the chunks and the results travel between the
+        processes. The results are merged back in table order, so a
+        parallel scan returns exactly what a serial one would. Forking
+        the pool has a cost of its own, so only scans of at least
+        min_rows rows are split.
+
+    A child forked while another thread of the process holds a lock would
+        wait on it forever, so scans stay serial whenever the process runs
+        more than one thread, such as a flush timer, the executor of an
+        `AsyncDatabase` or other threads reading the database.
+
+    Args:
+        workers (int): The number of worker processes.
+        min_rows (int): The number of rows from which a scan is split.
+
+    Raises:
+        ValueError: If workers is less than 1, or the platform can't fork.
+    '''
+    def __init__(self, workers: int, min_rows: int = 100000):
+        if workers < 1:
+            raise ValueError("A parallel scan needs at least one worker.")
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError("Parallel scans are not supported on this platform.")
+        self.workers = workers
+        self.min_rows = min_rows
+
+    def __repr__(self):
+        return f"ParallelScanner(workers={self.workers}, min_rows={self.min_rows})"
+
+    def wants(self, row_count: int) -> bool:
+        '''
+        Returns whether a scan of row_count rows is worth splitting, and
+            can be split safely: forking is only safe with a single thread.
+        '''
+        return row_count >= self.min_rows and threading.active_count() == 1
+
+    def _chunks(self, count: int, positions: List[int] = None) -> List:
+        '''
+        Splits count positions, or the given positions, into chunks, two per
+            worker so that a slow chunk doesn't hold up the others.
+        '''
+        size = -(-count // (self.workers * 2)) or 1
+        if positions is None:
+            return [range(start, min(start + size, count)) for start in range(0, count, size)]
+        return [positions[start:start + size] for start in range(0, count, size)]
+
+    def _map(self, shared, function, chunks, *args) -> List:
+        '''
+        Runs function on every chunk in a pool forked with shared in place.
+        '''
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(min(self.workers, len(chunks)) or 1, mp_context=context,
+                                 initializer=_share, initargs=(shared,)) as executor:
+            return list(executor.map(function, chunks, *(repeat(arg) for arg in args)))
+
+    def filter(self, rows: List[List[Any]], condition, slots: Dict[str, int], positions: List[int] = None) -> List[int]:
+        '''
+        Returns the positions of the rows that satisfy a condition.
+
+        Parameters:
+            rows (List[List[Any]]): The rows of the table.
+            condition (Predicate): The condition, compiled in each worker.
+            slots (Dict[str, int]): The position of each column in a row.
+            positions (List[int]): The candidate positions, or None for
+                every row.
+
+        Returns:
+            List[int]: The matching positions, in the order given.
+        '''
+        count = len(rows) if positions is None else len(positions)
+        found = []
+        for chunk in self._map(rows, _filter_chunk, self._chunks(count, positions), condition, slots):
+            found.extend(chunk)
+        return found
+
+    def find_in(self, rows: List[List[Any]], column_position: int, values: set) -> List[int]:
+        '''
+        Returns the positions of the rows whose column is one of values.
+        '''
+        found = []
+        for chunk in self._map(rows, _find_chunk, self._chunks(len(rows)), column_position, values):
+            found.extend(chunk)
+        return found
+
+    def hash_join(self, left_rows: List[List[Any]], right_rows: List[List[Any]], left_keys: List[int],
+                  right_keys: List[int], right_extra: List[int], how: str) -> Iterator[List[Any]]:
+        '''
+        Equi-joins two lists of rows, like `Database._hash_join`.
+
+        The hash table is built on the smaller side in this process, and
+            chunks of the other side probe it in the workers. The joined
+            rows come out in the same order as from a serial join.
+        '''
+        buckets = {}
+        if len(right_rows) <= len(left_rows):
+            right_key = itemgetter(*right_keys)
+            for r_row in right_rows:
+                key = right_key(r_row)
+                if not _has_null(key):
+                    buckets.setdefault(key, []).append([r_row[idx] for idx in right_extra])
+            chunks = self._map((left_rows, buckets, None), _probe_chunk, self._chunks(len(left_rows)),
+                               left_keys, right_extra, True, how)
+            for joined, _ in chunks:
+                yield from joined
+            return
+
+        left_key = itemgetter(*left_keys)
+        for position, row in enumerate(left_rows):
+            key = left_key(row)
+            if not _has_null(key):
+                buckets.setdefault(key, []).append(position)
+        matched = set()
+        chunks = self._map((right_rows, buckets, left_rows), _probe_chunk, self._chunks(len(right_rows)),
+                           right_keys, right_extra, False, how)
+        for joined, chunk_matched in chunks:
+            yield from joined
+            matched |= chunk_matched
+        if how == 'left':
+            padding = [None] * len(right_extra)
+            for position, row in enumerate(left_rows):
+                if position not in matched:
+                    yield list(row) + padding
@@ -0,0 +1,470 @@
+from typing import Any, Callable, Dict, List, Tuple
+from functools import reduce
+
+import operator
+
+from app.pydb.columnar import ArrayColumn, ColumnStore, DictionaryColumn
+from app.pydb.vectorized import numpy
+
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class Predicate:
+    '''
+    A condition on the columns of a row, built with `Col`.
+
+    Predicates are combined with & (AND), | (OR) and ~ (NOT), or with
+        `And`, `Or` and `Not`:
+
+            (Col('age') >= 18) & Col('country').isin(['NL', 'BE'])
+            Or(Col('score').between(0, 10), Col('score').is_null())
+
+    They are evaluated by the engine in a single pass over the rows,
+        before any row is copied. A None value never satisfies a
+        comparison or BETWEEN, nor IN unless None is one of the values,
+        with the exception of `== None` and `!= None`, which work like
+        IS NULL and IS NOT NULL. Unlike NOT in SQL, `~` matches exactly
+        the rows its predicate doesn't, so `~(Col('age') < 18)` and
+        `~Col('age').isin([18])` both match a None age; combine them with
+        `is_not_null` to leave those rows out.
+    '''
+    def __and__(self, other: 'Predicate') -> 'Predicate':
+        return And(self, other)
+
+    def __or__(self, other: 'Predicate') -> 'Predicate':
+        return Or(self, other)
+
+    def __invert__(self) -> 'Predicate':
+        return Not(self)
+
+    def column_names(self) -> List[str]:
+        '''
+        Returns the names of the columns the predicate reads, without duplicates.
+        '''
+        raise NotImplementedError
+
+    def validate(self, columns: Dict[str, Dict[str, Any]]):
+        '''
+        Checks the predicate against the columns of a table.
+
+        Raises:
+            ValueError: If a column doesn't exist, or a value can't be
+                ordered against the type of its column.
+        '''
+        raise NotImplementedError
+
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        '''
+        Returns a function testing a record, which holds the value of
+            each column at the position given by slots.
+        '''
+        raise NotImplementedError
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        '''
+        Returns a NumPy boolean mask of the rows of store that satisfy the
+            predicate, or None if it can't be evaluated with NumPy.
+        '''
+        return None
+
+    def equalities(self) -> Dict[str, Any]:
+        '''
+        Returns the column == value tests every matching row has to pass,
+            which can be answered by an index.
+        '''
+        return {}
+
+    def ranges(self) -> Dict[str, Tuple[Any, Any, bool, bool]]:
+        '''
+        Returns the (low, high, include_low, include_high) bounds the value
+            of a column has to be in for every matching row, which can be
+            answered by an ordered index. A bound of None means unbounded.
+        '''
+        return {}
+
+
+class Col:
+    '''
+    A column reference, used to build predicates.
+
+    Args:
+        name (str): The name of the column.
+    '''
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"Col('{self.name}')"
+
+    def __eq__(self, value: Any) -> Predicate:
+        return Comparison(self.name, '==', value)
+
+    def __ne__(self, value: Any) -> Predicate:
+        return Comparison(self.name, '!=', value)
+
+    def __lt__(self, value: Any) -> Predicate:
+        return Comparison(self.name, '<', value)
+
+    def __le__(self, value: Any) -> Predicate:
+        return Comparison(self.name, '<=', value)
+
+    def __gt__(self, value: Any) -> Predicate:
+        return Comparison(self.name, '>', value)
+
+    def __ge__(self, value: Any) -> Predicate:
+        return Comparison(self.name, '>=', value)
+
+    __hash__ = None
+
+    def isin(self, values) -> Predicate:
+        return In(self.name, values)
+
+    def between(self, low: Any, high: Any) -> Predicate:
+        '''
+        Both bounds are inclusive, as in SQL.
+        '''
+        return Between(self.name, low, high)
+
+    def is_null(self) -> Predicate:
+        return IsNull(self.name)
+
+    def is_not_null(self) -> Predicate:
+        return Not(IsNull(self.name))
+
+
+def _check_column(columns: Dict[str, Dict[str, Any]], name: str):
+    if name not in columns:
+        raise ValueError(f"Column {name} does not exist in table.")
+
+
+def _check_orderable(columns: Dict[str, Dict[str, Any]], name: str, value: Any):
+    _check_column(columns, name)
+    column_type = type(columns[name]['type'])
+    numbers = (int, float)
+    if isinstance(value, column_type) or (column_type in numbers and type(value) in numbers):
+        return
+    raise ValueError(f"Cannot compare column {name} of type {column_type.__name__} with {value!r}.")
+
+
+def _numeric_view(column, value):
+    '''
+    Returns the NumPy view of an int or float column and a mask of its
+        non-null rows, or None if value can't be compared with it in NumPy.
+    '''
+    if not isinstance(column, ArrayColumn) or type(value) not in (int, float):
+        return None
+    if column.kind is int and type(value) is int and not column.fits(value):
+        return None
+    values = numpy.frombuffer(column.values, dtype=column.values.typecode)
+    if column.nulls is None:
+        present = numpy.ones(len(column), dtype=bool)
+    else:
+        present = numpy.frombuffer(column.nulls, dtype=numpy.uint8) == 0
+    return values, present
+
+
+class Comparison(Predicate):
+    def __init__(self, column: str, op: str, value: Any):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op}.")
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return f"Col('{self.column}') {self.op} {self.value!r}"
+
+    def column_names(self) -> List[str]:
+        return [self.column]
+
+    def validate(self, columns: Dict[str, Dict[str, Any]]):
+        if self.op in ('==', '!=') or self.value is None:
+            _check_column(columns, self.column)
+        else:
+            _check_orderable(columns, self.column, self.value)
+
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        slot = slots[self.column]
+        value = self.value
+        if value is None:
+            if self.op == '==':
+                return lambda record: record[slot] is None
+            if self.op == '!=':
+                return lambda record: record[slot] is not None
+            return lambda record: False
+        if self.op == '==':
+            return lambda record: record[slot] == value
+        compare = OPERATORS[self.op]
+        return lambda record: record[slot] is not None and compare(record[slot], value)
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        column = store.columns[slots[self.column]]
+        if self.value is None and self.op in ('==', '!='):
+            nulls = IsNull(self.column).mask(store, slots)
+            if nulls is None:
+                return None
+            return nulls if self.op == '==' else ~nulls
+        if isinstance(column, DictionaryColumn) and self.op in ('==', '!='):
+            codes = numpy.frombuffer(column.codes, dtype=column.codes.typecode)
+            code = column.lookup.get(self.value)
+            if code is None:
+                matched = numpy.zeros(len(column), dtype=bool)
+            else:
+                matched = codes == code
+            return matched if self.op == '==' else ~matched & (codes >= 0)
+        view = _numeric_view(column, self.value)
+        if view is None:
+            return None
+        values, present = view
+        return OPERATORS[self.op](values, self.value) & present
+
+    def equalities(self) -> Dict[str, Any]:
+        if self.op == '==':
+            return {self.column: self.value}
+        return {}
+
+    def ranges(self) -> Dict[str, Tuple[Any, Any, bool, bool]]:
+        if self.value is None or self.op in ('==', '!='):
+            return {}
+        if self.op in ('<', '<='):
+            return {self.column: (None, self.value, True, self.op == '<=')}
+        return {self.column: (self.value, None, self.op == '>=', True)}
+
+
+class In(Predicate):
+    def __init__(self, column: str, values):
+        self.column = column
+        self.values = set(values)
+
+    def __repr__(self):
+        return f"Col('{self.column}').isin({sorted(self.values, key=repr)})"
+
+    def column_names(self) -> List[str]:
+        return [self.column]
+
+    def validate(self, columns: Dict[str, Dict[str, Any]]):
+        _check_column(columns, self.column)
+
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        slot = slots[self.column]
+        values = self.values
+        return lambda record: record[slot] in values
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        column = store.columns[slots[self.column]]
+        if isinstance(column, DictionaryColumn):
+            codes = [column.lookup[value] for value in self.values if value in column.lookup]
+            if None in self.values:
+                codes.append(-1)
+            return numpy.isin(numpy.frombuffer(column.codes, dtype=column.codes.typecode), codes)
+        if not isinstance(column, ArrayColumn) or not all(type(value) in (int, float) for value in self.values - {None}):
+            return None
+        present = list(self.values - {None})
+        if column.kind is int:
+            # A float equal to an int matches it, as it does row by row
+            present = [int(value) for value in present if type(value) is int or value.is_integer()]
+            present = [value for value in present if column.fits(value)]
+        view = _numeric_view(column, present[0] if present else column.placeholder)
+        values, not_null = view
+        matched = numpy.isin(values, present) & not_null
+        if None in self.values:
+            matched |= ~not_null
+        return matched
+
+
+class Between(Predicate):
+    def __init__(self, column: str, low: Any, high: Any):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def __repr__(self):
+        return f"Col('{self.column}').between({self.low!r}, {self.high!r})"
+
+    def column_names(self) -> List[str]:
+        return [self.column]
+
+    def validate(self, columns: Dict[str, Dict[str, Any]]):
+        _check_orderable(columns, self.column, self.low)
+        _check_orderable(columns, self.column, self.high)
+
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        slot = slots[self.column]
+        low, high = self.low, self.high
+        return lambda record: record[slot] is not None and low <= record[slot] <= high
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        column = store.columns[slots[self.column]]
+        if _numeric_view(column, self.low) is None or _numeric_view(column, self.high) is None:
+            return None
+        values, present = _numeric_view(column, self.low)
+        return (values >= self.low) & (values <= self.high) & present
+
+    def ranges(self) -> Dict[str, Tuple[Any, Any, bool, bool]]:
+        return {self.column: (self.low, self.high, True, True)}
+
+
+class IsNull(Predicate):
+    def __init__(self, column: str):
+        self.column = column
+
+    def __repr__(self):
+        return f"Col('{self.column}').is_null()"
+
+    def column_names(self) -> List[str]:
+        return [self.column]
+
+    def validate(self, columns: Dict[str, Dict[str, Any]]):
+        _check_column(columns, self.column)
+
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        slot = slots[self.column]
+        return lambda record: record[slot] is None
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        column = store.columns[slots[self.column]]
+        if isinstance(column, DictionaryColumn):
+            return numpy.frombuffer(column.codes, dtype=column.codes.typecode) < 0
+        if isinstance(column, ArrayColumn):
+            if column.nulls is None:
+                return numpy.zeros(len(column), dtype=bool)
+            return numpy.frombuffer(column.nulls, dtype=numpy.uint8) != 0
+        return None
+
+
+def _intersect(first: Tuple[Any, Any, bool, bool], second: Tuple[Any, Any, bool, bool]) -> Tuple[Any, Any, bool, bool]:
+    '''
+    Returns the overlap of two (low, high, include_low, include_high) ranges.
+    '''
+    low, high, include_low, include_high = first
+    other_low, other_high, other_include_low, other_include_high = second
+    if low is None or (other_low is not None and other_low > low):
+        low, include_low = other_low, other_include_low
+    elif other_low == low:
+        include_low = include_low and other_include_low
+    if high is None or (other_high is not None and other_high < high):
+        high, include_high = other_high, other_include_high
+    elif other_high == high:
+        include_high = include_high and other_include_high
+    return low, high, include_low, include_high
+
+
+class _Combination(Predicate):
+    def __init__(self, *predicates: Predicate):
+        if not predicates:
+            raise ValueError(f"{type(self).__name__} needs at least one predicate.")
+        self.predicates = list(predicates)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(map(repr, self.predicates))})"
+
+    def column_names(self) -> List[str]:
+        names = []
+        for predicate in self.predicates:
+            names.extend(name for name in predicate.column_names() if name not in names)
+        return names
+
+    def validate(self, columns: Dict[str, Dict[str, Any]]):
+        for predicate in self.predicates:
+            predicate.validate(columns)
+
+    def masks(self, store: ColumnStore, slots: Dict[str, int]):
+        masks = [predicate.mask(store, slots) for predicate in self.predicates]
+        if any(mask is None for mask in masks):
+            return None
+        return masks
+
+
+class And(_Combination):
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        tests = [predicate.compile(slots) for predicate in self.predicates]
+        return reduce(lambda first, second: lambda record: first(record) and second(record), tests)
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        masks = self.masks(store, slots)
+        return None if masks is None else reduce(operator.and_, masks)
+
+    def equalities(self) -> Dict[str, Any]:
+        found = {}
+        for predicate in self.predicates:
+            found.update(predicate.equalities())
+        return found
+
+    def ranges(self) -> Dict[str, Tuple[Any, Any, bool, bool]]:
+        # A column bounded by several predicates has to be in all of them
+        found = {}
+        for predicate in self.predicates:
+            for column, bounds in predicate.ranges().items():
+                found[column] = _intersect(found[column], bounds) if column in found else bounds
+        return found
+
+
+class Or(_Combination):
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        tests = [predicate.compile(slots) for predicate in self.predicates]
+        return reduce(lambda first, second: lambda record: first(record) or second(record), tests)
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        masks = self.masks(store, slots)
+        return None if masks is None else reduce(operator.or_, masks)
+
+
+class Not(_Combination):
+    def __init__(self, predicate: Predicate):
+        super().__init__(predicate)
+
+    def compile(self, slots: Dict[str, int]) -> Callable[[Any], bool]:
+        test = self.predicates[0].compile(slots)
+        return lambda record: not test(record)
+
+    def mask(self, store: ColumnStore, slots: Dict[str, int]):
+        mask = self.predicates[0].mask(store, slots)
+        return None if mask is None else ~mask
+
+
+def evaluate(predicate: Predicate, data, columns: Dict[str, Dict[str, Any]], positions: List[int] = None) -> List[int]:
+    '''
+    Returns the positions of the rows of data that satisfy predicate.
+
+    A ColumnStore is evaluated column by column: as NumPy masks when NumPy
+        is installed, otherwise by zipping only the columns the predicate
+        reads. Any other list of rows is tested row by row.
+
+    Parameters:
+        predicate (Predicate): The condition.
+        data (List[List[Any]] | ColumnStore): The rows.
+        columns (Dict[str, Dict[str, Any]]): The columns of the rows.
+        positions (List[int]): Only test the rows at these positions.
+
+    Returns:
+        List[int]: The matching positions, in the order they were tested.
+
+    Raises:
+        ValueError: If the predicate doesn't fit the columns.
+    '''
+    predicate.validate(columns)
+    column_list = list(columns.keys())
+    row_slots = {name: column_list.index(name) for name in predicate.column_names()}
+
+    if isinstance(data, ColumnStore) and positions is None:
+        if numpy is not None and len(data):
+            mask = predicate.mask(data, row_slots)
+            if mask is not None:
+                return numpy.flatnonzero(mask).tolist()
+        names = predicate.column_names()
+        test = predicate.compile({name: slot for slot, name in enumerate(names)})
+        records = zip(*(data.column(row_slots[name]) for name in names))
+        return [position for position, record in enumerate(records) if test(record)]
+
+    test = predicate.compile(row_slots)
+    if positions is None:
+        return [position for position, row in enumerate(data) if test(row)]
+    return [position for position in positions if test(data[position])]
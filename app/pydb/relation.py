@@ -0,0 +1,96 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from itertools import islice
+
+
+class Relation:
+    '''
+    An ephemeral, in-memory relation, such as the result of a join.
+
+    A relation never touches the database file. Its rows are produced
+        lazily every time it is iterated, from the tables (or relations)
+        it was built from, so it always reflects their current rows.
+        A relation can be passed to `Database.join_tables` in place of
+        a table name to chain joins.
+
+    Args:
+        name (str): The name of the relation.
+        columns (Dict[str, Dict[str, Any]]): The columns of the relation
+            and their metadata, in the same form as `Table.columns`.
+        rows (Callable[[], Iterator[List[Any]]]): Returns a fresh
+            iterator over the rows of the relation.
+
+    Attributes:
+        table_name (str): The name of the relation.
+        columns (Dict[str, Dict[str, Any]]): The columns of the relation.
+    '''
+    def __init__(self, name: str, columns: Dict[str, Dict[str, Any]], rows: Callable[[], Iterator[List[Any]]]):
+        self.table_name = name
+        self.columns = columns
+        self._rows = rows
+
+    def __repr__(self):
+        return f"Relation(name='{self.table_name}', columns={list(self.columns.keys())})"
+
+    def __str__(self):
+        return self.table_name
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        return iter(self._rows())
+
+    def fetchall(self) -> List[List[Any]]:
+        '''
+        Runs the relation and returns all of its rows.
+        '''
+        return list(self)
+
+    def materialize(self) -> 'Relation':
+        '''
+        Runs the relation once and returns a relation over the stored rows.
+
+        Useful when a relation is iterated many times, for instance as
+            the inner side of several joins.
+        '''
+        rows = list(self)
+        return Relation(self.table_name, self.columns, lambda: iter(rows))
+
+
+class Cursor(Relation):
+    '''
+    The lazy result of `Database.select`.
+
+    Nothing is read until the cursor is iterated or fetched from, and rows
+        are produced one at a time, so a query that is stopped early (or
+        has a limit) doesn't read or copy the rest of the table. Iterating
+        the cursor runs the query again, while `fetchone` and `fetchmany`
+        continue a single run, like a DB-API cursor. A cursor is also a
+        `Relation`, so it can be passed to `Database.join_tables`.
+    '''
+    def __init__(self, name: str, columns: Dict[str, Dict[str, Any]], rows: Callable[[], Iterator[List[Any]]]):
+        super().__init__(name, columns, rows)
+        self._iterator = None
+
+    def __repr__(self):
+        return f"Cursor(name='{self.table_name}', columns={list(self.columns.keys())})"
+
+    def _current(self) -> Iterator[List[Any]]:
+        if self._iterator is None:
+            self._iterator = iter(self._rows())
+        return self._iterator
+
+    def fetchone(self) -> Optional[List[Any]]:
+        '''
+        Returns the next row of the current run, or None once it is exhausted.
+        '''
+        return next(self._current(), None)
+
+    def fetchmany(self, size: int) -> List[List[Any]]:
+        '''
+        Returns up to size more rows of the current run.
+        '''
+        return list(islice(self._current(), size))
+
+    def fetchall(self) -> List[List[Any]]:
+        '''
+        Returns the remaining rows of the current run.
+        '''
+        return list(self._current())
@@ -0,0 +1,651 @@
+from typing import Any, Dict, List, Set, Tuple
+from array import array
+from contextlib import ExitStack, contextmanager
+from os import path
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+
+from app.pydb.locks import RWLock
+
+
+# The number of files written by this process
+_files_written = 0
+
+
+def files_written() -> int:
+    '''
+    Returns the number of files written by this process so far, which
+        tells whether an operation wrote anything.
+    '''
+    return _files_written
+
+
+@contextmanager
+def atomic_write(file_path: str, mode: str = 'w'):
+    '''
+    Opens a temporary file next to file_path for writing, and moves it over
+        file_path once it has been written and synced to disk.
+
+    Readers see either the previous file or the new one, never a partial
+        write, and a crash in the middle of a write leaves the previous
+        file intact.
+    '''
+    global _files_written
+    temp_path = f'{file_path}.tmp'
+    try:
+        with open(temp_path, mode) as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, file_path)
+        _files_written += 1
+    except BaseException:
+        if path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class StorageBackend:
+    '''
+    Base class for the file formats a PyDB database can be stored in.
+
+    `Table` and `Database` never open the database file themselves,
+        they go through a storage backend. A backend only has to
+        implement `read` and `write` for a whole database; the table
+        level operations are built on top of them and can be
+        overridden by backends that can do better.
+
+    The database data passed around is the same dictionary as the
+        JSON file holds: table names mapped to a dictionary with the
+        table's 'columns', 'data' and, optionally, 'indexes' and 'lsn',
+        the sequence number of the last journal record its rows hold.
+
+    Every file is written through `atomic_write`, so a write either
+        happens completely or not at all.
+
+    Attributes:
+        lock (threading.RLock): The lock `locked` returns for every table,
+            since the whole database is one file. Reads need no lock, since
+            files are replaced atomically.
+        snapshot_reads (bool): Whether a read always sees the database
+            as a single write left it, without any lock. True for the
+            backends that keep the whole database in one file.
+    '''
+    name = ''
+    snapshot_reads = True
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+    def locked(self, table_names: List[str] = None):
+        '''
+        Returns a context manager that callers hold around every write of
+            the files of table_names, or of the whole database when None,
+            so that two threads never interleave the read-modify-write of
+            the same file.
+        '''
+        return self.lock
+
+    def read(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def write(self, db_path: str, db_data: Dict[str, Dict[str, Any]]):
+        raise NotImplementedError
+
+    def create(self, db_path: str):
+        '''
+        Creates an empty database file if there is none yet.
+        '''
+        if not path.exists(db_path):
+            self.write(db_path, {})
+
+    def read_catalog(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        '''
+        Returns every table of the database with its 'columns' and 'indexes'.
+
+        Backends that have to read the rows anyway may include the 'data'
+            of each table as well.
+        '''
+        return self.read(db_path)
+
+    def read_table(self, db_path: str, table_name: str) -> Dict[str, Any]:
+        '''
+        Returns the 'columns', 'data' and 'indexes' of a single table,
+            or an empty dictionary if the table doesn't exist.
+        '''
+        return self.read(db_path).get(table_name, {})
+
+    def write_tables(self, db_path: str, tables: Dict[str, Dict[str, Any]]):
+        '''
+        Updates some of the tables in the database file.
+
+        Parameters:
+            tables (Dict[str, Dict[str, Any]]): For each table, the parts
+                to replace, for instance {'users': {'data': rows}}.
+        '''
+        db_data = self.read(db_path)
+        for table_name, parts in tables.items():
+            db_data.setdefault(table_name, {}).update(parts)
+        self.write(db_path, db_data)
+
+    def write_data(self, db_path: str, tables: Dict[str, Tuple[List[List[Any]], int, Set[int]]], lsn: int = None):
+        '''
+        Writes the rows of some of the tables in the database file.
+
+        Parameters:
+            tables (Dict[str, Tuple[List[List[Any]], int, Set[int]]]): For each
+                table, its rows and which of them changed since they were last
+                written: every row from the given position on (None if no row
+                was inserted or deleted) and the positions of the updated rows.
+                Backends that store a table in pieces only rewrite the pieces
+                holding changed rows.
+            lsn (int): The sequence number of the last journal record the
+                rows hold, stored with each table, or None without a journal.
+        '''
+        parts = {} if lsn is None else {'lsn': lsn}
+        self.write_tables(db_path, {table_name: {'data': data, **parts} for table_name, (data, *_) in tables.items()})
+
+    def drop_table(self, db_path: str, table_name: str):
+        db_data = self.read(db_path)
+        db_data.pop(table_name)
+        self.write(db_path, db_data)
+
+
+class JSONStorage(StorageBackend):
+    '''
+    The original PyDB format: the whole database as one pretty-printed
+        JSON document.
+
+    The document is written with an indent of 4, so the name of every
+        table, and nothing else, starts a line indented by exactly four
+        spaces, and the sections of a table ('data', 'columns' and
+        'indexes') are the only lines starting with a quote after eight
+        spaces. `read_table` relies on it to find a table with a byte
+        search and decode only that table, and `read_catalog` to decode
+        every section but the rows, instead of parsing the whole database.
+        Files in any other layout are parsed whole.
+    '''
+    name = 'json'
+    TABLE_PREFIX = b'\n    "'
+    SECTION_PREFIX = b'\n        "'
+
+    def read(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        with open(db_path, 'r') as db_file:
+            try:
+                return json.load(db_file)
+            except json.JSONDecodeError:
+                return {}
+
+    def write(self, db_path: str, db_data: Dict[str, Dict[str, Any]]):
+        with atomic_write(db_path) as write_file:
+            json.dump(db_data, write_file, indent=4, default=list)
+
+    def _find_table(self, text, table_name: str):
+        '''
+        Returns the (start, end) byte offsets of the value of a table in
+            the text of the file, or None if they can't be found.
+        '''
+        if text[:len(self.TABLE_PREFIX) + 1] != b'{' + self.TABLE_PREFIX:
+            return None
+        key = b'\n    ' + json.dumps(table_name).encode('ascii') + b': '
+        start = text.find(key)
+        if start == -1:
+            return None
+        start += len(key)
+        end = text.find(self.TABLE_PREFIX, start)
+        if end == -1:
+            end = text.rfind(b'}')
+        return start, end
+
+    def _read_schemas(self, text) -> Dict[str, Dict[str, Any]]:
+        '''
+        Decodes every section of every table but its rows, or returns None
+            if the text is not in the expected layout.
+        '''
+        if text[:len(self.TABLE_PREFIX) + 1] != b'{' + self.TABLE_PREFIX:
+            return None
+        decoder = json.JSONDecoder()
+        # The offsets of the opening quote after each prefix
+        table_quote = len(self.TABLE_PREFIX) - 1
+        section_quote = len(self.SECTION_PREFIX) - 1
+        catalog = {}
+        start = text.find(self.TABLE_PREFIX)
+        while start != -1:
+            end = text.find(self.TABLE_PREFIX, start + 1)
+            table_end = len(text) if end == -1 else end
+            name, _ = decoder.raw_decode(text[start + table_quote:text.find(b'\n', start + 1, table_end)].decode())
+            table = catalog[name] = {}
+            section = text.find(self.SECTION_PREFIX, start, table_end)
+            while section != -1:
+                following = text.find(self.SECTION_PREFIX, section + 1, table_end)
+                if text[section + section_quote:section + section_quote + 7] != b'"data":':
+                    line = text[section + section_quote:table_end if following == -1 else following].decode()
+                    key, value_start = decoder.raw_decode(line)
+                    table[key], _ = decoder.raw_decode(line, line.index(':', value_start) + 2)
+                section = following
+            start = end
+        return catalog
+
+    def read_catalog(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        with open(db_path, 'rb') as db_file:
+            try:
+                text = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file
+                return {}
+            with text:
+                try:
+                    catalog = self._read_schemas(text)
+                except (ValueError, UnicodeDecodeError):
+                    catalog = None
+        if catalog is not None:
+            return catalog
+        return super().read_catalog(db_path)
+
+    def read_table(self, db_path: str, table_name: str) -> Dict[str, Any]:
+        with open(db_path, 'rb') as db_file:
+            try:
+                text = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file
+                return {}
+            with text:
+                span = self._find_table(text, table_name)
+                if span is not None:
+                    try:
+                        return json.loads(text[span[0]:span[1]].rstrip(b', \r\n'))
+                    except json.JSONDecodeError:
+                        pass
+        return super().read_table(db_path, table_name)
+
+
+class BinaryStorage(StorageBackend):
+    '''
+    A compact binary format that loads and saves much faster than JSON.
+
+    The file starts with a magic number and a length-prefixed JSON header
+        holding the schema of every table, its row count and the layout of
+        its data. The rows follow as one typed block per column:
+            - int columns as packed 64-bit integers
+            - float columns as packed 64-bit floats
+            - str columns as their UTF-8 text, separated by NUL characters
+            - anything else (booleans, huge ints, mixed values) as JSON
+        Columns holding None also get a null map of one byte per row.
+
+    Packed blocks are decoded by the `array` module in a single call,
+        so loading a table costs little more than reading its bytes.
+    '''
+    name = 'binary'
+    MAGIC = b'PYDB\x01'
+
+    def read(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        with open(db_path, 'rb') as db_file:
+            header, body_start = self._read_header(db_file)
+            db_data = {}
+            for table_name, table_header in header.items():
+                db_file.seek(body_start + table_header['offset'])
+                body = db_file.read(table_header['length'])
+                db_data[table_name] = self._decode_table(table_header, body)
+        return db_data
+
+    def read_catalog(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        with open(db_path, 'rb') as db_file:
+            header, _ = self._read_header(db_file)
+        return {
+            table_name: {key: table_header[key] for key in ('columns', 'indexes', 'lsn') if key in table_header}
+            for table_name, table_header in header.items()
+        }
+
+    def read_table(self, db_path: str, table_name: str) -> Dict[str, Any]:
+        with open(db_path, 'rb') as db_file:
+            header, body_start = self._read_header(db_file)
+            table_header = header.get(table_name)
+            if table_header is None:
+                return {}
+            db_file.seek(body_start + table_header['offset'])
+            return self._decode_table(table_header, db_file.read(table_header['length']))
+
+    def write(self, db_path: str, db_data: Dict[str, Dict[str, Any]]):
+        header = {}
+        bodies = []
+        offset = 0
+        for table_name, table in db_data.items():
+            table_header, body = self._encode_table(table)
+            table_header['offset'] = offset
+            table_header['length'] = len(body)
+            header[table_name] = table_header
+            bodies.append(body)
+            offset += len(body)
+
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        with atomic_write(db_path, 'wb') as write_file:
+            write_file.write(self.MAGIC)
+            write_file.write(struct.pack('<I', len(header_bytes)))
+            write_file.write(header_bytes)
+            for body in bodies:
+                write_file.write(body)
+
+    def _read_header(self, db_file) -> Tuple[Dict[str, Any], int]:
+        magic = db_file.read(len(self.MAGIC))
+        if not magic:
+            return {}, 0
+        if magic != self.MAGIC:
+            raise ValueError("Not a PyDB binary database file.")
+        header_length = struct.unpack('<I', db_file.read(4))[0]
+        header = json.loads(db_file.read(header_length).decode('utf-8'))
+        return header, len(self.MAGIC) + 4 + header_length
+
+    @staticmethod
+    def _pack(values: array) -> bytes:
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tobytes()
+
+    @staticmethod
+    def _unpack(typecode: str, payload: bytes) -> array:
+        values = array(typecode)
+        values.frombytes(payload)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def _encode_column(self, values: List[Any]) -> Tuple[str, bytes, bytes]:
+        '''
+        Returns the encoding, null map and payload of a column.
+        '''
+        nulls = b''
+        present = values
+        if None in values:
+            nulls = bytes(value is None for value in values)
+            present = [value for value in values if value is not None]
+        kinds = set(map(type, present))
+
+        if kinds <= {int}:
+            try:
+                packed = array('q', [0 if value is None else value for value in values])
+                return 'i', nulls, self._pack(packed)
+            except OverflowError:
+                pass
+        elif kinds == {float}:
+            packed = array('d', [0.0 if value is None else value for value in values])
+            return 'f', nulls, self._pack(packed)
+        elif kinds == {str}:
+            text = '\x00'.join('' if value is None else value for value in values)
+            if text.count('\x00') == max(len(values) - 1, 0):
+                return 's', nulls, text.encode('utf-8')
+        return 'j', b'', json.dumps(values, separators=(',', ':')).encode('utf-8')
+
+    def _decode_column(self, encoding: str, rows: int, nulls: bytes, payload: bytes) -> List[Any]:
+        if encoding == 'i':
+            values = self._unpack('q', payload).tolist()
+        elif encoding == 'f':
+            values = self._unpack('d', payload).tolist()
+        elif encoding == 's':
+            values = payload.decode('utf-8').split('\x00') if rows else []
+        else:
+            return json.loads(payload.decode('utf-8'))
+        if nulls:
+            values = [None if null else value for value, null in zip(values, nulls)]
+        return values
+
+    def _encode_table(self, table: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        data = table.get('data', [])
+        column_count = len(table.get('columns', {}))
+        if data:
+            column_count = max(column_count, len(data[0]))
+        columns = [list(column) for column in zip(*data)] if data else [[] for _ in range(column_count)]
+
+        blocks = []
+        layout = []
+        for values in columns:
+            encoding, nulls, payload = self._encode_column(values)
+            layout.append([encoding, len(nulls), len(payload)])
+            blocks.append(nulls)
+            blocks.append(payload)
+
+        table_header = {'columns': table.get('columns', {}), 'rows': len(data), 'layout': layout}
+        for key in ('indexes', 'lsn'):
+            if key in table:
+                table_header[key] = table[key]
+        return table_header, b''.join(blocks)
+
+    def _decode_table(self, table_header: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+        rows = table_header['rows']
+        columns = []
+        position = 0
+        for encoding, nulls_length, payload_length in table_header['layout']:
+            nulls = body[position:position + nulls_length]
+            position += nulls_length
+            payload = body[position:position + payload_length]
+            position += payload_length
+            columns.append(self._decode_column(encoding, rows, nulls, payload))
+
+        table = {'data': [list(row) for row in zip(*columns)] if rows else [], 'columns': table_header['columns']}
+        for key in ('indexes', 'lsn'):
+            if key in table_header:
+                table[key] = table_header[key]
+        return table
+
+
+class DirectoryStorage(StorageBackend):
+    '''
+    Stores the database as a directory instead of a single file.
+
+    A small catalog holds the schema, foreign keys and indexes of every
+        table, and the rows of each table live in a directory of their own:
+            <db path>/catalog.json
+            <db path>/<table name>/0.json, 1.json, ...
+        With `partition_rows` set, the rows of a table are split into
+        partitions of that many rows, otherwise each table is a single
+        partition.
+
+    Writing a table only rewrites the partitions holding changed rows,
+        so a change to a small table no longer re-serializes the large
+        ones. The catalog only changes along with the schema, so different
+        tables can be written at the same time.
+
+    Args:
+        partition_rows (int): The number of rows per partition, or None to
+            keep each table in a single partition. A database keeps the
+            partition size it was created with.
+    '''
+    name = 'directory'
+    snapshot_reads = False
+    CATALOG = 'catalog.json'
+
+    def __init__(self, partition_rows: int = None):
+        if partition_rows is not None and partition_rows < 1:
+            raise ValueError("partition_rows must be at least 1.")
+        self.partition_rows = partition_rows
+        # Each table has a lock of its own, writes of the whole database
+        #  take the database lock alone, and the catalog lock is held
+        #  around every read-modify-write of the catalog
+        self._database_lock = RWLock()
+        self._table_locks = {}
+        self._table_locks_guard = threading.Lock()
+        self._catalog_lock = threading.RLock()
+
+    def __repr__(self):
+        return f"DirectoryStorage(partition_rows={self.partition_rows})"
+
+    @contextmanager
+    def locked(self, table_names: List[str] = None):
+        '''
+        Holds the locks of table_names, taken in name order, so that writes
+            and reads of different tables don't wait on each other. Holds
+            the lock of every table when table_names is None.
+        '''
+        if table_names is None:
+            with self._database_lock.write_locked():
+                yield
+            return
+        with self._database_lock.read_locked(), ExitStack() as stack:
+            for table_name in sorted(set(table_names)):
+                with self._table_locks_guard:
+                    lock = self._table_locks.setdefault(table_name, threading.RLock())
+                stack.enter_context(lock)
+            yield
+
+    def _partition_path(self, db_path: str, table_name: str, partition: int) -> str:
+        return path.join(db_path, table_name, f'{partition}.json')
+
+    def _read_catalog(self, db_path: str) -> Dict[str, Any]:
+        catalog_path = path.join(db_path, self.CATALOG)
+        if not path.exists(catalog_path):
+            return {'partition_rows': self.partition_rows, 'tables': {}}
+        with open(catalog_path, 'r') as catalog_file:
+            return json.load(catalog_file)
+
+    def _write_catalog(self, db_path: str, catalog: Dict[str, Any]):
+        with atomic_write(path.join(db_path, self.CATALOG)) as catalog_file:
+            json.dump(catalog, catalog_file, indent=4)
+
+    def _read_rows(self, db_path: str, table_name: str) -> List[List[Any]]:
+        data = []
+        partition = 0
+        while path.exists(self._partition_path(db_path, table_name, partition)):
+            with open(self._partition_path(db_path, table_name, partition), 'r') as partition_file:
+                data.extend(json.load(partition_file))
+            partition += 1
+        return data
+
+    def _write_rows(self, db_path: str, table_name: str, data: List[List[Any]], partition_rows: int,
+                    dirty_from: int = 0, dirty_rows: Set[int] = ()):
+        '''
+        Rewrites the partitions of a table that hold changed rows and
+            removes the partitions left over after deletes.
+        '''
+        size = partition_rows or len(data) or 1
+        count = max(1, -(-len(data) // size))
+        changed = {position // size for position in dirty_rows if position < len(data)}
+        if dirty_from is not None:
+            changed.update(range(min(dirty_from // size, count - 1), count))
+
+        os.makedirs(path.join(db_path, table_name), exist_ok=True)
+        for partition in sorted(changed):
+            with atomic_write(self._partition_path(db_path, table_name, partition)) as partition_file:
+                json.dump(data[partition * size:(partition + 1) * size], partition_file)
+
+        partition = count
+        while path.exists(self._partition_path(db_path, table_name, partition)):
+            os.remove(self._partition_path(db_path, table_name, partition))
+            partition += 1
+
+    def create(self, db_path: str):
+        os.makedirs(db_path, exist_ok=True)
+        with self._catalog_lock:
+            if not path.exists(path.join(db_path, self.CATALOG)):
+                self._write_catalog(db_path, self._read_catalog(db_path))
+
+    def read_catalog(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        return self._read_catalog(db_path)['tables']
+
+    def read(self, db_path: str) -> Dict[str, Dict[str, Any]]:
+        db_data = self.read_catalog(db_path)
+        for table_name, table in db_data.items():
+            table['data'] = self._read_rows(db_path, table_name)
+        return db_data
+
+    def read_table(self, db_path: str, table_name: str) -> Dict[str, Any]:
+        table = self.read_catalog(db_path).get(table_name)
+        if table is None:
+            return {}
+        table['data'] = self._read_rows(db_path, table_name)
+        return table
+
+    def write(self, db_path: str, db_data: Dict[str, Dict[str, Any]]):
+        os.makedirs(db_path, exist_ok=True)
+        with self._catalog_lock:
+            catalog = self._read_catalog(db_path)
+            for table_name in set(catalog['tables']) - set(db_data):
+                shutil.rmtree(path.join(db_path, table_name), ignore_errors=True)
+            catalog['tables'] = {}
+            for table_name, table in db_data.items():
+                catalog['tables'][table_name] = {key: value for key, value in table.items() if key != 'data'}
+                self._write_rows(db_path, table_name, table.get('data', []), catalog['partition_rows'])
+            self._write_catalog(db_path, catalog)
+
+    def _update_catalog(self, db_path: str, tables: Dict[str, Dict[str, Any]]):
+        '''
+        Merges the schema parts of tables into the catalog, and writes it
+            if anything changed.
+        '''
+        with self._catalog_lock:
+            catalog = self._read_catalog(db_path)
+            changed = False
+            for table_name, schema in tables.items():
+                if schema or table_name not in catalog['tables']:
+                    catalog['tables'].setdefault(table_name, {}).update(schema)
+                    changed = True
+            if changed:
+                self._write_catalog(db_path, catalog)
+
+    def write_tables(self, db_path: str, tables: Dict[str, Dict[str, Any]]):
+        partition_rows = self._read_catalog(db_path)['partition_rows']
+        for table_name, parts in tables.items():
+            if 'data' in parts:
+                self._write_rows(db_path, table_name, parts['data'], partition_rows)
+        self._update_catalog(db_path, {table_name: {key: value for key, value in parts.items() if key != 'data'}
+                                       for table_name, parts in tables.items()})
+
+    def write_data(self, db_path: str, tables: Dict[str, Tuple[List[List[Any]], int, Set[int]]], lsn: int = None):
+        partition_rows = self._read_catalog(db_path)['partition_rows']
+        for table_name, (data, dirty_from, dirty_rows) in tables.items():
+            self._write_rows(db_path, table_name, data, partition_rows, dirty_from, dirty_rows)
+        if lsn is not None:
+            # Recorded once every partition is written. Like a crash between
+            #  two partitions, a crash before this point leaves the table
+            #  torn, which is the price of storing it in several files
+            self._update_catalog(db_path, {table_name: {'lsn': lsn} for table_name in tables})
+
+    def drop_table(self, db_path: str, table_name: str):
+        with self._catalog_lock:
+            catalog = self._read_catalog(db_path)
+            catalog['tables'].pop(table_name)
+            self._write_catalog(db_path, catalog)
+        shutil.rmtree(path.join(db_path, table_name), ignore_errors=True)
+
+
+STORAGE_BACKENDS = {
+    JSONStorage.name: JSONStorage,
+    BinaryStorage.name: BinaryStorage,
+    DirectoryStorage.name: DirectoryStorage,
+}
+
+
+def get_storage(storage) -> StorageBackend:
+    '''
+    Returns a storage backend from its name ('json', 'binary' or
+        'directory'), or the backend itself when given one.
+    '''
+    if not isinstance(storage, str):
+        return storage
+    if storage not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{storage}'.")
+    return STORAGE_BACKENDS[storage]()
+
+
+def convert(source_path: str, target_path: str, source_storage='json', target_storage='binary'):
+    '''
+    Converts a database file from one storage backend to another.
+
+    Parameters:
+        source_path (str): The database file to read.
+        target_path (str): The database file to write.
+        source_storage (str | StorageBackend): The format of the source file.
+        target_storage (str | StorageBackend): The format of the target file.
+
+    Returns:
+        None
+    '''
+    db_data = get_storage(source_storage).read(source_path)
+    get_storage(target_storage).write(target_path, db_data)
@@ -1,12 +1,15 @@
 from dataclasses import dataclass, field
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Set, Tuple
 
-from os import getcwd
 from os import path
 
-import json
+import heapq
 
-import sys
+from app.pydb.index import HashIndex, SortedIndex
+from app.pydb.columnar import ColumnStore
+from app.pydb.vectorized import filter_positions
+from app.pydb.predicate import evaluate
+from app.pydb.storage import JSONStorage
 
 @dataclass
 class Table:
@@ -18,21 +21,135 @@ class Table:
     Attributes:
         path (str): The path to the database file.
         table_name (str): The name of the table.
+        storage (StorageBackend): The backend used to read and write the
+            database file. Defaults to the JSON backend.
         columns (Dict[str, Dict[str, Any]]): A dictionary of column names and their metadata.
         data (List[List[Any]]): A list of rows in the table.
+        journal (Journal): An optional write-ahead journal. When set, row
+            changes are appended to the journal instead of rewriting
+            the database file.
+        autosave (bool): Whether changes are written to the database file
+            as soon as they are made. When False, the table only keeps
+            track of its unsaved changes until `save_data` is called.
+        columnar (bool): Whether to hold the rows in a `ColumnStore`, with
+            typed arrays for int and float columns and dictionary-encoded
+            str columns, instead of a list of lists. Uses far less memory
+            and speeds up column scans.
+        tuple_rows (bool): Whether to hold each row as a tuple instead of a
+            list. Tuples take less memory and are not tracked by the garbage
+            collector. A change replaces the row with an updated copy, so
+            the rows handed out before stay as they were.
+        dirty (bool): Whether the table holds changes that are not in the
+            database file yet.
+        pending_changes (int): The number of row changes since the last save.
+        dirty_from (int): The position from which rows were inserted or
+            deleted since the last save, or None.
+        dirty_rows (Set[int]): The positions of the rows updated since
+            the last save.
+        pk_index (HashIndex): A hash index from primary key value to row
+            position, or None if the table has no primary key. It is rebuilt
+            whenever the table is loaded.
+        index_specs (Dict[str, Dict[str, Any]]): The user-defined indexes of the
+            table by name, each with its 'columns', whether it is 'unique' and
+            whether it is 'ordered'. Stored in the table's 'indexes' section
+            of the database file.
+        indexes (Dict[str, HashIndex | SortedIndex]): The user-defined indexes by name.
+        change_hooks (List[Callable[[Table], None]]): Functions called with the
+            table right before its rows are changed, for instance to take a
+            snapshot of them for a transaction.
+        version (int): Counts the changes to the rows, so that a reader can
+            tell whether the rows changed under it.
+        scanner (ParallelScanner): Splits the scans of large tables across
+            a pool of processes, or None to scan in this process.
+        catalog (Dict[str, Dict[str, Any]]): The schemas of the tables in
+            the database file, when the caller already read them, so that
+            the table doesn't read them again.
+
+    The rows of a table that already exists in the database file are only
+        read on first access to `data`, `pk_index` or `indexes`, so that
+        opening a database with many tables doesn't read all of them.
 
     '''
 
     path: str
     table_name: str = ''
     columns: Dict[str, Dict[str, Any]] = field(default_factory=dict)
-    data: List[List[Any]] = field(init=False, default_factory=list)
+    storage: Any = field(default_factory=JSONStorage, repr=False)
+    journal: Any = field(default=None, repr=False)
+    autosave: bool = field(default=True, repr=False)
+    columnar: bool = field(default=False, repr=False)
+    tuple_rows: bool = field(default=False, repr=False)
+    scanner: Any = field(default=None, repr=False)
+    catalog: Dict[str, Dict[str, Any]] = field(default=None, repr=False)
+    dirty: bool = field(init=False, default=False, repr=False)
+    pending_changes: int = field(init=False, default=0, repr=False)
+    dirty_from: int = field(init=False, default=None, repr=False)
+    dirty_rows: Set[int] = field(init=False, default_factory=set, repr=False)
+    index_specs: Dict[str, Dict[str, Any]] = field(init=False, default_factory=dict, repr=False)
+    change_hooks: List[Any] = field(init=False, default_factory=list, repr=False)
+    version: int = field(init=False, default=0, repr=False)
+    _data: List[List[Any]] = field(init=False, default_factory=list, repr=False)
+    _pk_index: Any = field(init=False, default=None, repr=False)
+    _indexes: Dict[str, Any] = field(init=False, default_factory=dict, repr=False)
+    _pending: bool = field(init=False, default=False, repr=False)
+    _materializing: bool = field(init=False, default=False, repr=False)
 
     def __post_init__(self):
         # Set the default columns which can be overridden by the user
         self.columns = self.default_columns(self.columns)
         self.build_table()
 
+    @property
+    def data(self) -> List[List[Any]]:
+        if self._pending:
+            self._materialize()
+        return self._data
+
+    @data.setter
+    def data(self, rows: List[List[Any]]):
+        self._data = rows
+        self._pending = False
+
+    @property
+    def pk_index(self):
+        if self._pending:
+            self._materialize()
+        return self._pk_index
+
+    @pk_index.setter
+    def pk_index(self, index):
+        self._pk_index = index
+
+    @property
+    def indexes(self) -> Dict[str, Any]:
+        if self._pending:
+            self._materialize()
+        return self._indexes
+
+    @indexes.setter
+    def indexes(self, indexes: Dict[str, Any]):
+        self._indexes = indexes
+
+    def _materialize(self):
+        '''
+        Reads the rows of the table from the database file and builds its
+            indexes, on first access.
+        '''
+        with self.storage.locked([self.table_name]):
+            # Other threads wait for the rows here, while the indexes
+            #  being built read them through the properties
+            if not self._pending or self._materializing:
+                return
+            self._materializing = True
+            try:
+                table_data = self.load_data()
+                self._data = self._hold(table_data.get('data', []))
+                self.index_specs = table_data.get('indexes', self.index_specs)
+                self.build_indexes()
+                self._pending = False
+            finally:
+                self._materializing = False
+
     def __repr__(self):
         return self.table_name
     
@@ -44,7 +161,7 @@ class Table:
             return{
                     'type': type,
                     'PK': PK,
-                    'FK': FK,
+                    'FK': dict(FK) if FK else FK,
                     'auto_inc': auto_inc,
                     'nullable': nullable,
                     'temporary': False
@@ -63,62 +180,388 @@ class Table:
         }
 
         # Check if the table exists in the db
-        with open(self.path, 'r+') as f:
-            try:
-                db_data = json.load(f)
-            except json.JSONDecodeError:
-                db_data = {}
-
-            # Check for multiple PK here
-            if len([col_info for col_info in self.columns.values() if col_info.get('PK')]) > 1:
-                raise ValueError("Multiple primary keys found in table.")
-
-            # Check our FK relations
-            for col_info in self.columns.values():
-                fk_info = col_info.get('FK')
-                if fk_info:
-                    if fk_info.get('table') not in db_data:
-                        raise ValueError(f"FK Relation does not exist for table {fk_info.get('table')}")
-                    else:
-                        # Check that the column exists in the parent table
-                        if not db_data.get(fk_info.get('table')).get('columns').get(fk_info.get('column')):
-                            raise ValueError(f"FK Relation column {fk_info.get('column')} does not exist in parent table.")
-                        
-                        # Check that the fk type matches the parent type
-                        if not isinstance(
-                            db_data.get(fk_info.get('table')).get('columns')[fk_info.get('column')]['type'],
-                            type(col_info.get('type'))
-                        ):
-                            raise ValueError(f"FK Relation type mismatch for column {fk_info.get('column')}")
-                        
-                        # Check that the parent is a primary key
-                        if not db_data.get(fk_info.get('table')).get('columns')[fk_info.get('column')]['PK']:
-                            raise ValueError(f"Parent is not a primary key.")
-                        
-                        # Check that the on_update and on_delete are valid
-                        if not fk_info.get('on_update') or not fk_info.get('on_update') in ['cascade', 'set_null', 'do_nothing']:
-                            fk_info['on_update'] = 'do_nothing'
-
-                        if not fk_info.get('on_delete') or not fk_info.get('on_delete') in ['cascade', 'set_null', 'do_nothing']:
-                            fk_info['on_delete'] = 'do_nothing'
-
-            # Check if the table exists in the db
-            if self.table_name not in db_data:
-                table_base = {
-                                "data": self.data,
-                                "columns": self.columns
-                            }
-                db_data[self.table_name] = table_base
-                f.seek(0)
-                json.dump(db_data, f, indent=4)
-            self.data = db_data[self.table_name]["data"]
+        db_data = self.catalog if self.catalog is not None else self.storage.read_catalog(self.path)
+        self.catalog = None
+
+        # Check for multiple PK here
+        if len([col_info for col_info in self.columns.values() if col_info.get('PK')]) > 1:
+            raise ValueError("Multiple primary keys found in table.")
+
+        # Check our FK relations
+        for col_info in self.columns.values():
+            fk_info = col_info.get('FK')
+            if fk_info:
+                if fk_info.get('table') not in db_data:
+                    raise ValueError(f"FK Relation does not exist for table {fk_info.get('table')}")
+                else:
+                    # Check that the column exists in the parent table
+                    if not db_data.get(fk_info.get('table')).get('columns').get(fk_info.get('column')):
+                        raise ValueError(f"FK Relation column {fk_info.get('column')} does not exist in parent table.")
+                    
+                    # Check that the fk type matches the parent type
+                    if not isinstance(
+                        db_data.get(fk_info.get('table')).get('columns')[fk_info.get('column')]['type'],
+                        type(col_info.get('type'))
+                    ):
+                        raise ValueError(f"FK Relation type mismatch for column {fk_info.get('column')}")
+                    
+                    # Check that the parent is a primary key
+                    if not db_data.get(fk_info.get('table')).get('columns')[fk_info.get('column')]['PK']:
+                        raise ValueError(f"Parent is not a primary key.")
+                    
+                    # Check that the on_update and on_delete are valid
+                    if not fk_info.get('on_update') or not fk_info.get('on_update') in ['cascade', 'set_null', 'do_nothing']:
+                        fk_info['on_update'] = 'do_nothing'
+
+                    if not fk_info.get('on_delete') or not fk_info.get('on_delete') in ['cascade', 'set_null', 'do_nothing']:
+                        fk_info['on_delete'] = 'do_nothing'
+
+        # Check if the table exists in the db
+        if self.table_name not in db_data:
+            table_base = {
+                            "data": self.data,
+                            "columns": self.columns
+                        }
+            with self.storage.locked([self.table_name]):
+                self.storage.write_tables(self.path, {self.table_name: table_base})
+            db_data[self.table_name] = table_base
+        elif "data" not in db_data[self.table_name]:
+            # The catalog of the backend only holds the schema, the rows
+            #  are read on first access
+            self.index_specs = db_data[self.table_name].get("indexes", {})
+            self._pending = True
+            return
+        self.data = self._hold(db_data[self.table_name]["data"])
+        self.index_specs = db_data[self.table_name].get("indexes", {})
+        self.build_indexes()
+
+    def _hold(self, rows: List[List[Any]]):
+        '''
+        Returns rows read from the database file in the form the table holds them.
+        '''
+        if self.columnar:
+            return ColumnStore(self.columns, rows)
+        if self.tuple_rows:
+            return [tuple(row) for row in rows]
+        return rows
+
+    def build_indexes(self):
+        '''
+        Builds the in-memory indexes of the table from its rows.
+        '''
+        pk_positions = [idx for idx, col_info in enumerate(self.columns.values()) if col_info.get('PK')]
+        if pk_positions:
+            self.pk_index = HashIndex(pk_positions, unique=True)
+            self.pk_index.build(self.data)
+        else:
+            self.pk_index = None
+
+        self.indexes = {}
+        for index_name, spec in self.index_specs.items():
+            self.indexes[index_name] = self.build_index(spec['columns'], spec['unique'], spec.get('ordered', False))
+
+    def build_index(self, column_names: List[str], unique: bool, ordered: bool = False):
+        column_list = list(self.columns.keys())
+        for col_name in column_names:
+            if col_name not in column_list:
+                raise ValueError(f"Column {col_name} does not exist in table.")
+        column_positions = [column_list.index(col_name) for col_name in column_names]
+        if ordered:
+            # A single sort, duplicates end up next to each other
+            index = SortedIndex(column_positions, unique=unique)
+            index.build(self.data)
+            if unique:
+                for key, next_key in zip(index.keys, index.keys[1:]):
+                    if key == next_key:
+                        raise ValueError(f"Duplicate value {key} for unique index on {column_names}.")
+                for key, positions in index.null_entries.items():
+                    if len(positions) > 1:
+                        raise ValueError(f"Duplicate value {key} for unique index on {column_names}.")
+            return index
+        index = HashIndex(column_positions, unique=unique)
+        if unique:
+            for position, row in enumerate(self.data):
+                if index.key(row) in index:
+                    raise ValueError(f"Duplicate value {index.key(row)} for unique index on {column_names}.")
+                index.add(row, position)
+        else:
+            index.build(self.data)
+        return index
+
+    def all_indexes(self) -> list:
+        '''
+        Returns the primary key index, if any, followed by the user-defined indexes.
+        '''
+        indexes = list(self.indexes.values())
+        if self.pk_index is not None:
+            indexes.insert(0, self.pk_index)
+        return indexes
+
+    def create_index(self, index_name: str, column_names: List[str], unique: bool = False, ordered: bool = False):
+        '''
+        Creates an index on one or more columns and stores it in the database file.
+
+        Parameters:
+            index_name (str): The name of the index.
+            column_names (List[str]): The indexed columns.
+            unique (bool): Whether the combination of values must be unique.
+                None counts as a value.
+            ordered (bool): Whether to create a `SortedIndex`, which also
+                answers range scans and ordered iteration, instead of a
+                `HashIndex`.
+
+        Returns:
+            None
+        '''
+        if index_name in self.index_specs:
+            raise ValueError(f"Index '{index_name}' already exists.")
+        self.indexes[index_name] = self.build_index(column_names, unique, ordered)
+        self.index_specs[index_name] = {'columns': list(column_names), 'unique': unique}
+        if ordered:
+            self.index_specs[index_name]['ordered'] = True
+        self.save_indexes()
+
+    def drop_index(self, index_name: str):
+        if index_name not in self.index_specs:
+            raise ValueError(f"Index '{index_name}' does not exist.")
+        del self.indexes[index_name]
+        del self.index_specs[index_name]
+        self.save_indexes()
+
+    def save_indexes(self):
+        '''
+        Saves the index definitions of the table to the database file.
+        '''
+        with self.storage.locked([self.table_name]):
+            self.storage.write_tables(self.path, {self.table_name: {"indexes": self.index_specs}})
+
+    def lookup(self, condition: Dict[str, Any]):
+        '''
+        Uses an index to find the rows that may match an equality condition.
+
+        The primary key index is preferred, then unique indexes, then the
+            index covering the most columns of the condition.
+
+        Parameters:
+            condition (Dict[str, Any]): Column names and the values they must equal.
+
+        Returns:
+            List[int]: The positions of the candidate rows, in table order,
+                or None if no index covers the condition. The candidates
+                still have to be checked against the rest of the condition.
+        '''
+        column_list = list(self.columns.keys())
+        best = None
+        for index in self.all_indexes():
+            names = [column_list[position] for position in index.column_positions]
+            if not all(name in condition for name in names):
+                continue
+            rank = (index is self.pk_index, index.unique, len(names))
+            if best is None or rank > best[0]:
+                best = (rank, index, names)
+        if best is None:
+            return None
+
+        rank, index, names = best
+        if len(names) == 1:
+            return index.lookup(condition[names[0]])
+        return index.lookup(tuple(condition[name] for name in names))
+
+    def find_positions_in(self, column_name: str, column_values) -> List[int]:
+        '''
+        Returns the positions of the rows where column_name is one of column_values.
+
+        Probes an index on column_name once per value when there is one,
+            otherwise scans the table once.
+        '''
+        column_values = set(column_values)
+        if not column_values:
+            return []
+        index = list(self.columns.keys()).index(column_name)
+        for candidate in self.all_indexes():
+            if candidate.column_positions == [index]:
+                positions = []
+                for value in column_values:
+                    positions.extend(candidate.lookup(value))
+                return sorted(positions)
+        if self.columnar:
+            return self.data.find_in(index, column_values)
+        if self.scanner is not None and self.scanner.wants(len(self.data)):
+            return self.scanner.find_in(self.data, index, column_values)
+        return [idx for idx, row in enumerate(self.data) if row[index] in column_values]
+
+    def find_positions(self, column_name: str, column_value: Any) -> List[int]:
+        '''
+        Returns the positions of the rows where column_name equals column_value.
+
+        Uses an index on column_name when there is one, otherwise scans the table.
+        '''
+        index = list(self.columns.keys()).index(column_name)
+        positions = self.lookup({column_name: column_value})
+        if positions is not None:
+            return positions
+        if self.columnar:
+            return self.data.find(index, column_value)
+        return [idx for idx, row in enumerate(self.data) if row[index] == column_value]
+
+    def rows_at(self, positions: List[int]) -> List[List[Any]]:
+        '''
+        Returns the rows at positions. Rows of a columnar table are
+            returned as lists rather than views.
+        '''
+        if self.columnar:
+            return [self.data[position].copy() for position in positions]
+        return [self.data[position] for position in positions]
+
+    def find_where(self, predicate) -> List[int]:
+        '''
+        Returns the positions of the rows that satisfy a predicate, in table order.
+
+        When an index covers the equality tests the predicate requires,
+            only the rows it returns are tested.
+
+        Raises:
+            ValueError: If the predicate doesn't fit the columns of the table.
+        '''
+        predicate.validate(self.columns)
+        positions = self.lookup(predicate.equalities())
+        if positions is None:
+            positions = self.range_lookup(predicate.ranges())
+        return evaluate(predicate, self.data, self.columns, positions)
+
+    def ordered_index(self, column_name: str):
+        '''
+        Returns an ordered index on column_name alone, or None if there is none.
+        '''
+        column_position = list(self.columns.keys()).index(column_name)
+        for index in self.indexes.values():
+            if isinstance(index, SortedIndex) and index.column_positions == [column_position]:
+                return index
+        return None
+
+    def range_lookup(self, ranges: Dict[str, Any]):
+        '''
+        Uses an ordered index to find the rows that may match range conditions.
+
+        Parameters:
+            ranges (Dict[str, Tuple[Any, Any, bool, bool]]): For each column, the
+                (low, high, include_low, include_high) bounds its value must be in.
+                A bound of None means unbounded.
+
+        Returns:
+            List[int]: The positions of the candidate rows, in table order,
+                or None if no ordered index covers any of the columns.
+        '''
+        for column_name, (low, high, include_low, include_high) in ranges.items():
+            index = self.ordered_index(column_name)
+            if index is not None:
+                return sorted(index.range(low, high, include_low, include_high))
+        return None
+
+    def scan(self, condition=None, order_by: str = None, descending: bool = False, after: Any = None,
+             stop: int = None) -> Iterator[int]:
+        '''
+        Lazily yields the positions of the rows that satisfy a condition.
+
+        Rows are tested as they are read, so a caller that stops early
+            doesn't test the rest of the table. Indexes are used the same
+            way as `find_where`, and rows are read in key order from an
+            ordered index on order_by when there is one. Without one, the
+            matching rows are sorted, and only the first `stop` of them are
+            kept when stop is given.
+
+        Parameters:
+            condition (Predicate): The condition, or None for every row.
+            order_by (str): A column to order the rows by, None first.
+            descending (bool): Whether to order in descending order, None last.
+            after (Any): Only yield the rows whose order_by value comes after
+                this value in the requested order. Requires order_by.
+            stop (int): The number of positions the caller will read at most.
+
+        Returns:
+            Iterator[int]: The matching positions.
+        '''
+        data = self.data
+        column_list = list(self.columns.keys())
+
+        positions = None
+        test = None
+        if condition is not None:
+            positions = self.lookup(condition.equalities())
+            if positions is None:
+                positions = self.range_lookup(condition.ranges())
+            if isinstance(data, ColumnStore):
+                # Whole columns are much cheaper to test than row views
+                equalities = condition.equalities()
+                if positions is None and equalities:
+                    positions = filter_positions(data, [(column_list.index(name), value) for name, value in equalities.items()])
+                positions = evaluate(condition, data, self.columns, positions)
+            else:
+                slots = {name: column_list.index(name) for name in condition.column_names()}
+                count = len(data) if positions is None else len(positions)
+                # Splitting the scan reads every row, which a caller stopping
+                #  early without an order would not have done
+                if self.scanner is not None and self.scanner.wants(count) and (stop is None or order_by is not None):
+                    positions = self.scanner.filter(data, condition, slots, positions)
+                else:
+                    test = condition.compile(slots)
+
+        def matching(candidates):
+            if test is None:
+                yield from candidates
+            else:
+                for position in candidates:
+                    if test(data[position]):
+                        yield position
+
+        if order_by is None:
+            return matching(range(len(data)) if positions is None else positions)
+
+        index = self.ordered_index(order_by)
+        if index is not None and (positions is None or len(positions) * 8 > len(data)):
+            ordered = index.iter_ordered(descending, after)
+            if positions is not None:
+                wanted = set(positions)
+                ordered = (position for position in ordered if position in wanted)
+            return matching(ordered)
+
+        column_position = column_list.index(order_by)
+        if isinstance(data, ColumnStore):
+            value = data.columns[column_position].get
+        else:
+            value = lambda position: data[position][column_position]
+        found = matching(range(len(data)) if positions is None else positions)
+        if after is not None:
+            if descending:
+                found = (position for position in found if value(position) is not None and value(position) < after)
+            else:
+                found = (position for position in found if value(position) is not None and value(position) > after)
+
+        key = lambda position: (value(position) is not None, value(position))
+        if stop is not None:
+            return iter((heapq.nlargest if descending else heapq.nsmallest)(stop, found, key=key))
+        return iter(sorted(found, key=key, reverse=descending))
+
+    def candidates(self, condition: Dict[str, Any]):
+        '''
+        Finds the rows that may match an equality condition without looking
+            at every row: with an index covering the condition, or in a
+            columnar table by evaluating the condition over whole columns.
+
+        Returns:
+            List[int]: The positions of the candidate rows, in table order,
+                or None if every row is a candidate.
+        '''
+        positions = self.lookup(condition)
+        if positions is None and self.columnar and condition:
+            column_list = list(self.columns.keys())
+            positions = filter_positions(self.data, [(column_list.index(name), value) for name, value in condition.items()])
+        return positions
 
     def load_data(self) -> Dict[str, Any]:
         if path.exists(self.path):
-            # Load all of the db data from db_path then get specific table data
-            with open(self.path, 'r') as db_file:
-                db_data = json.load(db_file)
-                return db_data.get(self.table_name, {})
+            # Load the specific table data from db_path
+            return self.storage.read_table(self.path, self.table_name)
         else:
             return {}
         
@@ -134,12 +577,102 @@ class Table:
         Returns:
             None
         '''
-        with open(self.path, 'r') as db_file:
-            db_data = json.load(db_file)
-            db_data[self.table_name]["data"] = self.data
-            db_file.seek(0)
-            with open(self.path, 'w') as write_file:
-                json.dump(db_data, write_file, indent=4)
+        with self.storage.locked([self.table_name]):
+            self.storage.write_data(self.path, {self.table_name: self.unsaved_changes()})
+        self.mark_clean()
+
+    def unsaved_changes(self) -> Tuple[List[List[Any]], int, Set[int]]:
+        '''
+        Returns the rows of the table and which of them changed since the
+            last save, in the form expected by `StorageBackend.write_data`.
+            Every row counts as changed when the table is clean, so that
+            saving a clean table rewrites it completely.
+        '''
+        if not self.dirty:
+            return self.data, 0, set()
+        return self.data, self.dirty_from, self.dirty_rows
+
+    def mark_clean(self):
+        '''
+        Marks the table as saved to the database file.
+        '''
+        self.dirty = False
+        self.pending_changes = 0
+        self.dirty_from = None
+        self.dirty_rows = set()
+
+    def before_change(self):
+        '''
+        Calls the change hooks of the table. Every method that changes
+            rows calls it once, before changing the first one.
+        '''
+        self.version += 1
+        for hook in self.change_hooks:
+            hook(self)
+
+    def snapshot(self) -> Tuple[List[List[Any]], bool, int, int, Set[int]]:
+        '''
+        Returns a copy of the rows of the table and of its record of
+            unsaved changes, which `restore` can bring back.
+        '''
+        # Tuple rows are never changed in place, so they can be shared
+        rows = list(self.data) if self.tuple_rows else [list(row) for row in self.data]
+        return rows, self.dirty, self.pending_changes, self.dirty_from, set(self.dirty_rows)
+
+    def restore(self, snapshot: Tuple[List[List[Any]], bool, int, int, Set[int]]):
+        '''
+        Brings the table back to a snapshot taken by `snapshot`, and
+            rebuilds its indexes.
+        '''
+        rows, self.dirty, self.pending_changes, self.dirty_from, self.dirty_rows = snapshot
+        self.data = self._hold(rows)
+        self.version += 1
+        self.build_indexes()
+
+    def reload(self, table_data: Dict[str, Any]):
+        '''
+        Replaces the rows and index definitions of the table with the ones
+            read from the database file, and rebuilds its indexes.
+        '''
+        self.data = self._hold(table_data['data'])
+        self.index_specs = table_data.get('indexes', {})
+        self.version += 1
+        self.build_indexes()
+        self.mark_clean()
+
+    def record_change(self, op: str, position: int, row: List[Any] = None):
+        '''
+        Records a single row change.
+
+        The table is marked dirty and, with a journal, the change is
+            appended to it. Call `persist` once all of the changes of
+            an operation have been recorded.
+
+        Parameters:
+            op (str): 'i' for an insert, 'u' for an update, 'd' for a delete.
+            position (int): The index of the changed row in `data`.
+            row (List[Any]): The new contents of the row, if any.
+
+        Returns:
+            None
+        '''
+        self.dirty = True
+        self.pending_changes += 1
+        if op == 'u':
+            self.dirty_rows.add(position)
+        elif self.dirty_from is None or position < self.dirty_from:
+            # Inserts and deletes move every row after them
+            self.dirty_from = position
+        if self.journal is not None:
+            self.journal.append(op, self.table_name, position, row)
+
+    def persist(self):
+        '''
+        Saves the recorded changes to the database file, unless they
+            are journaled or the table does not autosave.
+        '''
+        if self.dirty and self.autosave and self.journal is None:
+            self.save_data()
 
     def delete_table(self):
         '''
@@ -153,12 +686,8 @@ class Table:
         Returns:
             None
         '''
-        with open(self.path, 'r') as db_file:
-            db_data = json.load(db_file)
-            db_data.pop(self.table_name)
-            db_file.seek(0)
-            with open(self.path, 'w') as write_file:
-                json.dump(db_data, write_file, indent=4)
+        with self.storage.locked([self.table_name]):
+            self.storage.drop_table(self.path, self.table_name)
 
     def prep_insert_row(self, row_data: List[Any]):
         """
@@ -199,9 +728,14 @@ class Table:
         #  that already exists in the table, this is not allowed
         for index, (col, metadata) in enumerate(self.columns.items()):
             if metadata.get('PK', True):
-                if row_data[index] in [row[index] for row in self.data]:
+                if row_data[index] in self.pk_index:
                     raise ValueError(f"Primary key value {row_data[index]} already exists in the table.")
 
+        # Same for the unique indexes of the table
+        for index_name, index in self.indexes.items():
+            if index.unique and index.key(row_data) in index:
+                raise ValueError(f"Value {index.key(row_data)} already exists in unique index {index_name}.")
+
         # Check that the data types match the schema
         # Handle nullable columns as well
         for index, (col, metadata) in enumerate(self.columns.items()):
@@ -215,14 +749,63 @@ class Table:
         # Append the row to the table and save the data
         return row_data
 
+    def append_row(self, row_data: List[Any]):
+        """
+        Appends a prepared row to the table, its indexes and the record of changes.
+        """
+        self.before_change()
+        if self.tuple_rows:
+            row_data = tuple(row_data)
+        self.data.append(row_data)
+        for index in self.all_indexes():
+            index.add(row_data, len(self.data)-1)
+        self.record_change('i', len(self.data)-1, row_data)
+
     def insert_row(self, row_data: List[Any]):
         try:
-            self.data.append(self.prep_insert_row(row_data))
-            self.save_data()
+            self.append_row(self.prep_insert_row(row_data))
+            self.persist()
         except Exception as e:
             print(e)
 
-    def update_row(self, column_names: List[str], column_values: List[Any], conditional_column_name: str, conditional_column_value: Any):
+    def insert_rows(self, rows, check=None):
+        """
+        Inserts many rows into the table with a single save.
+
+        Every row goes through the same validation as `prep_insert_row`. Rows are
+            added to the primary key index as they are accepted, so duplicates within
+            the batch are caught as well. Rows that fail validation are skipped and
+            reported.
+
+        Args:
+            rows (Iterable[List[Any]]): The rows to insert. Can be any iterable,
+                including a generator.
+            check (Callable[[List[Any]], None]): An optional extra check run on every
+                prepared row. It should raise a ValueError to reject the row.
+
+        Returns:
+            Tuple[List[List[Any]], List[Tuple[int, List[Any], str]]]: The inserted rows,
+                and a (position in rows, row, reason) tuple for every rejected row.
+        """
+        inserted = []
+        rejected = []
+        for position, row in enumerate(rows):
+            try:
+                row_data = self.prep_insert_row(list(row))
+                if check is not None:
+                    check(row_data)
+            except ValueError as e:
+                rejected.append((position, row, str(e)))
+                continue
+
+            # Appending straight away keeps auto-increment values in step
+            self.append_row(row_data)
+            inserted.append(row_data)
+
+        self.persist()
+        return inserted, rejected
+
+    def update_row(self, column_names: List[str], column_values: List[Any], conditional_column_name: str = None, conditional_column_value: Any = None, where=None):
         """
         Updates rows in the table based on a conditional statement.
 
@@ -231,6 +814,8 @@ class Table:
             column_values (List[Any]): A list of values to update the corresponding columns with.
             conditional_column_name (str): The name of the column used in the conditional statement.
             conditional_column_value (Any): The value to match in the conditional statement.
+            where (Predicate): A predicate selecting the rows to update, used
+                instead of the conditional column and value.
 
         Raises:
             ValueError: If one or more columns doesn't exist in the table.
@@ -274,30 +859,26 @@ class Table:
             else:
                 row_indices.append(index)
 
-        # Get the index of the conditional column
-        conditional_column_index = [idx for idx, key in enumerate(list(self.columns.items())) if key[0] == conditional_column_name][0]
-
-        # Get the row contents and index of the rows to update
-        rows_to_update = [row for row in self.data if row[conditional_column_index] == conditional_column_value]
-        rows_to_update_indices = [idx for idx, row in enumerate(self.data) if row[conditional_column_index] == conditional_column_value]
+        # Get the index and contents of the rows to update
+        #  The primary key index is used when the condition is on the PK
+        if where is not None:
+            rows_to_update_indices = self.find_where(where)
+        else:
+            rows_to_update_indices = self.find_positions(conditional_column_name, conditional_column_value)
+        rows_to_update = [self.data[idx] for idx in rows_to_update_indices]
 
         # If no primary keys will be updated, pass
-        if pk_indices == [[]]:
-            pass
-        else:
+        if pk_indices:
             # Stop the user from updating multiple PK columns at once to the same value
             # This is a broad check that may catch some false positives
-            if len(rows_to_update) > 1 and len(pk_indices) >= 1:
+            if len(rows_to_update) > 1:
                 raise ValueError("Attempting to update multiple PK to the same value.")
 
             # Stop the user from updating a PK column to a value that already exists in the table
-            for index, row in enumerate(self.data):
-                if index in rows_to_update_indices:
-                    continue
-                else:
-                    for idx, pk_index in enumerate(pk_indices):
-                        if row[pk_index[0]] == column_values[idx]:  # [0] works here because we only allow on PK column in the table
-                            raise ValueError(f"Primary key value {column_values[idx]} already exists in the table.")
+            pk_value = column_values[column_names.index(list(self.columns.keys())[pk_indices[0][0]])]
+            for index in self.pk_index.lookup(pk_value):
+                if index not in rows_to_update_indices:
+                    raise ValueError(f"Primary key value {pk_value} already exists in the table.")
 
         # Check that row_indices length equals column_names length *****************
         if not row_indices == [[]] and not len(row_indices) == len(column_names):
@@ -319,27 +900,62 @@ class Table:
         if mismatches:
             raise ValueError("Could not update table. Check for data type inconsistencies at {}.".format(mismatches))
         
+        # Stop the user from updating a unique index to a value that already exists
+        updated_positions = {col[0] for col in row_indices}
+        rows_to_update_set = set(rows_to_update_indices)
+        for index_name, index in self.indexes.items():
+            if not index.unique or not updated_positions.intersection(index.column_positions):
+                continue
+            new_keys = set()
+            for row in rows_to_update:
+                new_row = list(row)
+                for idx, col in enumerate(row_indices):
+                    new_row[col[0]] = column_values[idx]
+                key = index.key(new_row)
+                if key in new_keys or any(pos not in rows_to_update_set for pos in index.lookup(key)):
+                    raise ValueError(f"Value {key} already exists in unique index {index_name}.")
+                new_keys.add(key)
+
         # store the previous values of the rows to update
         prev_values = []
         for row in rows_to_update:
-            prev_values.append(row.copy())
+            prev_values.append(row if self.tuple_rows else row.copy())
 
         # Update the table after all checks have passed
+        if rows_to_update_indices:
+            self.before_change()
         counter = 0
-        for row in self.data:
-            if row[conditional_column_index] == conditional_column_value:
-                for idx, col in enumerate(row_indices):
-                    row[col[0]] = column_values[idx]
-                    counter += 1
+        for position, prev_row in zip(rows_to_update_indices, prev_values):
+            row = list(prev_row) if self.tuple_rows else self.data[position]
+            for idx, col in enumerate(row_indices):
+                row[col[0]] = column_values[idx]
+                counter += 1
+            if self.tuple_rows:
+                row = self.data[position] = tuple(row)
+            for index in self.all_indexes():
+                index.update(prev_row, row, position)
 
         # Save the updated table
-        self.save_data()
+        for position in rows_to_update_indices:
+            self.record_change('u', position, self.data[position])
+        self.persist()
         return counter, prev_values
 
     def delete_row(self, column_name: str, column_value: Any, is_fk_delete: bool = False):
         """
         Deletes rows in the table when given a column and value.
         """
+        removed = self.delete_rows(column_name, column_value, is_fk_delete)
+        self.persist()
+        return len(removed)
+
+    def delete_rows(self, column_name: str, column_value: Any, is_fk_delete: bool = False) -> List[List[Any]]:
+        """
+        Deletes rows in the table when given a column and value, without saving.
+
+        Returns:
+            List[List[Any]]: The deleted rows, in table order.
+        """
 
         index = [idx for idx, key in enumerate(list(self.columns.items())) if key[0] == column_name]
         if len(index) == 0:
@@ -354,10 +970,80 @@ class Table:
         if not isinstance(column_value, type(self.columns[column_name]['type'])):
             raise ValueError("There is a type mismatch.")
 
-        counter = 0
-        for row in self.data:
-            if row[index[0]] == column_value:
-                self.data.remove(row)
-                self.save_data()
-                counter += 1
-        return counter
\ No newline at end of file
+        return self.delete_positions(self.find_positions(column_name, column_value))
+
+    def delete_where(self, predicate) -> List[List[Any]]:
+        """
+        Deletes the rows that satisfy a predicate, without saving.
+
+        Returns:
+            List[List[Any]]: The deleted rows, in table order.
+        """
+        return self.delete_positions(self.find_where(predicate))
+
+    def delete_positions(self, positions: List[int]) -> List[List[Any]]:
+        """
+        Deletes the rows at the given positions, without saving.
+
+        Returns:
+            List[List[Any]]: The deleted rows, in table order.
+        """
+        if positions:
+            self.before_change()
+        # Delete from the back so the remaining positions stay valid
+        removed = []
+        for position in sorted(positions, reverse=True):
+            removed.append((position, self.data.pop(position)))
+            self.record_change('d', position)
+        for index in self.all_indexes():
+            index.remove(removed, self.data)
+        return [row for position, row in reversed(removed)]
+
+    def update_positions(self, positions: List[int], column_name: str, values: List[Any]) -> List[List[Any]]:
+        """
+        Sets column_name of the rows at positions to the matching entry of values, without saving.
+
+        All of the values are checked against the column type, nullability and
+            the primary key and unique indexes before any row is changed.
+
+        Returns:
+            List[List[Any]]: The rows as they were before the update.
+        """
+        col_index = list(self.columns.keys()).index(column_name)
+        metadata = self.columns[column_name]
+        for value in values:
+            if value is None:
+                if not metadata['nullable']:
+                    raise ValueError(f"Column {column_name} cannot be null.")
+            elif not isinstance(value, type(metadata['type'])):
+                raise ValueError(f"Data type mismatch for column {column_name}.")
+
+        updated = set(positions)
+        for index in self.all_indexes():
+            if not index.unique or col_index not in index.column_positions:
+                continue
+            new_keys = set()
+            for position, value in zip(positions, values):
+                new_row = list(self.data[position])
+                new_row[col_index] = value
+                key = index.key(new_row)
+                if key in new_keys or any(pos not in updated for pos in index.lookup(key)):
+                    raise ValueError(f"Value {key} already exists in column {column_name}.")
+                new_keys.add(key)
+
+        if positions:
+            self.before_change()
+        prev_rows = []
+        for position, value in zip(positions, values):
+            row = self.data[position]
+            if self.tuple_rows:
+                prev_row = row
+                row = self.data[position] = row[:col_index] + (value,) + row[col_index + 1:]
+            else:
+                prev_row = row.copy()
+                row[col_index] = value
+            for index in self.all_indexes():
+                index.update(prev_row, row, position)
+            self.record_change('u', position, row)
+            prev_rows.append(prev_row)
+        return prev_rows
@@ -0,0 +1,105 @@
+from typing import Any, List, Tuple
+from operator import itemgetter
+
+from app.pydb.columnar import ArrayColumn, ColumnStore, DictionaryColumn, ObjectColumn
+
+# NumPy is optional. Without it, columns are scanned with the
+#  pure-Python routines of app.pydb.columnar.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _numpy_mask(column: ObjectColumn, value: Any):
+    '''
+    Returns a boolean mask of the rows of column that equal value, or None
+        if the column can't be compared with NumPy.
+
+    The typed arrays of the column are viewed by NumPy without copying.
+    '''
+    if isinstance(column, DictionaryColumn):
+        code = -1 if value is None else column.lookup.get(value)
+        if code is None:
+            return numpy.zeros(len(column), dtype=bool)
+        return numpy.frombuffer(column.codes, dtype=column.codes.typecode) == code
+
+    if not isinstance(column, ArrayColumn):
+        return None
+    if value is None:
+        if column.nulls is None:
+            return numpy.zeros(len(column), dtype=bool)
+        return numpy.frombuffer(column.nulls, dtype=numpy.uint8) != 0
+    if type(value) not in (int, float):
+        return None
+    if column.kind is int and type(value) is int and not column.fits(value):
+        return numpy.zeros(len(column), dtype=bool)
+
+    mask = numpy.frombuffer(column.values, dtype=column.values.typecode) == value
+    if column.nulls is not None:
+        mask &= numpy.frombuffer(column.nulls, dtype=numpy.uint8) == 0
+    return mask
+
+
+def _refine(store: ColumnStore, positions: List[int], conditions: List[Tuple[int, Any]]) -> List[int]:
+    '''
+    Keeps the positions whose rows equal the remaining conditions.
+    '''
+    for column_position, value in conditions:
+        column = store.columns[column_position]
+        positions = [position for position in positions if column.get(position) == value]
+    return positions
+
+
+def filter_positions(store: ColumnStore, conditions: List[Tuple[int, Any]]) -> List[int]:
+    '''
+    Returns the positions of the rows of a ColumnStore that equal every condition.
+
+    Each condition is evaluated over a whole column at once: as a NumPy mask
+        when NumPy is installed, otherwise by the column's own scan. Typed
+        columns are scanned first, and the conditions on columns of plain
+        objects are only checked for the rows that are left.
+
+    Parameters:
+        store (ColumnStore): The rows to filter.
+        conditions (List[Tuple[int, Any]]): (column position, value) pairs.
+
+    Returns:
+        List[int]: The matching positions, in table order.
+    '''
+    if not conditions:
+        return list(range(len(store)))
+    if not len(store):
+        return []
+
+    if numpy is not None:
+        mask = None
+        rest = []
+        for column_position, value in conditions:
+            column_mask = _numpy_mask(store.columns[column_position], value)
+            if column_mask is None:
+                rest.append((column_position, value))
+            elif mask is None:
+                mask = column_mask
+            else:
+                mask &= column_mask
+        if mask is not None:
+            return _refine(store, numpy.flatnonzero(mask).tolist(), rest)
+
+    first, *rest = sorted(conditions, key=lambda condition: type(store.columns[condition[0]]) is ObjectColumn)
+    return _refine(store, store.find(*first), rest)
+
+
+def filter_rows(rows, column_positions: List[int], values: List[Any]) -> List[List[Any]]:
+    '''
+    Returns the rows where every column in column_positions equals the matching value.
+
+    Works on any collection of rows. The columns of each row are fetched
+        and compared in a single step by `operator.itemgetter`, rather than
+        one at a time.
+    '''
+    if not column_positions:
+        return list(rows)
+    getter = itemgetter(*column_positions)
+    target = values[0] if len(column_positions) == 1 else tuple(values)
+    return [row for row in rows if getter(row) == target]
@@ -51,37 +51,42 @@ db.insert_into_table('seed_companies', ['Rijk Zwaan', 9])
 db.insert_into_table('seed_companies', ['Takii', 10])
 
 # Insert statements for contacts
-db.insert_into_table('contacts', ['John Doe', 1, 1])
-db.insert_into_table('contacts', ['John Doe', 50, 15])
-db.insert_into_table('contacts', ['Jane Smith', 2, 1])
-db.insert_into_table('contacts', ['Alice Johnson', 3, 2])
-db.insert_into_table('contacts', ['Bob Brown', 4, 2])
-db.insert_into_table('contacts', ['Charlie Davis', 5, 3])
-db.insert_into_table('contacts', ['Diana Evans', 6, 3])
-db.insert_into_table('contacts', ['Eve Foster', 7, 4])
-db.insert_into_table('contacts', ['Frank Green', 8, 4])
-db.insert_into_table('contacts', ['Grace Harris', 9, 5])
-db.insert_into_table('contacts', ['Hank Irving', 10, 5])
-db.insert_into_table('contacts', ['Ivy Johnson', 11, 6])
-db.insert_into_table('contacts', ['Jack King', 12, 6])
-db.insert_into_table('contacts', ['Kara Lee', 13, 7])
-db.insert_into_table('contacts', ['Leo Martin', 14, 7])
-db.insert_into_table('contacts', ['Mona Nelson', 15, 8])
-db.insert_into_table('contacts', ['Nina Owens', 16, 8])
-db.insert_into_table('contacts', ['Oscar Perry', 17, 9])
-db.insert_into_table('contacts', ['Pam Quinn', 18, 9])
-db.insert_into_table('contacts', ['Quincy Roberts', 19, 10])
-db.insert_into_table('contacts', ['Rachel Scott', 20, 10])
-db.insert_into_table('contacts', ['Sam Taylor', 21, 1])
-db.insert_into_table('contacts', ['Tina Underwood', 22, 2])
-db.insert_into_table('contacts', ['Uma Vance', 23, 3])
-db.insert_into_table('contacts', ['Victor White', 24, 4])
-db.insert_into_table('contacts', ['Wendy Xander', 25, 5])
-db.insert_into_table('contacts', ['Xander Young', 26, 6])
-db.insert_into_table('contacts', ['Yara Zane', 27, 7])
-db.insert_into_table('contacts', ['Zack Allen', 28, 8])
-db.insert_into_table('contacts', ['Amy Baker', 29, 9])
-db.insert_into_table('contacts', ['Brian Clark', 30, 10])
+# Contacts referencing a seed company that doesn't exist are rejected
+inserted, rejected = db.insert_many('contacts', [
+    ['John Doe', 1, 1],
+    ['John Doe', 50, 15],
+    ['Jane Smith', 2, 1],
+    ['Alice Johnson', 3, 2],
+    ['Bob Brown', 4, 2],
+    ['Charlie Davis', 5, 3],
+    ['Diana Evans', 6, 3],
+    ['Eve Foster', 7, 4],
+    ['Frank Green', 8, 4],
+    ['Grace Harris', 9, 5],
+    ['Hank Irving', 10, 5],
+    ['Ivy Johnson', 11, 6],
+    ['Jack King', 12, 6],
+    ['Kara Lee', 13, 7],
+    ['Leo Martin', 14, 7],
+    ['Mona Nelson', 15, 8],
+    ['Nina Owens', 16, 8],
+    ['Oscar Perry', 17, 9],
+    ['Pam Quinn', 18, 9],
+    ['Quincy Roberts', 19, 10],
+    ['Rachel Scott', 20, 10],
+    ['Sam Taylor', 21, 1],
+    ['Tina Underwood', 22, 2],
+    ['Uma Vance', 23, 3],
+    ['Victor White', 24, 4],
+    ['Wendy Xander', 25, 5],
+    ['Xander Young', 26, 6],
+    ['Yara Zane', 27, 7],
+    ['Zack Allen', 28, 8],
+    ['Amy Baker', 29, 9],
+    ['Brian Clark', 30, 10],
+])
+for position, row, reason in rejected:
+    print(f"Rejected {row}: {reason}")
 
 db.update_table('seed_companies', ['seed_company_id'], [11], 'seed_company_id', 2)
 
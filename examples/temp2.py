@@ -33,4 +33,4 @@ db.update_table('users', ['id'], [5], 'id', 1)
 
 db.delete_from_table('users', 'id', 2)
 
-print(db.select('users'))
\ No newline at end of file
+print(list(db.select('users')))
\ No newline at end of file
@@ -67,33 +67,40 @@ db.insert_into_table('posts', [1, 'aasdf43'])
 
 # Insert a comment with valid foreign keys
 db.insert_into_table('comments', [1, 1, 2, 'Nice post!'])
-comments = db.select('comments', [], {'comment_id': 1})
+comments = list(db.select('comments', [], {'comment_id': 1}))
 print("Comments after valid insert:", comments)
 # print("Comments after valid insert:", comments)
 
 # Attempt to insert a comment with an invalid post_id
-db.insert_into_table('comments', [2, 3, 1, 'Invalid post'])
+try:
+    db.insert_into_table('comments', [2, 3, 1, 'Invalid post'])
+except ValueError as e:
+    print("Rejected:", e)
 #comments = db.select('comments')
 # print("Comments after invalid post_id insert:", comments)
 
 # Attempt to insert a comment with an invalid user_id
-db.insert_into_table('comments', [3, 1, 3, 'Invalid user'])
+try:
+    db.insert_into_table('comments', [3, 1, 3, 'Invalid user'])
+except ValueError as e:
+    print("Rejected:", e)
 #comments = db.select('comments')
 # print("Comments after invalid user_id insert:", comments)
 
 # Delete a user and check cascading delete
 # db.delete_from_table('users', 'user_id', 1)
-users = db.select('users', [], {'user_id': 2})
+users = list(db.select('users', [], {'user_id': 2}))
 print("Users after delete:", users)
-posts = db.select('posts', [], {'user_id': 1})
+posts = list(db.select('posts', [], {'user_id': 1}))
 print("Posts after delete:", posts)
 # comments = db.select('comments')
 
 # join the users and posts tables on the user_id column where the user_id is 1
-db.join_tables('users', 'posts', {'user_id': 1})
+users_posts = db.join_tables('users', 'posts', {'user_id': 1}, on={'user_id': 'user_id'})
 
 # try to join joined_table with comments table on the post_id column where the post_id is 1
-db.join_tables('temp_users_posts', 'comments', {'post_id': 1})
+joined = db.join_tables(users_posts, 'comments', {'post_id': 1}, on={'post_id': 'post_id'})
+print("Joined:", joined.fetchall())
 # print(db.join_tables('users', 'posts', {'user_id': 1}))
 # db.tables.pop('temp_users_posts')
 